@@ -0,0 +1,58 @@
+"""Memory and speed of the in-memory due queue with many checks.
+
+Checks are added with random intervals and last checks over the past
+hour, then the due ones are taken and finished in batches the way the
+daemon does. Ids run from 1 unless ``--sparse`` spreads them at random
+up to 2**40::
+
+    python -m benchmarks.duequeue --checks 1000000 [--sparse]
+"""
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+
+from .probes import setup_django
+
+
+INTERVALS = (60, 120, 300, 600, 3600)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--checks', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--sparse', action='store_true')
+    args = parser.parse_args(argv)
+    with tempfile.NamedTemporaryFile(suffix='.sqlite3') as database:
+        setup_django(database.name)
+        from domainchecks.duequeue import DueQueue
+
+        now = time.time()
+        if args.sparse:
+            pks = random.sample(range(1, 2 ** 40), args.checks)
+        else:
+            pks = range(1, args.checks + 1)
+        tracemalloc.start()
+        start = time.time()
+        queue = DueQueue()
+        for pk in pks:
+            queue.add(pk, random.choice(INTERVALS), now - random.random() * 3600)
+        elapsed = time.time() - start
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{:>20} {:>12,}'.format('checks', len(queue)))
+        print('{:>20} {:>12.1f}'.format('load (s)', elapsed))
+        print('{:>20} {:>12.1f}'.format('memory (MB)', size / 2 ** 20))
+        print('{:>20} {:>12.1f}'.format('bytes per check', size / len(queue)))
+        start = time.time()
+        pks = queue.pop_due(now, limit=args.batch)
+        for pk in pks:
+            queue.finish(pk, now)
+        elapsed = time.time() - start
+        print('{:>20} {:>12.1f}'.format('take+finish (us)', elapsed / len(pks) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Local fake HTTP farm for benchmarking the probes.
+
+A threaded server which answers every request after a fixed latency. It
+listens on all loopback addresses so each of 127.0.0.x can stand in for a
+different host::
+
+    python -m benchmarks.farm --port 8100 --latency 0.1
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class FarmHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, body=True):
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            status, content = 500, b'Error'
+        else:
+            status, content = 200, b'Ok' * 512
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Farm(socketserver.ThreadingMixIn, HTTPServer):
+    """Fake web servers with a fixed response latency (in seconds)."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, latency=0.1, error_rate=0):
+        super().__init__(('', port), FarmHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def host(self, index):
+        """Loopback address and port standing in for the nth host."""
+        return '127.0.{}.{}:{}'.format(index // 250, index % 250 + 1, self.port)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve fake sites for the probes.')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument(
+        '--latency', type=float, default=0.1, help='Response time (in seconds).')
+    parser.add_argument(
+        '--error-rate', type=float, default=0, help='Share of requests which fail.')
+    args = parser.parse_args(argv)
+    farm = Farm(args.port, latency=args.latency, error_rate=args.error_rate)
+    print('Serving on port {}'.format(farm.port))
+    try:
+        farm.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
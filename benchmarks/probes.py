@@ -0,0 +1,88 @@
+"""Throughput of one probe worker process against the fake HTTP farm.
+
+Each domain has a single check and is run with the check_domain task the
+same way a worker runs it. Concurrency 1 matches a prefork worker process
+while higher values match the threads or green threads of a probe worker
+with a cooperative pool (with prefetch 1 each slot holds one task). Results
+are published to the memory backend so only the probing is measured::
+
+    python -m benchmarks.probes --domains 500 --latency 0.1 --concurrency 1 10 50
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .farm import Farm
+
+
+def setup_django(path):
+    os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(path)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'statuspage.settings.dev')
+    os.environ['DOMAINCHECKS_RESULT_BACKEND'] = 'domainchecks.results.MemoryBackend'
+    os.environ['PROCESS_TYPE'] = 'worker'
+    os.environ.setdefault('CACHE_URL', 'locmem://')
+    import django
+
+    django.setup()
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+
+
+def create_domains(farm, count):
+    from django.contrib.auth import get_user_model
+    from domainchecks.models import Domain, DomainCheck
+
+    owner = get_user_model().objects.create(username='benchmark')
+    names = []
+    for i in range(count):
+        domain = Domain.objects.create(name=farm.host(i), owner=owner)
+        DomainCheck.objects.create(domain=domain, path='/')
+        names.append(domain.name)
+    return names
+
+
+def run_tasks(names, concurrency, timeout):
+    from django.db import connection
+    from domainchecks import tasks
+
+    def run(name):
+        try:
+            tasks.check_domain(name, minutes=0, timeout=timeout)
+        finally:
+            connection.close()
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, names))
+    return time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--domains', type=int, default=200)
+    parser.add_argument(
+        '--latency', type=float, default=0.1, help='Farm response time (in seconds).')
+    parser.add_argument('--timeout', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100])
+    args = parser.parse_args(argv)
+    with tempfile.NamedTemporaryFile(suffix='.sqlite3') as database:
+        setup_django(database.name)
+        from domainchecks.results import get_backend
+
+        farm = Farm(latency=args.latency).start()
+        names = create_domains(farm, args.domains)
+        print('{:>12} {:>10} {:>12}'.format('concurrency', 'seconds', 'checks/sec'))
+        for concurrency in args.concurrency:
+            elapsed = run_tasks(names, concurrency, args.timeout)
+            get_backend().queue.clear()
+            print('{:>12} {:>10.2f} {:>12.1f}'.format(
+                concurrency, elapsed, len(names) / elapsed))
+        farm.shutdown()
+
+
+if __name__ == '__main__':
+    main()
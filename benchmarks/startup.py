@@ -0,0 +1,60 @@
+"""Cold start of a small checkdomains sweep with each process profile.
+
+Each run starts a new ``manage.py checkdomains`` process against the fake
+HTTP farm so the time is mostly interpreter start up, imports and app
+loading. The command profile loads every installed app while the probe
+profile (PROCESS_TYPE=probe) only loads what the checks need::
+
+    python -m benchmarks.startup --domains 10 --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .farm import Farm
+from .probes import create_domains, setup_django
+
+
+MANAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'manage.py')
+
+
+def run_sweep(process_type, runs):
+    env = dict(
+        os.environ, PROCESS_TYPE=process_type,
+        DOMAINCHECKS_RESULT_BACKEND='domainchecks.results.DatabaseBackend')
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call(
+            [sys.executable, MANAGE, 'checkdomains', '--minutes', '0', '--verbosity', '0'],
+            env=env, stderr=subprocess.DEVNULL)
+        times.append(time.time() - start)
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--domains', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument(
+        '--profiles', nargs='+', default=['command', 'probe'],
+        help='Values of PROCESS_TYPE to compare.')
+    args = parser.parse_args(argv)
+    with tempfile.NamedTemporaryFile(suffix='.sqlite3') as database:
+        setup_django(database.name)
+        farm = Farm(latency=0).start()
+        create_domains(farm, args.domains)
+        print('{:>10} {:>10} {:>10}'.format('profile', 'best', 'median'))
+        for process_type in args.profiles:
+            times = run_sweep(process_type, args.runs)
+            print('{:>10} {:>10.3f} {:>10.3f}'.format(
+                process_type, min(times), statistics.median(times)))
+        farm.shutdown()
+
+
+if __name__ == '__main__':
+    main()
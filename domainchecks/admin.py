@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.timesince import timesince
 
-from . import models
+from . import models, results, routers
 
 
 class StatusListFilter(admin.SimpleListFilter):
@@ -21,6 +21,19 @@ class StatusListFilter(admin.SimpleListFilter):
             return queryset.filter(status=self.value())
 
 
+class ReplicaChangeListMixin(object):
+    """Read the change list from a replica."""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context=extra_context)
+        with routers.replica_reads(not routers.is_pinned(request)):
+            response = super().changelist_view(request, extra_context=extra_context)
+            if callable(getattr(response, 'render', None)):
+                response.render()
+            return response
+
+
 @admin.register(models.Domain)
 class DomainAdmin(admin.ModelAdmin):
 
@@ -29,8 +42,15 @@ class DomainAdmin(admin.ModelAdmin):
     search_fields = ('name', )
 
 
+@admin.register(models.OwnerQuota)
+class OwnerQuotaAdmin(admin.ModelAdmin):
+
+    list_display = ('owner', 'probes_per_minute', 'weight', )
+    search_fields = ('owner__username', )
+
+
 @admin.register(models.DomainCheck)
-class DomainCheckAdmin(admin.ModelAdmin):
+class DomainCheckAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
 
     list_display = (
         'domain', 'path', 'protocol', 'method', 'is_active',
@@ -56,6 +76,7 @@ class DomainCheckAdmin(admin.ModelAdmin):
     def run_check(self, request, queryset):
         for item in queryset:
             item.run_check()
+        results.get_backend().flush()
     run_check.short_description = 'Run the domain check'
 
     def mark_inactive(self, request, queryset):
@@ -68,8 +89,8 @@ class DomainCheckAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.CheckResult)
-class CheckResultAdmin(admin.ModelAdmin):
+class CheckResultAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
 
     date_hierarchy = 'checked_on'
-    list_display = ('domain_check', 'status_code', )
+    list_display = ('domain_check', 'status_code', 'count', )
     list_filter = ('checked_on', )
@@ -0,0 +1,142 @@
+"""Standalone probe agent.
+
+Agents run the checks away from the main deployment so results can be
+measured from several regions. Each agent pulls a batch of due checks from
+the status page, probes them concurrently and pushes the results back in a
+single request. The region is decided by the server from the agent's key.
+
+This doesn't need Django, only requests. To try it locally start the
+development server and run an agent for each of the keys configured in
+the development settings::
+
+    python manage.py runserver
+    python -m domainchecks.agent --key local-east
+    python -m domainchecks.agent --key local-west
+"""
+import argparse
+import collections
+import logging
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import probes
+
+
+logger = logging.getLogger(__name__)
+
+
+class Agent(object):
+    """Pull checks, probe them and push the results."""
+
+    def __init__(self, server, key, concurrency=10, limit=100, timeout=10,
+                 breaker=None):
+        self.server = server.rstrip('/')
+        self.breaker = breaker
+        self.limit = limit
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'Token {}'.format(key)
+
+    def fetch_checks(self):
+        """Get the next batch of due checks from the server."""
+        response = self.session.get(
+            self.server + '/agent/checks/', params={'limit': self.limit},
+            timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        Check = collections.namedtuple('Check', data['fields'])
+        return [Check(*values) for values in data['checks']]
+
+    def run_check(self, check):
+        """Probe a single check and return its result record."""
+        started = time.time()
+        result = probes.probe(
+            check, timeout=self.timeout, max_bytes=check.max_bytes,
+            breaker=self.breaker)
+        return [
+            check.id, started, result.status_code, result.response_time,
+            result.response_body, result.assertion_passed,
+        ]
+
+    def push_results(self, records):
+        """Send the result records back to the server."""
+        response = self.session.post(
+            self.server + '/agent/results/', json={'results': records},
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def run_once(self, pool):
+        """Run one batch of checks and return how many were probed."""
+        checks = self.fetch_checks()
+        if checks:
+            records = list(pool.map(self.run_check, checks))
+            outcome = self.push_results(records)
+            logger.info(
+                'Probed %d check(s): %d accepted', len(records), outcome['accepted'])
+        return len(checks)
+
+    def run(self, poll=5, once=False):
+        """Probe checks until stopped, waiting when none are due."""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while True:
+                try:
+                    count = self.run_once(pool)
+                except requests.exceptions.RequestException as e:
+                    logger.warning('Could not reach %s: %s', self.server, e)
+                    count = 0
+                if once:
+                    break
+                if count < self.limit:
+                    time.sleep(poll)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run domain checks for a status page.')
+    parser.add_argument(
+        '--server', default=os.environ.get('PROBE_SERVER', 'http://localhost:8000'),
+        help='Base URL of the status page.')
+    parser.add_argument(
+        '--key', default=os.environ.get('PROBE_AGENT_KEY'),
+        help='Agent key which identifies the region.')
+    parser.add_argument(
+        '--concurrency', type=int, default=10,
+        help='Number of checks to run at the same time.')
+    parser.add_argument(
+        '--limit', type=int, default=100, help='Checks to fetch per batch.')
+    parser.add_argument(
+        '--timeout', type=int, default=10,
+        help='Timeout for server response (in seconds).')
+    parser.add_argument(
+        '--poll', type=int, default=5,
+        help='Time to wait when no checks are due (in seconds).')
+    parser.add_argument(
+        '--breaker-threshold', type=int, default=5,
+        help='Connection failures before a host is skipped (0 to disable).')
+    parser.add_argument(
+        '--breaker-reset', type=int, default=60,
+        help='Time between canary requests to a failing host (in seconds).')
+    parser.add_argument(
+        '--once', action='store_true', help='Run a single batch and exit.')
+    args = parser.parse_args(argv)
+    if not args.key:
+        parser.error('An agent key is required.')
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s: %(levelname)s/%(name)s] - %(message)s')
+    breaker = None
+    if args.breaker_threshold:
+        breaker = probes.CircuitBreaker(args.breaker_threshold, args.breaker_reset)
+    agent = Agent(
+        args.server, args.key, concurrency=args.concurrency,
+        limit=args.limit, timeout=args.timeout, breaker=breaker)
+    agent.run(poll=args.poll, once=args.once)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Alerts on check status changes.
+
+When results are recorded only the checks they belong to are evaluated:
+their success rate over the last DOMAINCHECKS_ALERT_WINDOW seconds is read
+from the status buckets and fed to their ``CheckState``. Transitions are
+written to the ``AlertEvent`` outbox in the same transaction as the new
+state and the ``deliver_alerts`` task hands them to the notifiers in
+DOMAINCHECKS_ALERT_NOTIFIERS in batches. Events are delivered at least
+once: a batch is retried if any notifier fails.
+"""
+import datetime
+import json
+import logging
+
+import requests
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from .models import AlertEvent, CheckState, DomainCheck
+from .signals import results_recorded
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_states(checks):
+    """Lock the states of the checks, creating the missing ones."""
+    states = dict((s.pk, s) for s in CheckState.objects.select_for_update().filter(pk__in=checks))
+    for check in set(checks) - set(states):
+        try:
+            with transaction.atomic():
+                states[check] = CheckState.objects.create(domain_check_id=check)
+        except IntegrityError:
+            # Created by another worker in the meantime
+            states[check] = CheckState.objects.select_for_update().get(pk=check)
+    return states
+
+
+def evaluate_checks(checks, when=None):
+    """Update the alert states of the checks and queue any alerts."""
+    when = when or now()
+    window = datetime.timedelta(seconds=settings.DOMAINCHECKS_ALERT_WINDOW)
+    events = []
+    with transaction.atomic():
+        existing = DomainCheck.objects.filter(pk__in=checks)
+        states = get_states(list(existing.values_list('pk', flat=True)))
+        # Read after locking so concurrent evaluations of a check are in order
+        rates = dict(existing.status(cutoff=window).values_list('pk', 'success_rate'))
+        for check, rate in sorted(rates.items()):
+            state = states[check]
+            previous = state.status
+            kind = state.evaluate(rate, when)
+            state.save()
+            if kind is not None:
+                events.append(AlertEvent(
+                    domain_check_id=check, kind=kind, previous_status=previous,
+                    status=state.status, success_rate=rate, created_on=when))
+        AlertEvent.objects.bulk_create(events)
+    return len(events)
+
+
+@receiver(results_recorded)
+def evaluate_results(sender, results, **kwargs):
+    evaluate_checks(set(result.domain_check_id for result in results))
+
+
+def serialize(event):
+    return {
+        'id': event.pk,
+        'check': event.domain_check_id,
+        'domain': event.domain_check.domain.name,
+        'url': event.domain_check.url,
+        'kind': event.kind,
+        'previous_status': event.previous_status,
+        'status': event.status,
+        'success_rate': event.success_rate,
+        'created_on': event.created_on,
+    }
+
+
+class LogNotifier(object):
+    """Log each alert."""
+
+    def send(self, alerts):
+        for alert in alerts:
+            logger.warning(
+                'Check %(check)s (%(url)s) %(kind)s: %(previous_status)s -> %(status)s',
+                alert)
+
+
+class FileNotifier(object):
+    """Append alerts as JSON lines to DOMAINCHECKS_ALERT_FILE."""
+
+    def send(self, alerts):
+        with open(settings.DOMAINCHECKS_ALERT_FILE, 'a') as f:
+            for alert in alerts:
+                f.write(json.dumps(alert, cls=DjangoJSONEncoder) + '\n')
+
+
+class WebhookNotifier(object):
+    """POST each batch of alerts as JSON to DOMAINCHECKS_ALERT_WEBHOOK."""
+
+    timeout = 10
+
+    def send(self, alerts):
+        response = requests.post(
+            settings.DOMAINCHECKS_ALERT_WEBHOOK,
+            data=json.dumps({'alerts': alerts}, cls=DjangoJSONEncoder),
+            headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+def get_notifiers():
+    return [import_string(path)() for path in settings.DOMAINCHECKS_ALERT_NOTIFIERS]
+
+
+def deliver_alerts(batch_size=100):
+    """Send the queued alerts to the notifiers in batches.
+
+    Returns the number of alerts delivered. Undelivered alerts stay in the
+    outbox for the next run when a notifier fails.
+    """
+    notifiers = get_notifiers()
+    delivered = 0
+    while True:
+        events = list(AlertEvent.objects.filter(delivered_on__isnull=True).select_related(
+            'domain_check__domain').order_by('pk')[:batch_size])
+        if not events:
+            break
+        alerts = [serialize(event) for event in events]
+        for notifier in notifiers:
+            try:
+                notifier.send(alerts)
+            except Exception:
+                logger.exception('Failed to send %d alert(s) with %r', len(alerts), notifier)
+                return delivered
+        AlertEvent.objects.filter(pk__in=[e.pk for e in events]).update(delivered_on=now())
+        delivered += len(events)
+    return delivered
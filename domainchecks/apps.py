@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class DomainChecksConfig(AppConfig):
+    name = 'domainchecks'
+
+    def ready(self):
+        # Connect the live update and alert receivers
+        from . import alerts, updates  # noqa
@@ -0,0 +1,199 @@
+"""Cold archive of old check results.
+
+Results older than DOMAINCHECKS_ARCHIVE_AFTER days are moved out of the
+database into one file per check and month under DOMAINCHECKS_ARCHIVE_DIR.
+Each file holds fixed-width little-endian records sorted by ``checked_on``
+so readers memory-map it and find the start of a time range by bisection
+instead of loading it. The response body isn't archived.
+"""
+import bisect
+import datetime
+import math
+import mmap
+import os
+import struct
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import utc
+
+from . import export
+from .export import result_batches
+from .models import CheckResult
+
+
+# id, checked_on, last_checked_on, count, status_code, response_time,
+# response_time_min, response_time_max, assertion_passed, region
+RECORD = struct.Struct('<qddIhdddb50s')
+
+FIELDS = (
+    'id', 'checked_on', 'last_checked_on', 'count', 'status_code', 'response_time',
+    'response_time_min', 'response_time_max', 'assertion_passed', 'region', )
+
+
+def month_start(value):
+    return value.astimezone(utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def archive_path(check, month):
+    return os.path.join(
+        settings.DOMAINCHECKS_ARCHIVE_DIR, str(check), '{:%Y-%m}.bin'.format(month))
+
+
+def pack(row):
+    """Encode a row of FIELDS values as a record."""
+    (pk, checked_on, last_checked_on, count, status_code, response_time,
+     response_time_min, response_time_max, passed, region) = row
+    return RECORD.pack(
+        pk, checked_on.timestamp(), last_checked_on.timestamp(), count,
+        -1 if status_code is None else status_code,
+        math.nan if response_time is None else response_time,
+        math.nan if response_time_min is None else response_time_min,
+        math.nan if response_time_max is None else response_time_max,
+        -1 if passed is None else passed,
+        region.encode('utf-8'))
+
+
+def unpack(record):
+    """Decode a record into a dict of FIELDS values."""
+    values = dict(zip(FIELDS, RECORD.unpack(record)))
+    for field in ('checked_on', 'last_checked_on'):
+        values[field] = datetime.datetime.fromtimestamp(values[field], tz=utc)
+    for field in ('status_code', 'assertion_passed'):
+        if values[field] == -1:
+            values[field] = None
+    for field in ('response_time', 'response_time_min', 'response_time_max'):
+        if math.isnan(values[field]):
+            values[field] = None
+    if values['assertion_passed'] is not None:
+        values['assertion_passed'] = bool(values['assertion_passed'])
+    values['region'] = values['region'].rstrip(b'\0').decode('utf-8', 'ignore')
+    return values
+
+
+class ArchiveFile(object):
+    """Memory-mapped records of one check and month."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """The ``checked_on`` timestamp of a record, for bisection."""
+        return struct.unpack_from('<d', self.data, index * RECORD.size + 8)[0]
+
+    def record(self, index):
+        return self.data[index * RECORD.size:(index + 1) * RECORD.size]
+
+    def records(self, start=0, stop=None):
+        for index in range(start, self.count if stop is None else stop):
+            yield self.record(index)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_month(check, month, rows):
+    """Merge rows into the check's file for the month.
+
+    Records already in the file are kept once so an archive run which was
+    interrupted before deleting the rows can be repeated.
+    """
+    path = archive_path(check, month)
+    records = dict((RECORD.unpack_from(record)[0], record) for record in map(pack, rows))
+    if os.path.exists(path):
+        with ArchiveFile(path) as existing:
+            for record in existing.records():
+                records.setdefault(RECORD.unpack_from(record)[0], record)
+    ordered = sorted(records.values(), key=lambda r: RECORD.unpack_from(r)[1::-1])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(b''.join(ordered))
+    os.replace(path + '.tmp', path)
+
+
+def delete_rows(pks, batch_size=500):
+    for i in range(0, len(pks), batch_size):
+        CheckResult.objects.filter(pk__in=pks[i:i + batch_size]).delete()
+
+
+def archive_results(before):
+    """Move the results which started before the given time into the archive."""
+    moved = 0
+    old = CheckResult.objects.filter(checked_on__lt=before)
+    for check in old.order_by().values_list('domain_check', flat=True).distinct():
+        month, rows = None, []
+        for batch in result_batches(old.filter(domain_check=check), fields=FIELDS):
+            for row in batch:
+                if month is not None and month_start(row[1]) != month:
+                    moved += move_month(check, month, rows)
+                    rows = []
+                month = month_start(row[1])
+                rows.append(row)
+        if rows:
+            moved += move_month(check, month, rows)
+    return moved
+
+
+def move_month(check, month, rows):
+    write_month(check, month, rows)
+    with transaction.atomic():
+        delete_rows([row[0] for row in rows])
+    return len(rows)
+
+
+def export_rows(check, start, end):
+    """Archived results of the check which started in [start, end), oldest first.
+
+    Rows hold the export fields in (checked_on, id) order with an empty
+    response body.
+    """
+    month = month_start(start)
+    while month < end:
+        path = archive_path(check, month)
+        if os.path.exists(path):
+            with ArchiveFile(path) as archived:
+                first = bisect.bisect_left(archived, start.timestamp())
+                last = bisect.bisect_left(archived, end.timestamp())
+                for record in archived.records(first, last):
+                    values = unpack(record)
+                    values.update(domain_check=check, response_body='')
+                    yield tuple(values[field] for field in export.FIELDS)
+        month = next_month(month)
+
+
+def read_results(check, start, end):
+    """Archived results of the check which overlap the time range, newest first."""
+    # Runs can start up to the longest span before the range
+    earliest = start - datetime.timedelta(seconds=settings.DOMAINCHECKS_COMPACT_MAX_SPAN)
+    results = []
+    month = month_start(earliest)
+    while month <= end:
+        path = archive_path(check, month)
+        if os.path.exists(path):
+            with ArchiveFile(path) as archived:
+                first = bisect.bisect_left(archived, earliest.timestamp())
+                last = bisect.bisect_right(archived, end.timestamp())
+                for record in archived.records(first, last):
+                    values = unpack(record)
+                    if values['last_checked_on'] >= start:
+                        results.append(values)
+        month = next_month(month)
+    results.reverse()
+    return results
@@ -0,0 +1,129 @@
+"""Run the checks continuously from a single long-running process.
+
+This is an alternative to Celery for small deployments::
+
+    python manage.py checkdomains --daemon --concurrency 20
+
+The due checks are taken from a ``DueQueue`` and probed by a bounded pool
+of threads. Each thread keeps its own HTTP session and database
+connection open between checks. The queue is refreshed from the database
+every ``refresh`` seconds and the checks are loaded as they become due so
+changes to them are picked up on their next run. Database errors while
+reading the checks, such as during a failover, are logged and retried
+with a growing delay rather than stopping the daemon.
+"""
+import logging
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from django.db import DatabaseError, connection
+from django.utils.timezone import now
+
+from .duequeue import DueQueue, refresh
+from .models import DomainCheck
+from .results import get_backend
+
+
+logger = logging.getLogger(__name__)
+
+# Longest time (in seconds) the loop waits before looking for a stop
+POLL_INTERVAL = 1
+
+# Longest delay (in seconds) between attempts to read the checks when the
+# database can't be reached
+MAX_BACKOFF = 60
+
+_local = threading.local()
+
+
+def load_checks(queue, pks):
+    """Load the checks taken from the queue, dropping the inactive ones."""
+    if not pks:
+        return []
+    checks = list(DomainCheck.objects.active().filter(pk__in=pks).select_related('domain'))
+    for pk in set(pks) - set(check.pk for check in checks):
+        queue.remove(pk)
+    return checks
+
+
+def take_checks(queue, limit):
+    """Take and load up to limit due checks, putting them back on errors."""
+    pks = queue.pop_due(time.time(), limit)
+    try:
+        return load_checks(queue, pks)
+    except DatabaseError:
+        for pk in pks:
+            queue.release(pk)
+        raise
+
+
+def get_session():
+    """HTTP session of the current thread."""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def run_check(check, timeout):
+    """Probe a check from a pool thread and return when it finished."""
+    try:
+        check.run_check(timeout=timeout, session=get_session())
+    except DatabaseError:
+        logger.exception('Unable to record the result of check %s', check.pk)
+        # The next check opens a new connection in case this one was lost
+        connection.close()
+    except Exception:
+        logger.exception('Unable to run check %s', check.pk)
+    return now()
+
+
+def run(concurrency=10, timeout=10, refresh_interval=30, stop=None):
+    """Probe the checks as they become due until ``stop`` is set.
+
+    At most ``concurrency`` checks run at the same time. Checks which are
+    running when the daemon stops are finished first. Returns the number
+    of checks run.
+    """
+    stop = stop or threading.Event()
+    queue = DueQueue()
+    pending = {}
+    count = 0
+    refreshed = None
+    backoff = POLL_INTERVAL
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while not stop.is_set():
+            try:
+                if refreshed is None or time.time() >= refreshed + refresh_interval:
+                    loaded = refresh(queue)
+                    refreshed = time.time()
+                    logger.debug('Loaded %d of %d check(s)', loaded, len(queue))
+                checks = take_checks(queue, concurrency - len(pending))
+            except DatabaseError:
+                logger.exception('Unable to read the checks, retrying in %d second(s)', backoff)
+                connection.close()
+                stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = POLL_INTERVAL
+            for check in checks:
+                pending[pool.submit(run_check, check, timeout)] = check.pk
+            wake = refreshed + refresh_interval
+            due = queue.next_due()
+            if due is not None and len(pending) < concurrency:
+                wake = min(wake, due)
+            delay = min(max(wake - time.time(), 0), POLL_INTERVAL)
+            if not pending:
+                stop.wait(delay)
+                continue
+            done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                queue.finish(pending.pop(future), future.result().timestamp())
+                count += 1
+            get_backend().flush()
+    count += len(pending)
+    get_backend().flush()
+    return count
@@ -0,0 +1,236 @@
+"""In-memory queue of the active checks ordered by their next due time.
+
+The queue only holds what is needed to schedule a check. That is its
+interval, the time it was last checked and when it is next due, kept in
+arrays of slots. Each check is given a slot when it is added and the
+slots of removed checks are reused, so the memory used depends on the
+number of checks rather than the size of their ids. A heap orders the
+slots by due time, from ``scheduling.next_due``, so taking the next due
+check costs O(log n). Each heap entry is a single integer that packs the
+due time in milliseconds with the slot. A million checks take about
+170 MB whatever their ids.
+
+Entries left behind when a check is rescheduled or removed are skipped
+when they come up. Checks which have been taken from the queue have no
+entry until they are finished or released.
+
+``refresh`` brings a queue up to date with the active checks in the
+database. After the first load only the checks changed since the last
+refresh are read. Deleted checks are removed when they are next taken and
+aren't found. Both the daemon mode of ``checkdomains`` and ``queue_domains``
+(with DOMAINCHECKS_DUE_QUEUE) take their due checks from a queue. Each
+process has its own queue, loaded from the database when it is first
+used.
+"""
+import array
+import datetime
+import heapq
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from . import scheduling
+from .models import DomainCheck
+
+
+SLOT_BITS = 32
+
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+# Due time of checks which have no entry in the heap
+NOT_DUE = -1
+
+
+class DueQueue(object):
+    """Active checks by the time they are next due."""
+
+    def __init__(self):
+        # Slot of each check in the arrays
+        self.slots = {}
+        # Id, interval, timestamp of the last check (0 for checks which have
+        # never run) and due time (in milliseconds) of the heap entry of the
+        # check in each slot
+        self.ids = array.array('q')
+        self.intervals = array.array('I')
+        self.last_checked = array.array('d')
+        self.due = array.array('q')
+        # Slots left by removed checks
+        self.free = array.array('I')
+        self.heap = []
+        # Time of the last refresh from the database
+        self.refreshed_on = None
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, pk):
+        return pk in self.slots
+
+    def __iter__(self):
+        return iter(list(self.slots))
+
+    def interval(self, pk):
+        return self.intervals[self.slots[pk]]
+
+    def last_check(self, pk):
+        """Timestamp of the check's last run or 0 if it has never run."""
+        return self.last_checked[self.slots[pk]]
+
+    def is_taken(self, pk):
+        return pk in self.slots and self.due[self.slots[pk]] == NOT_DUE
+
+    def new_slot(self, pk):
+        """Give the check a free slot or a new one."""
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = len(self.ids)
+            if slot > SLOT_MASK:
+                raise ValueError('At most {} checks fit in a queue.'.format(SLOT_MASK + 1))
+            self.ids.append(0)
+            self.intervals.append(0)
+            self.last_checked.append(0)
+            self.due.append(NOT_DUE)
+        self.slots[pk] = slot
+        self.ids[slot] = pk
+        return slot
+
+    def add(self, pk, interval, last_check=None):
+        """Add a check or change its interval and last check.
+
+        ``last_check`` is a timestamp. It is left as it is for checks which
+        are already in the queue when it isn't given. Taken checks are
+        scheduled when they are finished.
+        """
+        taken = self.is_taken(pk)
+        slot = self.slots.get(pk)
+        if slot is None:
+            slot = self.new_slot(pk)
+        self.intervals[slot] = interval
+        if last_check is not None:
+            self.last_checked[slot] = last_check
+        if not taken:
+            self.schedule(slot)
+
+    def remove(self, pk):
+        slot = self.slots.pop(pk, None)
+        if slot is not None:
+            self.ids[slot] = 0
+            self.intervals[slot] = 0
+            self.last_checked[slot] = 0
+            self.due[slot] = NOT_DUE
+            self.free.append(slot)
+
+    def schedule(self, slot):
+        """Push the due time of the check in the slot from its last check."""
+        last_check = self.last_checked[slot]
+        due = 0
+        if last_check:
+            due = int(scheduling.due_timestamp(
+                self.ids[slot], self.intervals[slot], last_check) * 1000)
+        if due != self.due[slot]:
+            self.due[slot] = due
+            heapq.heappush(self.heap, due << SLOT_BITS | slot)
+            if len(self.heap) > 2 * len(self.slots) + 1000:
+                self.compact()
+
+    def compact(self):
+        """Drop the heap entries which are no longer in use."""
+        self.heap = [
+            entry for entry in self.heap
+            if self.due[entry & SLOT_MASK] == entry >> SLOT_BITS]
+        heapq.heapify(self.heap)
+
+    def discard(self):
+        """Drop the unused entries from the top of the heap."""
+        heap = self.heap
+        while heap and self.due[heap[0] & SLOT_MASK] != heap[0] >> SLOT_BITS:
+            heapq.heappop(heap)
+
+    def next_due(self):
+        """Timestamp when the next check is due or None if there are none."""
+        self.discard()
+        return (self.heap[0] >> SLOT_BITS) / 1000 if self.heap else None
+
+    def pop_due(self, when, limit=None):
+        """Take the ids of up to limit checks which are due by the timestamp."""
+        cutoff = int(when * 1000)
+        pks = []
+        self.discard()
+        while self.heap and (self.heap[0] >> SLOT_BITS) <= cutoff:
+            if limit is not None and len(pks) >= limit:
+                break
+            slot = heapq.heappop(self.heap) & SLOT_MASK
+            self.due[slot] = NOT_DUE
+            pks.append(self.ids[slot])
+            self.discard()
+        return pks
+
+    def finish(self, pk, last_check):
+        """Schedule a taken check from when it was last checked.
+
+        ``last_check`` is a timestamp or None if the check hasn't run.
+        """
+        slot = self.slots.get(pk)
+        if slot is not None:
+            self.last_checked[slot] = last_check or 0
+            self.schedule(slot)
+
+    def release(self, pk):
+        """Put a taken check back at its due time."""
+        if self.is_taken(pk):
+            self.schedule(self.slots[pk])
+
+
+def timestamp(value):
+    return None if value is None else value.timestamp()
+
+
+def refresh(queue, batch_size=500):
+    """Bring the queue up to date with the active checks.
+
+    Checks are added with the time of their latest result and the ones
+    which are no longer active are removed. Returns the number of checks
+    which were added or changed.
+    """
+    started = now()
+    if queue.refreshed_on is None:
+        rows = DomainCheck.objects.active().last_checked().values_list(
+            'pk', 'interval', 'last_check')
+        for pk, interval, last_check in rows.iterator():
+            queue.add(pk, interval, timestamp(last_check))
+        queue.refreshed_on = started
+        return len(queue)
+    since = queue.refreshed_on - datetime.timedelta(
+        seconds=settings.DOMAINCHECKS_CHANGES_OVERLAP)
+    changed = 0
+    new = []
+    rows = DomainCheck.objects.changed_since(since).values_list('pk', 'interval', 'is_active')
+    for pk, interval, is_active in rows.iterator():
+        if not is_active:
+            queue.remove(pk)
+        elif pk not in queue:
+            new.append((pk, interval))
+        elif queue.interval(pk) != interval:
+            queue.add(pk, interval)
+            changed += 1
+    for i in range(0, len(new), batch_size):
+        batch = dict(new[i:i + batch_size])
+        last_checked = dict(DomainCheck.objects.filter(
+            pk__in=list(batch)).last_checked().values_list('pk', 'last_check'))
+        for pk, interval in batch.items():
+            queue.add(pk, interval, timestamp(last_checked.get(pk)))
+    queue.refreshed_on = started
+    return changed + len(new)
+
+
+_queue = None
+
+
+def get_queue():
+    """Return this process's due queue, up to date with the database."""
+    global _queue
+    if _queue is None:
+        _queue = DueQueue()
+    refresh(_queue)
+    return _queue
@@ -0,0 +1,199 @@
+"""Bulk export of check results.
+
+Results are read in batches ordered by (``checked_on``, ``id``) and each
+batch starts after the last row of the previous one, so every query is
+as cheap as the first and only one batch is held in memory at a time.
+Results which have been moved to the archive are merged in, in the same
+order, without their response body.
+The batches are written out as CSV, JSON lines or a compact columnar
+binary format which can be read back with ``read_columnar``.
+"""
+import array
+import csv
+import heapq
+import io
+import json
+import math
+import struct
+import sys
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .models import CheckResult
+
+
+FIELDS = (
+    'id', 'domain_check', 'checked_on', 'last_checked_on', 'count',
+    'status_code', 'response_time', 'response_time_min', 'response_time_max',
+    'assertion_passed', 'region', 'response_body', )
+
+
+def result_batches(queryset, batch_size=None, fields=FIELDS):
+    """Yield lists of result rows in (checked_on, id) order."""
+    batch_size = batch_size or settings.DOMAINCHECKS_EXPORT_BATCH_SIZE
+    queryset = queryset.order_by('checked_on', 'pk').values_list(*fields)
+    pk, checked_on = fields.index('id'), fields.index('checked_on')
+    page = queryset
+    while True:
+        batch = list(page[:batch_size])
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            break
+        last_pk, last_on = batch[-1][pk], batch[-1][checked_on]
+        page = queryset.filter(
+            Q(checked_on__gt=last_on) | Q(checked_on=last_on, pk__gt=last_pk))
+
+
+def merge_archived(batches, checks, start, end, batch_size=None):
+    """Merge the archived results of the checks into the result batches.
+
+    Rows are kept in (checked_on, id) order and results found in both,
+    from an archive run which was interrupted, are only given once.
+    """
+    from . import archive
+
+    batch_size = batch_size or settings.DOMAINCHECKS_EXPORT_BATCH_SIZE
+    pk, checked_on = FIELDS.index('id'), FIELDS.index('checked_on')
+    archived = [
+        archive.export_rows(getattr(check, 'pk', check), start, end) for check in checks]
+    stored = (row for batch in batches for row in batch)
+    rows = heapq.merge(stored, *archived, key=lambda row: (row[checked_on], row[pk]))
+    batch, last = [], None
+    for row in rows:
+        if row[pk] == last:
+            continue
+        last = row[pk]
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CSVFormat(object):
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def write(self, rows):
+        output = io.StringIO()
+        csv.writer(output).writerows(rows)
+        return output.getvalue().encode('utf-8')
+
+    def chunks(self, batches):
+        yield self.write([FIELDS])
+        for batch in batches:
+            yield self.write(
+                [value.isoformat() if hasattr(value, 'isoformat') else value
+                 for value in row] for row in batch)
+
+
+class JSONLinesFormat(object):
+    content_type = 'application/x-ndjson'
+    extension = 'jsonl'
+
+    def chunks(self, batches):
+        for batch in batches:
+            yield ''.join(
+                json.dumps(dict(zip(FIELDS, row)), cls=DjangoJSONEncoder) + '\n'
+                for row in batch).encode('utf-8')
+
+
+# Array typecodes of the numeric columns, text columns have none. Missing
+# numbers are stored as -1 in the integer columns and NaN in the floats.
+COLUMNS = (
+    ('id', 'q'), ('domain_check', 'q'), ('checked_on', 'd'), ('last_checked_on', 'd'),
+    ('count', 'q'), ('status_code', 'q'), ('response_time', 'd'),
+    ('response_time_min', 'd'), ('response_time_max', 'd'),
+    ('assertion_passed', 'b'), ('region', None), ('response_body', None), )
+
+MAGIC = b'DCRX1\n'
+
+
+class ColumnarFormat(object):
+    """Little-endian column blocks, one for each batch.
+
+    The file starts with ``MAGIC`` and each block with its number of rows
+    as an unsigned 32 bit integer. Numeric columns follow as packed arrays
+    with times as POSIX timestamps. Text columns are the end offset of
+    each value as unsigned 32 bit integers followed by the UTF-8 data.
+    """
+
+    content_type = 'application/octet-stream'
+    extension = 'dcrx'
+
+    def pack(self, values, typecode):
+        packed = array.array(typecode, values)
+        if sys.byteorder != 'little':
+            packed.byteswap()
+        return packed.tobytes()
+
+    def encode(self, value, typecode):
+        if value is None:
+            return math.nan if typecode == 'd' else -1
+        if hasattr(value, 'timestamp'):
+            return value.timestamp()
+        return int(value) if typecode != 'd' else value
+
+    def chunks(self, batches):
+        yield MAGIC
+        for batch in batches:
+            block = [struct.pack('<I', len(batch))]
+            for i, (name, typecode) in enumerate(COLUMNS):
+                if typecode is None:
+                    data = [row[i].encode('utf-8') for row in batch]
+                    offsets, end = [], 0
+                    for value in data:
+                        end += len(value)
+                        offsets.append(end)
+                    block.append(self.pack(offsets, 'I'))
+                    block.extend(data)
+                else:
+                    block.append(self.pack(
+                        (self.encode(row[i], typecode) for row in batch), typecode))
+            yield b''.join(block)
+
+
+def read_columnar(stream):
+    """Yield dicts of column arrays for each block of a columnar export."""
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a columnar result export.')
+    while True:
+        header = stream.read(4)
+        if not header:
+            break
+        rows, = struct.unpack('<I', header)
+        block = {}
+        for name, typecode in COLUMNS:
+            column = array.array(typecode or 'I')
+            column.frombytes(stream.read(column.itemsize * rows))
+            if sys.byteorder != 'little':
+                column.byteswap()
+            if typecode is None:
+                data = stream.read(column[-1] if rows else 0)
+                starts = [0] + list(column[:-1])
+                column = [data[s:e].decode('utf-8') for s, e in zip(starts, column)]
+            block[name] = column
+        yield block
+
+
+FORMATS = {
+    'csv': CSVFormat,
+    'jsonl': JSONLinesFormat,
+    'columnar': ColumnarFormat,
+}
+
+
+def export_results(checks, start, end, format='csv', batch_size=None, using=None):
+    """Yield the encoded results of the checks which started in [start, end)."""
+    queryset = CheckResult.objects.filter(
+        domain_check__in=checks, checked_on__gte=start, checked_on__lt=end)
+    if using is not None:
+        queryset = queryset.using(using)
+    batches = merge_archived(
+        result_batches(queryset, batch_size=batch_size), checks, start, end,
+        batch_size=batch_size)
+    return FORMATS[format]().chunks(batches)
@@ -1,6 +1,7 @@
 import django_filters
 
 from django import forms
+from django.utils.dateparse import parse_datetime
 from django.forms.models import BaseInlineFormSet, inlineformset_factory
 
 from . import models
@@ -24,10 +25,10 @@ class CheckFilterForm(forms.Form):
 
 
 class CheckResultFilter(django_filters.FilterSet):
-    """Filter check results for a time range."""
+    """Filter check results which overlap a time range."""
 
     start = django_filters.DateTimeFilter(
-        name='checked_on', lookup_type='gte', required=True)
+        name='last_checked_on', lookup_type='gte', required=True)
     end = django_filters.DateTimeFilter(
         name='checked_on', lookup_type='lte', required=True)
 
@@ -37,6 +38,34 @@ class CheckResultFilter(django_filters.FilterSet):
         order_by = ('-checked_on', )
 
 
+class ISODateTimeField(forms.DateTimeField):
+    """Also accept ISO 8601 date/times with a UTC offset."""
+
+    def strptime(self, value, format):
+        return parse_datetime(value) or super().strptime(value, format)
+
+
+class ResultExportForm(forms.Form):
+    """Checks and time range of a bulk result export."""
+
+    checks = forms.ModelMultipleChoiceField(queryset=models.DomainCheck.objects.all())
+    start = ISODateTimeField()
+    end = ISODateTimeField()
+    format = forms.ChoiceField(choices=(
+        ('csv', 'CSV'), ('jsonl', 'JSON lines'), ('columnar', 'Columnar'), ), required=False)
+
+    def clean_format(self):
+        return self.cleaned_data.get('format') or 'csv'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        if start is not None and end is not None and start >= end:
+            raise forms.ValidationError('End date must be greater than start date.')
+        return cleaned_data
+
+
 class BaseDomainCheckFormSet(BaseInlineFormSet):
     """Additional validations for required domain checks."""
 
@@ -54,7 +83,9 @@ class BaseDomainCheckFormSet(BaseInlineFormSet):
 
 DomainCheckFormSet = inlineformset_factory(
     parent_model=models.Domain, model=models.DomainCheck,
-    fields=('protocol', 'path', 'method', 'is_active', ),
+    fields=(
+        'protocol', 'path', 'method', 'is_active', 'interval', 'status_only',
+        'assertion', 'assertion_value', ),
     formset=BaseDomainCheckFormSet,
     extra=3, can_delete=False,
     max_num=3, validate_max=True,
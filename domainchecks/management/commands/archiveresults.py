@@ -0,0 +1,21 @@
+import datetime
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils.timezone import now
+
+from ...archive import archive_results
+
+
+class Command(BaseCommand):
+    help = 'Moves old check results from the database to the archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, dest='days', default=settings.DOMAINCHECKS_ARCHIVE_AFTER,
+            help='Archive results older than this (in days).')
+
+    def handle(self, *args, **options):
+        count = archive_results(before=now() - datetime.timedelta(days=options['days']))
+        if options['verbosity'] > 0:
+            self.stdout.write('{} result{} archived\n'.format(count, '' if count == 1 else 's'))
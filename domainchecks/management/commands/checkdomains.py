@@ -1,13 +1,21 @@
 import datetime
+import signal
+import threading
 
 from django.core.management import BaseCommand
 
+from ... import daemon
 from ...models import DomainCheck
+from ...results import get_backend
 
 
 class Command(BaseCommand):
     help = 'Pings configured domain checks for their current status.'
 
+    # Run from cron, with PROCESS_TYPE=probe to only load the apps the checks
+    # need, so skip the start up cost of the system checks
+    requires_system_checks = False
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--minutes', type=int, dest='minutes', default=5,
@@ -15,18 +23,48 @@ class Command(BaseCommand):
         parser.add_argument(
             '--timeout', type=int, dest='timeout', default=10,
             help='Timeout for server response (in seconds).')
+        parser.add_argument(
+            '--daemon', '--loop', action='store_true', dest='daemon', default=False,
+            help='Keep running the checks as they become due until stopped.')
+        parser.add_argument(
+            '--concurrency', type=int, dest='concurrency', default=10,
+            help='Checks to run at the same time with --daemon.')
+        parser.add_argument(
+            '--refresh', type=int, dest='refresh', default=30,
+            help='Time between loading changed checks with --daemon (in seconds).')
 
     def handle(self, *args, **options):
         verbosity = options['verbosity']
-        if verbosity > 0:
-            self.stdout.write('Refreshing domain statuses\n')
-        count = 0
-        cutoff = datetime.timedelta(minutes=options['minutes'])
-        for check in DomainCheck.objects.active().stale(cutoff=cutoff):
-            if verbosity > 1:
-                self.stdout.write('Running check {}\n'.format(check))
-            check.run_check(timeout=options['timeout'])
-            count += 1
+        if options['daemon']:
+            count = self.run_daemon(**options)
+        else:
+            if verbosity > 0:
+                self.stdout.write('Refreshing domain statuses\n')
+            count = 0
+            cutoff = datetime.timedelta(minutes=options['minutes'])
+            for check in DomainCheck.objects.active().stale(cutoff=cutoff):
+                if verbosity > 1:
+                    self.stdout.write('Running check {}\n'.format(check))
+                check.run_check(timeout=options['timeout'])
+                count += 1
+            get_backend().flush()
         if verbosity > 0:
             self.stdout.write('{count} domain status{plural} updated\n'.format(
                 count=count, plural='' if count == 1 else 'es'))
+
+    def run_daemon(self, **options):
+        """Run the checks continuously until interrupted or terminated."""
+        if options['verbosity'] > 0:
+            self.stdout.write('Running domain checks with {} thread(s)\n'.format(
+                options['concurrency']))
+        stop = threading.Event()
+        previous = dict(
+            (signum, signal.signal(signum, lambda signum, frame: stop.set()))
+            for signum in (signal.SIGINT, signal.SIGTERM))
+        try:
+            return daemon.run(
+                concurrency=options['concurrency'], timeout=options['timeout'],
+                refresh_interval=options['refresh'], stop=stop)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
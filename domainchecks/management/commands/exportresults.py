@@ -0,0 +1,53 @@
+import sys
+
+from django.core.management import BaseCommand, CommandError
+
+from ...export import export_results
+from ...forms import ResultExportForm
+from ...models import DomainCheck
+
+
+class Command(BaseCommand):
+    help = 'Exports the results of domain checks which started in a time range.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', type=int, dest='checks', action='append', default=[],
+            help='Id of a check to export (can be repeated).')
+        parser.add_argument(
+            '--domain', dest='domains', action='append', default=[],
+            help='Export all of the checks of a domain (can be repeated).')
+        parser.add_argument('--start', required=True, help='Start of the time range.')
+        parser.add_argument('--end', required=True, help='End of the time range.')
+        parser.add_argument(
+            '--format', default='csv', choices=('csv', 'jsonl', 'columnar'),
+            help='Output format (default: csv).')
+        parser.add_argument(
+            '--output', default='-', help='File to write to (default: stdout).')
+
+    def handle(self, *args, **options):
+        checks = set(options['checks'])
+        checks.update(DomainCheck.objects.filter(
+            domain__name__in=options['domains']).values_list('pk', flat=True))
+        form = ResultExportForm({
+            'checks': sorted(checks),
+            'start': options['start'],
+            'end': options['end'],
+            'format': options['format'],
+        })
+        if not form.is_valid():
+            raise CommandError('; '.join(
+                '{}: {}'.format(field, ' '.join(errors))
+                for field, errors in form.errors.items()))
+        data = form.cleaned_data
+        chunks = export_results(data['checks'], data['start'], data['end'], data['format'])
+        if options['output'] == '-':
+            self.write(chunks, sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write(chunks, output)
+
+    def write(self, chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
@@ -0,0 +1,49 @@
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from ...provisioning import provision
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates domains from a file with a JSON object per line: '
+        '{"name": ..., "checks": [{"path": ...}, ...]}.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('owner', help='Username of the owner of the domains.')
+        parser.add_argument(
+            'file', nargs='?', default='-', help='File to read (default: stdin).')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size', default=500,
+            help='Domains validated and created together.')
+
+    def read(self, lines):
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    raise CommandError('Line {} is not valid JSON.'.format(number))
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            owner = User.objects.get(**{User.USERNAME_FIELD: options['owner']})
+        except User.DoesNotExist:
+            raise CommandError('Unknown owner {}.'.format(options['owner']))
+        if options['file'] == '-':
+            created, errors = self.provision(sys.stdin, owner, options)
+        else:
+            with open(options['file']) as lines:
+                created, errors = self.provision(lines, owner, options)
+        for position, error in sorted(errors.items()):
+            self.stderr.write('Domain {}: {}\n'.format(position + 1, json.dumps(error)))
+        if options['verbosity'] > 0:
+            self.stdout.write('{} domain{} created, {} skipped\n'.format(
+                created, '' if created == 1 else 's', len(errors)))
+
+    def provision(self, lines, owner, options):
+        return provision(self.read(lines), owner, chunk_size=options['chunk_size'])
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0001_squashed_0006_rename_domain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domaincheck',
+            name='interval',
+            field=models.PositiveIntegerField(default=120, help_text='Time between checks (in seconds).'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0002_check_interval'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domaincheck',
+            name='status_only',
+            field=models.BooleanField(default=False, help_text='Only check the status code and skip the body.'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0003_check_status_only'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkresult',
+            name='assertion_passed',
+            field=models.NullBooleanField(),
+        ),
+        migrations.AddField(
+            model_name='domaincheck',
+            name='assertion',
+            field=models.CharField(max_length=8, blank=True, default='', choices=[('contains', 'Contains text'), ('regex', 'Matches regular expression'), ('json', 'JSON path')]),
+        ),
+        migrations.AddField(
+            model_name='domaincheck',
+            name='assertion_value',
+            field=models.CharField(max_length=1024, blank=True, default='', help_text='Text, pattern or JSON path (optionally "== value") to look for.'),
+        ),
+    ]
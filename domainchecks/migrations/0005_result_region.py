@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0004_content_assertions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkresult',
+            name='region',
+            field=models.CharField(max_length=50, blank=True, default=''),
+        ),
+    ]
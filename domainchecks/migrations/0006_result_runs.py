@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def fill_runs(apps, schema_editor):
+    """Existing results are runs of a single check."""
+    CheckResult = apps.get_model('domainchecks', 'CheckResult')
+    CheckResult.objects.update(
+        last_checked_on=models.F('checked_on'),
+        response_time_min=models.F('response_time'),
+        response_time_max=models.F('response_time'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0005_result_region'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkresult',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='checkresult',
+            name='last_checked_on',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='checkresult',
+            name='response_time_max',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='checkresult',
+            name='response_time_min',
+            field=models.FloatField(null=True),
+        ),
+        migrations.RunPython(fill_runs, migrations.RunPython.noop),
+    ]
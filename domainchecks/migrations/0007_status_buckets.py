@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.db import models, migrations
+from django.utils.timezone import now, utc
+
+
+def fill_buckets(apps, schema_editor):
+    """Count the recent results and keep the last check time of each check."""
+    CheckResult = apps.get_model('domainchecks', 'CheckResult')
+    StatusBucket = apps.get_model('domainchecks', 'StatusBucket')
+    size = settings.DOMAINCHECKS_STATUS_BUCKET
+    since = now() - datetime.timedelta(seconds=settings.DOMAINCHECKS_STATUS_RETENTION)
+    totals = {}
+    recent = CheckResult.objects.filter(last_checked_on__gte=since).values_list(
+        'domain_check', 'last_checked_on', 'status_code', 'assertion_passed', 'count')
+    for check, checked_on, status_code, passed, count in recent.iterator():
+        timestamp = checked_on.timestamp()
+        started_on = datetime.datetime.fromtimestamp(timestamp - timestamp % size, tz=utc)
+        successes, pings, last = totals.get((check, started_on), (0, 0, checked_on))
+        if status_code is not None and 200 <= status_code <= 299 and passed is not False:
+            successes += count
+        totals[(check, started_on)] = (successes, pings + count, max(last, checked_on))
+    counted = set(check for check, started_on in totals)
+    older = CheckResult.objects.exclude(domain_check__in=counted).values(
+        'domain_check').annotate(latest=models.Max('last_checked_on'))
+    for row in older:
+        totals[(row['domain_check'], row['latest'])] = (0, 0, row['latest'])
+    StatusBucket.objects.bulk_create(
+        StatusBucket(
+            domain_check_id=check, started_on=started_on, successes=successes,
+            pings=pings, last_checked_on=last)
+        for (check, started_on), (successes, pings, last) in totals.items())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0006_result_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusBucket',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('started_on', models.DateTimeField()),
+                ('successes', models.PositiveIntegerField(default=0)),
+                ('pings', models.PositiveIntegerField(default=0)),
+                ('last_checked_on', models.DateTimeField()),
+                ('domain_check', models.ForeignKey(to='domainchecks.DomainCheck')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='statusbucket',
+            unique_together=set([('domain_check', 'started_on')]),
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+    ]
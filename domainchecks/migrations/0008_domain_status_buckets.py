@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def fill_buckets(apps, schema_editor):
+    """Add up the existing check buckets for each domain."""
+    StatusBucket = apps.get_model('domainchecks', 'StatusBucket')
+    DomainStatusBucket = apps.get_model('domainchecks', 'DomainStatusBucket')
+    totals = StatusBucket.objects.values('domain_check__domain', 'started_on').annotate(
+        total_successes=models.Sum('successes'), total_pings=models.Sum('pings'),
+        latest=models.Max('last_checked_on')).order_by()
+    DomainStatusBucket.objects.bulk_create(
+        DomainStatusBucket(
+            domain_id=row['domain_check__domain'], started_on=row['started_on'],
+            successes=row['total_successes'], pings=row['total_pings'],
+            last_checked_on=row['latest'])
+        for row in totals.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0007_status_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainStatusBucket',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('started_on', models.DateTimeField()),
+                ('successes', models.PositiveIntegerField(default=0)),
+                ('pings', models.PositiveIntegerField(default=0)),
+                ('last_checked_on', models.DateTimeField()),
+                ('domain', models.ForeignKey(to='domainchecks.Domain')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='domainstatusbucket',
+            unique_together=set([('domain', 'started_on')]),
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+    ]
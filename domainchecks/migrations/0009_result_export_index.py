@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0008_domain_status_buckets'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='checkresult',
+            index_together=set([('checked_on', 'id')]),
+        ),
+    ]
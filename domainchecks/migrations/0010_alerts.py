@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0009_result_export_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('kind', models.CharField(max_length=10, choices=[('transition', 'Status changed'), ('flapping', 'Started flapping'), ('stable', 'Stopped flapping')])),
+                ('previous_status', models.CharField(max_length=10)),
+                ('status', models.CharField(max_length=10)),
+                ('success_rate', models.FloatField(null=True)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivered_on', models.DateTimeField(null=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CheckState',
+            fields=[
+                ('domain_check', models.OneToOneField(primary_key=True, serialize=False, to='domainchecks.DomainCheck')),
+                ('status', models.CharField(max_length=10, default='unknown')),
+                ('changed_on', models.DateTimeField(null=True)),
+                ('pending_status', models.CharField(max_length=10, blank=True, default='')),
+                ('pending_count', models.PositiveIntegerField(default=0)),
+                ('flaps', models.PositiveIntegerField(default=0)),
+                ('flaps_since', models.DateTimeField(null=True)),
+                ('is_flapping', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='alertevent',
+            name='domain_check',
+            field=models.ForeignKey(to='domainchecks.DomainCheck'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+import django.core.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('domainchecks', '0010_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OwnerQuota',
+            fields=[
+                ('owner', models.OneToOneField(primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('probes_per_minute', models.PositiveIntegerField(blank=True, null=True, help_text='Leave blank for the default rate.')),
+                ('weight', models.FloatField(default=1, help_text='Share of the probes when they are all busy.', validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import models, migrations
+
+
+def raise_intervals(apps, schema_editor):
+    """Existing checks run at most every 10 seconds."""
+    DomainCheck = apps.get_model('domainchecks', 'DomainCheck')
+    DomainCheck.objects.filter(interval__lt=10).update(interval=10)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domainchecks', '0012_change_tracking'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='domaincheck',
+            name='interval',
+            field=models.PositiveIntegerField(default=120, help_text='Time between checks (in seconds).', validators=[django.core.validators.MinValueValidator(10)]),
+        ),
+        migrations.RunPython(raise_intervals, migrations.RunPython.noop),
+    ]
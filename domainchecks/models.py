@@ -1,64 +1,184 @@
 import datetime
-import time
-
-import requests
+import re
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models import Case, Count, F, Max, Q, Value, When
-from django.utils.timezone import now
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
+from django.utils.timezone import now, utc
+
+from . import probes, scheduling
+from .signals import results_recorded
+
+
+_breaker = None
+
+
+def get_breaker():
+    """Return this process's circuit breaker for failing hosts."""
+    global _breaker
+    threshold = settings.DOMAINCHECKS_BREAKER_THRESHOLD
+    reset_timeout = settings.DOMAINCHECKS_BREAKER_RESET
+    if not threshold:
+        return None
+    if _breaker is None or (_breaker.threshold, _breaker.reset_timeout) != (
+            threshold, reset_timeout):
+        _breaker = probes.CircuitBreaker(threshold, reset_timeout)
+    return _breaker
+
+
+def bucket_start(value):
+    """Round a time down to the start of its status bucket."""
+    size = settings.DOMAINCHECKS_STATUS_BUCKET
+    timestamp = value.timestamp()
+    return datetime.datetime.fromtimestamp(timestamp - timestamp % size, tz=utc)
+
+
+def annotate_status(queryset, buckets, cutoff):
+    """Annotate the success rate and status from the related buckets."""
+    recent = Q(**{buckets + '__started_on__gte': bucket_start(now() - cutoff)})
+    return queryset.annotate(
+        last_check=Max(buckets + '__last_checked_on'),
+        successes=Coalesce(Sum(Case(When(recent, then=buckets + '__successes'))), 0),
+        pings=Sum(Case(When(recent, then=buckets + '__pings'))),
+    ).annotate(
+        success_rate=F('successes') * 100.0 / F('pings')
+    ).annotate(
+        status=Case(
+            When(success_rate__gt=90, then=Value('good')),
+            When(success_rate__range=(75, 90), then=Value('fair')),
+            When(success_rate__lt=75, then=Value('poor')),
+            When(success_rate__isnull=True, then=Value('unknown')),
+            output_field=models.CharField())
+    )
+
+
+def rate_status(rate):
+    """Status for a success rate, matching ``annotate_status``."""
+    if rate is None:
+        return 'unknown'
+    elif rate > 90:
+        return 'good'
+    elif rate >= 75:
+        return 'fair'
+    return 'poor'
 
 
-class DomainCheckQuerySet(models.QuerySet):
+class TrackedQuerySet(models.QuerySet):
+    """Queryset which keeps ``updated_on`` current on bulk updates."""
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_on', now())
+        return super().update(**kwargs)
+
+    def changed_since(self, when):
+        """Rows which were saved or updated at or after the given time."""
+        return self.filter(updated_on__gte=when)
+
+
+class TrackedModel(models.Model):
+    """Model with the time it was last changed.
+
+    ``updated_on`` is set whenever the model is saved, including saves
+    limited to some fields, and by the ``update`` of its queryset.
+    """
+
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_on'}
+        super().save(*args, **kwargs)
+
+
+class DomainCheckQuerySet(TrackedQuerySet):
     """Custom queryset to filter and annotate domain checks."""
 
     def active(self):
         return self.filter(is_active=True)
 
+    def last_checked(self, region=None):
+        """Annotate the latest result time, optionally for a single region.
+
+        Without a region the time is read from the status buckets, which
+        keep the latest one for each check, so the cost doesn't grow with
+        the number of results.
+        """
+        if region is None:
+            return self.annotate(last_check=Max('statusbucket__last_checked_on'))
+        return self.annotate(last_check=Max(Case(
+            When(checkresult__region=region, then='checkresult__last_checked_on'),
+            output_field=models.DateTimeField())))
+
     def stale(self, cutoff=datetime.timedelta(hours=1)):
         end_time = now() - cutoff
-        return self.annotate(
-            last_check=Max('checkresult__checked_on')
-        ).filter(
+        return self.last_checked().filter(
             Q(last_check__lt=end_time) | Q(last_check__isnull=True))
 
     def status(self, cutoff=datetime.timedelta(hours=1)):
-        start_time = now() - cutoff
-        ping = Q(checkresult__checked_on__gte=start_time)
-        success = Q(
-            checkresult__checked_on__gte=start_time,
-            checkresult__status_code__range=(200, 299))
-        return self.annotate(
-            last_check=Max('checkresult__checked_on'),
-            successes=Count(Case(When(success, then=1))),
-            pings=Count(Case(When(ping, then=1))),
-        ).annotate(
-            success_rate=F('successes') * 100.0 / F('pings')
-        ).annotate(
-            status=Case(
-                When(success_rate__gt=90, then=Value('good')),
-                When(success_rate__range=(75, 90), then=Value('fair')),
-                When(success_rate__lt=75, then=Value('poor')),
-                When(success_rate__isnull=True, then=Value('unknown')),
-                output_field=models.CharField())
-        )
-
-
-class Domain(models.Model):
-    """Domain managed by a user."""
+        """Annotate the success rate and status for the time cutoff.
+
+        Counts are read from the status buckets so the cost depends on the
+        number of buckets in the cutoff rather than the number of results.
+        The start of the cutoff is rounded down to the start of its bucket.
+        """
+        return annotate_status(self, 'statusbucket', cutoff)
+
+
+class DomainQuerySet(TrackedQuerySet):
+    """Custom queryset to filter and annotate domains."""
+
+    def update(self, **kwargs):
+        """Update the domains and mark their checks as changed too."""
+        kwargs.setdefault('updated_on', now())
+        with transaction.atomic(using=self.db):
+            # Checks first, while the domains still match the filters
+            DomainCheck.objects.filter(domain__in=self.values('pk')).update(
+                updated_on=kwargs['updated_on'])
+            return super().update(**kwargs)
+
+    def active(self):
+        """Domains with at least one active check."""
+        return self.filter(pk__in=DomainCheck.objects.active().values('domain'))
+
+    def status(self, cutoff=datetime.timedelta(hours=1)):
+        """Annotate the success rate and status of all checks for the domain."""
+        return annotate_status(self, 'domainstatusbucket', cutoff)
+
+
+class Domain(TrackedModel):
+    """Domain managed by a user.
+
+    Changes to a domain also change ``updated_on`` of its checks so the
+    checks changed since a time can be found from their own index.
+    """
 
     name = models.CharField(max_length=253, unique=True)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL)
 
+    objects = DomainQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
     def get_absolute_url(self):
         return reverse('status-detail', kwargs={'domain': self.name})
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            self.domaincheck_set.update(updated_on=self.updated_on)
+
 
-class DomainCheck(models.Model):
+class DomainCheck(TrackedModel):
     """Configured website check."""
 
     PROTOCOL_HTTP = 'http'
@@ -83,6 +203,16 @@ class DomainCheck(models.Model):
         (METHOD_HEAD, 'HEAD'),
     )
 
+    ASSERTION_CONTAINS = 'contains'
+    ASSERTION_REGEX = 'regex'
+    ASSERTION_JSON = 'json'
+
+    ASSERTION_CHOICES = (
+        (ASSERTION_CONTAINS, 'Contains text'),
+        (ASSERTION_REGEX, 'Matches regular expression'),
+        (ASSERTION_JSON, 'JSON path'),
+    )
+
     domain = models.ForeignKey(Domain)
     path = models.CharField(max_length=1024)
     protocol = models.CharField(
@@ -90,6 +220,16 @@ class DomainCheck(models.Model):
     method = models.CharField(
         max_length=6, choices=METHOD_CHOICES, default=METHOD_GET)
     is_active = models.BooleanField(default=True)
+    interval = models.PositiveIntegerField(
+        default=120, validators=[MinValueValidator(scheduling.MIN_INTERVAL)],
+        help_text='Time between checks (in seconds).')
+    status_only = models.BooleanField(
+        default=False, help_text='Only check the status code and skip the body.')
+    assertion = models.CharField(
+        max_length=8, choices=ASSERTION_CHOICES, blank=True, default='')
+    assertion_value = models.CharField(
+        max_length=1024, blank=True, default='',
+        help_text='Text, pattern or JSON path (optionally "== value") to look for.')
 
     objects = DomainCheckQuerySet.as_manager()
 
@@ -97,40 +237,321 @@ class DomainCheck(models.Model):
         return '{method} {url}'.format(
             method=self.get_method_display(), url=self.url)
 
+    def clean(self):
+        if self.assertion:
+            if self.status_only:
+                raise ValidationError(
+                    'Status only checks cannot have a content assertion.')
+            if not self.assertion_value:
+                raise ValidationError(
+                    {'assertion_value': 'A value is required for the assertion.'})
+            try:
+                probes.get_matcher(self)
+            except (ValueError, re.error) as e:
+                raise ValidationError({'assertion_value': str(e)})
+
     @property
     def url(self):
         return '{protocol}://{domain}{path}'.format(
             protocol=self.protocol, domain=self.domain, path=self.path)
 
-    def run_check(self, timeout=10):
-        start = time.time()
-        result = CheckResult(domain_check=self, checked_on=now())
-        try:
-            response = requests.request(
-                self.method, self.url, allow_redirects=False, timeout=timeout)
-            result.status_code = response.status_code
-            response.raise_for_status()
-        except requests.exceptions.ConnectionError:
-            # Host could not be resolved or the connection was refused
-            pass
-        except requests.exceptions.Timeout:
-            # Request timed out
-            pass
-        except requests.exceptions.RequestException:
-            # Server responded with 4XX or 5XX status code
-            result.response_body = response.text
+    def probe(self, timeout=10, session=None):
+        """Fetch the check url and return an unsaved result."""
+        if self.assertion:
+            max_bytes = settings.DOMAINCHECKS_MAX_ASSERTION_BYTES
         else:
-            result.response_body = response.text
-        finally:
-            result.response_time = time.time() - start
-            result.save()
+            max_bytes = settings.DOMAINCHECKS_MAX_BODY_BYTES
+        result = CheckResult(
+            domain_check=self, checked_on=now(),
+            region=settings.DOMAINCHECKS_REGION)
+        outcome = probes.probe(
+            self, timeout=timeout, max_bytes=max_bytes, breaker=get_breaker(),
+            session=session)
+        result.status_code = outcome.status_code
+        result.response_time = outcome.response_time
+        result.response_body = outcome.response_body
+        result.assertion_passed = outcome.assertion_passed
+        return result
+
+    def run_check(self, timeout=10, session=None):
+        from .results import get_backend
+
+        get_backend().publish(self.probe(timeout=timeout, session=session))
 
 
 class CheckResult(models.Model):
-    """Result of a status check on a website."""
+    """Result of a status check on a website.
+
+    With compact storage a single result can stand for a run of
+    consecutive checks with the same outcome. The run spans from
+    ``checked_on`` to ``last_checked_on`` and ``response_time`` is the
+    mean over the run.
+    """
 
     domain_check = models.ForeignKey(DomainCheck)
     checked_on = models.DateTimeField()
     status_code = models.PositiveIntegerField(null=True)
     response_time = models.FloatField(null=True)
     response_body = models.TextField(default='')
+    assertion_passed = models.NullBooleanField()
+    region = models.CharField(max_length=50, blank=True, default='')
+    last_checked_on = models.DateTimeField(null=True)
+    count = models.PositiveIntegerField(default=1)
+    response_time_min = models.FloatField(null=True)
+    response_time_max = models.FloatField(null=True)
+
+    def save(self, *args, **kwargs):
+        self.start_run()
+        super().save(*args, **kwargs)
+
+    def start_run(self):
+        """Fill in the run fields for a single check."""
+        if self.last_checked_on is None:
+            self.last_checked_on = self.checked_on
+        if self.response_time_min is None:
+            self.response_time_min = self.response_time
+        if self.response_time_max is None:
+            self.response_time_max = self.response_time
+
+    @property
+    def is_success(self):
+        return (
+            self.status_code is not None and 200 <= self.status_code <= 299 and
+            self.assertion_passed is not False)
+
+    @property
+    def outcome(self):
+        """Results with the same outcome can be merged into one run."""
+        return (
+            self.region, self.status_code, self.assertion_passed,
+            self.response_time is None)
+
+    def extend_run(self, result):
+        """Merge a later result with the same outcome into this run."""
+        if result.response_time is not None:
+            total = self.response_time * self.count + result.response_time
+            self.response_time = total / (self.count + 1)
+            self.response_time_min = min(self.response_time_min, result.response_time)
+            self.response_time_max = max(self.response_time_max, result.response_time)
+        self.count += 1
+        self.last_checked_on = result.checked_on
+
+    class Meta:
+        # Exports page through results in this order
+        index_together = (('checked_on', 'id'), )
+
+
+class StatusBucketQuerySet(models.QuerySet):
+    """Update and prune the status counters."""
+
+    def add(self, owner, started_on, successes, pings, last_checked_on):
+        """Add to the counts of an existing bucket. Returns False if there is none."""
+        later = Value(last_checked_on, output_field=models.DateTimeField())
+        lookup = {self.model.owner_field: owner, 'started_on': started_on}
+        return self.filter(**lookup).update(
+            successes=F('successes') + successes,
+            pings=F('pings') + pings,
+            last_checked_on=Case(
+                When(last_checked_on__lt=last_checked_on, then=later),
+                default=F('last_checked_on'))) > 0
+
+    def record(self, results, key=None):
+        """Count a batch of new results in their buckets.
+
+        ``key`` returns the id of the bucket owner for a result and
+        defaults to the result's check.
+        """
+        key = key or (lambda result: result.domain_check_id)
+        totals = {}
+        for result in results:
+            bucket = (key(result), bucket_start(result.checked_on))
+            successes, pings, last = totals.get(bucket, (0, 0, result.checked_on))
+            totals[bucket] = (
+                successes + result.is_success, pings + 1, max(last, result.checked_on))
+        for (owner, started_on), (successes, pings, last) in totals.items():
+            if self.add(owner, started_on, successes, pings, last):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(**{
+                        self.model.owner_field: owner, 'started_on': started_on,
+                        'successes': successes, 'pings': pings, 'last_checked_on': last,
+                    })
+            except IntegrityError:
+                # Bucket was created by another worker in the meantime
+                self.add(owner, started_on, successes, pings, last)
+
+    def prune(self, before):
+        """Delete buckets which started before the given time.
+
+        The latest bucket for each owner is kept so the time of its last
+        check is still known.
+        """
+        latest = self.values(self.model.owner_field).annotate(
+            latest=Max('pk')).values_list('latest', flat=True)
+        return self.filter(started_on__lt=before).exclude(pk__in=list(latest)).delete()
+
+
+class BaseStatusBucket(models.Model):
+    """Number of successful checks and pings in a short period.
+
+    Buckets are updated as results are recorded so the status can be read
+    without scanning the results. Their length is set by
+    DOMAINCHECKS_STATUS_BUCKET.
+    """
+
+    started_on = models.DateTimeField()
+    successes = models.PositiveIntegerField(default=0)
+    pings = models.PositiveIntegerField(default=0)
+    last_checked_on = models.DateTimeField()
+
+    objects = StatusBucketQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class StatusBucket(BaseStatusBucket):
+    """Status counters for a single check."""
+
+    owner_field = 'domain_check_id'
+
+    domain_check = models.ForeignKey(DomainCheck)
+
+    class Meta:
+        unique_together = (('domain_check', 'started_on'), )
+
+
+class DomainStatusBucket(BaseStatusBucket):
+    """Status counters for all of the checks of a domain."""
+
+    owner_field = 'domain_id'
+
+    domain = models.ForeignKey(Domain)
+
+    class Meta:
+        unique_together = (('domain', 'started_on'), )
+
+
+class OwnerQuota(models.Model):
+    """Probe rate limit and scheduling weight of an account.
+
+    Owners without a quota get DOMAINCHECKS_OWNER_PROBE_RATE and a weight
+    of one.
+    """
+
+    owner = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True)
+    probes_per_minute = models.PositiveIntegerField(
+        null=True, blank=True, help_text='Leave blank for the default rate.')
+    weight = models.FloatField(
+        default=1, validators=[MinValueValidator(0)],
+        help_text='Share of the probes when they are all busy.')
+
+    def __str__(self):
+        return str(self.owner)
+
+
+class CheckState(models.Model):
+    """Last alerted status of a check and the transition it is waiting on.
+
+    A new status has to hold for DOMAINCHECKS_ALERT_CONFIRM evaluations in
+    a row before the check moves to it, and the success rate has to be
+    more than DOMAINCHECKS_ALERT_HYSTERESIS points past the threshold.
+    Checks changing status more than DOMAINCHECKS_ALERT_FLAP_LIMIT times
+    in DOMAINCHECKS_ALERT_FLAP_WINDOW seconds are flapping and only alert
+    again once they have settled.
+    """
+
+    domain_check = models.OneToOneField(DomainCheck, primary_key=True)
+    status = models.CharField(max_length=10, default='unknown')
+    changed_on = models.DateTimeField(null=True)
+    pending_status = models.CharField(max_length=10, blank=True, default='')
+    pending_count = models.PositiveIntegerField(default=0)
+    flaps = models.PositiveIntegerField(default=0)
+    flaps_since = models.DateTimeField(null=True)
+    is_flapping = models.BooleanField(default=False)
+
+    def classify(self, rate):
+        """Status for the rate, keeping the current one within the margin."""
+        margin = settings.DOMAINCHECKS_ALERT_HYSTERESIS
+        if rate is not None and self.status in (
+                rate_status(max(rate - margin, 0)), rate_status(min(rate + margin, 100))):
+            return self.status
+        return rate_status(rate)
+
+    def evaluate(self, rate, when):
+        """Update the state for a new success rate.
+
+        Returns the kind of alert to send, if any: ``transition`` when the
+        status changes, ``flapping`` when it starts flapping and ``stable``
+        when a flapping check settles.
+        """
+        status = self.classify(rate)
+        if status == self.status:
+            self.pending_status, self.pending_count = '', 0
+            flap_window = datetime.timedelta(seconds=settings.DOMAINCHECKS_ALERT_FLAP_WINDOW)
+            if self.is_flapping and when - self.changed_on > flap_window:
+                self.is_flapping, self.flaps, self.flaps_since = False, 0, None
+                return 'stable'
+            return None
+        if status == self.pending_status:
+            self.pending_count += 1
+        else:
+            self.pending_status, self.pending_count = status, 1
+        if self.pending_count < settings.DOMAINCHECKS_ALERT_CONFIRM:
+            return None
+        previous = self.status
+        self.status, self.changed_on = status, when
+        self.pending_status, self.pending_count = '', 0
+        if previous == 'unknown':
+            # First status of a new check, only worth an alert if it isn't good
+            return None if status == 'good' else 'transition'
+        return self.count_flap(when)
+
+    def count_flap(self, when):
+        flap_window = datetime.timedelta(seconds=settings.DOMAINCHECKS_ALERT_FLAP_WINDOW)
+        if self.flaps_since is None or when - self.flaps_since > flap_window:
+            self.flaps, self.flaps_since = 0, when
+        self.flaps += 1
+        if self.is_flapping:
+            return None
+        if self.flaps > settings.DOMAINCHECKS_ALERT_FLAP_LIMIT:
+            self.is_flapping = True
+            return 'flapping'
+        return 'transition'
+
+
+class AlertEvent(models.Model):
+    """Outbox of alerts waiting to be sent to the notifiers."""
+
+    KIND_TRANSITION = 'transition'
+    KIND_FLAPPING = 'flapping'
+    KIND_STABLE = 'stable'
+
+    KIND_CHOICES = (
+        (KIND_TRANSITION, 'Status changed'),
+        (KIND_FLAPPING, 'Started flapping'),
+        (KIND_STABLE, 'Stopped flapping'),
+    )
+
+    domain_check = models.ForeignKey(DomainCheck)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    previous_status = models.CharField(max_length=10)
+    status = models.CharField(max_length=10)
+    success_rate = models.FloatField(null=True)
+    created_on = models.DateTimeField(default=now)
+    delivered_on = models.DateTimeField(null=True, db_index=True)
+
+    def __str__(self):
+        return '{}: {} -> {}'.format(self.domain_check_id, self.previous_status, self.status)
+
+
+@receiver(results_recorded)
+def count_results(sender, results, **kwargs):
+    StatusBucket.objects.record(results)
+    checks = set(result.domain_check_id for result in results)
+    domains = dict(DomainCheck.objects.filter(pk__in=checks).values_list('pk', 'domain'))
+    # Checks deleted in the meantime have no domain left to count them for
+    DomainStatusBucket.objects.record(
+        [result for result in results if domains.get(result.domain_check_id)],
+        key=lambda result: domains[result.domain_check_id])
@@ -0,0 +1,321 @@
+"""HTTP requests for domain checks.
+
+This module doesn't depend on Django so the same probing code can be used
+outside of the project. A check is any object with ``method``, ``url``,
+``status_only``, ``assertion`` and ``assertion_value`` attributes.
+"""
+import collections
+import json
+import re
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+import requests
+
+
+ProbeResult = collections.namedtuple(
+    'ProbeResult',
+    ('status_code', 'response_time', 'response_body', 'assertion_passed'))
+
+# Bytes of context kept on either side of an assertion match
+EXCERPT_LENGTH = 100
+
+# Bytes carried over between chunks when searching for a regex. Matches
+# longer than this which span two chunks won't be found.
+REGEX_OVERLAP = 4096
+
+CHUNK_SIZE = 8192
+
+
+def decode(content, encoding):
+    """Decode response bytes as text, ignoring anything invalid."""
+    try:
+        return content.decode(encoding or 'utf-8', 'replace')
+    except LookupError:
+        # Server sent an unknown encoding
+        return content.decode('utf-8', 'replace')
+
+
+def iter_body(response, max_bytes):
+    """Iterate over chunks of the body until max_bytes have been read."""
+    remaining = max_bytes
+    if remaining:
+        for chunk in response.iter_content(min(CHUNK_SIZE, max_bytes)):
+            yield chunk[:remaining]
+            remaining -= len(chunk)
+            if remaining <= 0:
+                break
+
+
+def read_body(response, max_bytes):
+    """Read at most max_bytes of the response body as text."""
+    return decode(b''.join(iter_body(response, max_bytes)), response.encoding)
+
+
+class ContainsMatcher(object):
+    """Look for a substring in the response body."""
+
+    def __init__(self, value):
+        self.head = b''
+        self.tail = b''
+        self.passed = None
+        self.excerpt = b''
+        self.pattern = value.encode('utf-8')
+
+    @property
+    def overlap(self):
+        return max(len(self.pattern) - 1, EXCERPT_LENGTH)
+
+    def search(self, data):
+        """Return the start and end of the first match in the data."""
+        index = data.find(self.pattern)
+        if index < 0:
+            return None
+        return index, index + len(self.pattern)
+
+    def feed(self, chunk):
+        """Search the next chunk. Returns True once the verdict is known."""
+        if len(self.head) < EXCERPT_LENGTH:
+            self.head += chunk[:EXCERPT_LENGTH - len(self.head)]
+        data = self.tail + chunk
+        match = self.search(data)
+        if match is not None:
+            start, end = match
+            self.passed = True
+            self.excerpt = data[max(0, start - EXCERPT_LENGTH):end + EXCERPT_LENGTH]
+            return True
+        self.tail = data[-self.overlap:]
+        return False
+
+    def finish(self):
+        """End of the body was reached without a verdict."""
+        if self.passed is None:
+            self.passed = False
+            self.excerpt = self.head
+
+
+class RegexMatcher(ContainsMatcher):
+    """Look for a regular expression match in the response body."""
+
+    overlap = REGEX_OVERLAP
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.pattern = re.compile(value.encode('utf-8'))
+
+    def search(self, data):
+        match = self.pattern.search(data)
+        if match is None:
+            return None
+        return match.start(), match.end()
+
+
+def parse_path(path):
+    """Split a JSON path such as ``$.items[0].name`` into keys and indexes."""
+    path = path.strip()
+    if path.startswith('$'):
+        path = path[1:]
+    if path and path[0] not in '.[':
+        path = '.' + path
+    keys = []
+    for part in re.finditer(r'\.([^.\[\]]+)|\[(\d+)\]|(.)', path):
+        key, index, invalid = part.groups()
+        if invalid is not None:
+            raise ValueError('Invalid JSON path: {}'.format(path))
+        keys.append(key if key is not None else int(index))
+    return keys
+
+
+def parse_json_assertion(value):
+    """Split ``path`` or ``path == value`` into the path keys and expected value."""
+    if '==' in value:
+        path, expected = value.split('==', 1)
+        return parse_path(path), json.loads(expected)
+    return parse_path(value), None
+
+
+class JSONMatcher(object):
+    """Check a value in a JSON response body.
+
+    The standard library can't parse JSON incrementally so the body is
+    buffered up to the read limit before the path is evaluated.
+    """
+
+    missing = object()
+
+    def __init__(self, value):
+        self.chunks = []
+        self.passed = None
+        self.excerpt = b''
+        self.keys, self.expected = parse_json_assertion(value)
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+        return False
+
+    def lookup(self, document):
+        for key in self.keys:
+            try:
+                document = document[key]
+            except (KeyError, IndexError, TypeError):
+                return self.missing
+        return document
+
+    def finish(self):
+        content = b''.join(self.chunks)
+        self.chunks = []
+        self.passed = False
+        self.excerpt = content[:EXCERPT_LENGTH * 2]
+        try:
+            document = json.loads(decode(content, 'utf-8'))
+        except ValueError:
+            return
+        found = self.lookup(document)
+        if found is not self.missing:
+            self.passed = self.expected is None or found == self.expected
+            self.excerpt = json.dumps(found).encode('utf-8')[:EXCERPT_LENGTH * 2]
+
+
+MATCHERS = {
+    'contains': ContainsMatcher,
+    'regex': RegexMatcher,
+    'json': JSONMatcher,
+}
+
+
+def get_matcher(check):
+    """Build the matcher for the check's content assertion, if it has one."""
+    assertion = getattr(check, 'assertion', '')
+    if check.status_only or not assertion:
+        return None
+    return MATCHERS[assertion](check.assertion_value)
+
+
+def match_body(response, matcher, max_bytes):
+    """Feed the body to the matcher until it has a verdict.
+
+    Returns the verdict and a short excerpt of the body around the match.
+    """
+    for chunk in iter_body(response, max_bytes):
+        if matcher.feed(chunk):
+            break
+    else:
+        matcher.finish()
+    return matcher.passed, decode(matcher.excerpt, response.encoding)
+
+
+class CircuitBreaker(object):
+    """Stop sending requests to hosts which keep failing.
+
+    After ``threshold`` consecutive connection failures or timeouts the
+    circuit for the host opens and requests are skipped. Once every
+    ``reset_timeout`` seconds a single canary request is let through and
+    the circuit closes again as soon as one succeeds. State is kept in
+    memory so each process has its own breaker.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = collections.Counter()
+        self.opened = {}
+        self.canaries = set()
+
+    def allow(self, host):
+        """Check if a request to the host should be made."""
+        with self.lock:
+            opened = self.opened.get(host)
+            if opened is None:
+                return True
+            if host in self.canaries or time.time() - opened < self.reset_timeout:
+                return False
+            self.canaries.add(host)
+            return True
+
+    def record(self, host, success):
+        """Track the outcome of a request to the host."""
+        with self.lock:
+            self.canaries.discard(host)
+            if success:
+                self.failures.pop(host, None)
+                self.opened.pop(host, None)
+            else:
+                self.failures[host] += 1
+                if self.failures[host] >= self.threshold:
+                    self.opened[host] = time.time()
+
+    def is_open(self, host):
+        with self.lock:
+            return host in self.opened
+
+
+def request(check, timeout=10, max_bytes=0, session=None):
+    """Start a streamed request for the check.
+
+    Bodies are only wanted for GET requests when the check isn't status
+    only. In that case only the first ``max_bytes`` are requested with a
+    Range header. Servers which don't support ranges ignore it and send a
+    full response which won't be read past ``max_bytes``. A ``session``
+    keeps its connections open for the next request.
+    """
+    http = requests if session is None else session
+    headers = {}
+    method = check.method.lower()
+    ranged = method == 'get' and not check.status_only and max_bytes > 0
+    if ranged:
+        headers['Range'] = 'bytes=0-{}'.format(max_bytes - 1)
+    response = http.request(
+        check.method, check.url, allow_redirects=False, timeout=timeout,
+        stream=True, headers=headers)
+    if ranged and response.status_code == 416:
+        # Empty resources can't satisfy any range so fetch them plainly
+        response.close()
+        response = http.request(
+            check.method, check.url, allow_redirects=False, timeout=timeout,
+            stream=True, headers={})
+    return response
+
+
+def probe(check, timeout=10, max_bytes=0, breaker=None, session=None):
+    """Run the check and return its status code, timing and body.
+
+    Status only checks close the connection as soon as the headers have
+    arrived. Checks with a content assertion stop reading as soon as it
+    passes and only keep an excerpt of the body. Other checks read at most
+    ``max_bytes`` of the body.
+
+    When a circuit ``breaker`` is given and the host's circuit is open a
+    failed result is returned without making a request.
+    """
+    host = urlsplit(check.url).netloc
+    if breaker is not None and not breaker.allow(host):
+        return ProbeResult(None, None, 'Skipped: {} is unreachable.'.format(host), None)
+    start = time.time()
+    status_code, body, passed = None, '', None
+    matcher = get_matcher(check)
+    try:
+        response = request(check, timeout=timeout, max_bytes=max_bytes, session=session)
+        try:
+            status_code = response.status_code
+            if matcher is not None:
+                passed, body = match_body(response, matcher, max_bytes)
+            elif not check.status_only:
+                body = read_body(response, max_bytes)
+        finally:
+            response.close()
+    except requests.exceptions.ConnectionError:
+        # Host could not be resolved or the connection was refused
+        pass
+    except requests.exceptions.Timeout:
+        # Request timed out
+        pass
+    except requests.exceptions.RequestException:
+        # Response was cut off or otherwise invalid
+        pass
+    finally:
+        if breaker is not None:
+            breaker.record(host, status_code is not None)
+    return ProbeResult(status_code, time.time() - start, body, passed)
@@ -0,0 +1,138 @@
+"""Create domains and their checks in bulk.
+
+Each domain is validated by the same ``DomainForm`` and check formset as
+the add domain page, except that names are checked for uniqueness with a
+single query per chunk. The valid domains of a chunk and their checks are
+then inserted with two bulk inserts in one transaction.
+"""
+import itertools
+
+from django.db import transaction
+
+from .forms import DomainForm
+from .models import Domain, DomainCheck
+
+
+class BulkDomainForm(DomainForm):
+    """Domain form which leaves the unique name check to the caller."""
+
+    def validate_unique(self):
+        pass
+
+
+def shape_errors(domain):
+    """Errors for data which isn't shaped like ``{'name': ..., 'checks': [{...}, ...]}``."""
+    if not isinstance(domain, dict):
+        return {'__all__': ['Domain must be an object.']}
+    checks = domain.get('checks')
+    if checks and (not isinstance(checks, list) or
+                   not all(isinstance(check, dict) for check in checks)):
+        return {'checks': ['Checks must be a list of objects.']}
+    return None
+
+
+def form_data(domain):
+    """Convert a ``{'name': ..., 'checks': [...]}`` dict into form data."""
+    checks = domain.get('checks') or []
+    data = {
+        'name': domain.get('name', ''),
+        'checks-TOTAL_FORMS': len(checks),
+        'checks-INITIAL_FORMS': 0,
+    }
+    interval = DomainCheck._meta.get_field('interval').default
+    for i, check in enumerate(checks):
+        prefix = 'checks-{}-'.format(i)
+        data.update({
+            prefix + 'protocol': check.get('protocol', DomainCheck.PROTOCOL_HTTP),
+            prefix + 'path': check.get('path', ''),
+            prefix + 'method': check.get('method', DomainCheck.METHOD_GET),
+            prefix + 'is_active': 'on' if check.get('is_active', True) else '',
+            prefix + 'interval': check.get('interval', interval),
+            prefix + 'status_only': 'on' if check.get('status_only', False) else '',
+            prefix + 'assertion': check.get('assertion', ''),
+            prefix + 'assertion_value': check.get('assertion_value', ''),
+        })
+    return data
+
+
+def form_errors(form):
+    """Errors of the domain form and its checks as a single dict."""
+    errors = dict(form.errors)
+    if form.checks.non_form_errors():
+        errors['checks'] = list(form.checks.non_form_errors())
+    for i, check_errors in enumerate(form.checks.errors):
+        if check_errors:
+            errors['checks-{}'.format(i)] = dict(check_errors)
+    return errors
+
+
+def validate(domains):
+    """Validate a chunk of domains.
+
+    Returns the valid forms and a dict of errors by position in the chunk.
+    """
+    errors = {}
+    forms = []
+    for i, domain in enumerate(domains):
+        shape = shape_errors(domain)
+        if shape:
+            errors[i] = shape
+        else:
+            forms.append((i, BulkDomainForm(data=form_data(domain))))
+    valid = []
+    names = set()
+    for i, form in forms:
+        if not form.is_valid():
+            errors[i] = form_errors(form)
+        elif form.cleaned_data['name'] in names:
+            errors[i] = {'name': ['Domain is listed more than once.']}
+        else:
+            names.add(form.cleaned_data['name'])
+            valid.append((i, form))
+    existing = set(Domain.objects.filter(name__in=names).values_list('name', flat=True))
+    for i, form in valid:
+        if form.cleaned_data['name'] in existing:
+            errors[i] = {'name': ['Domain with this Name already exists.']}
+    return [form for i, form in valid if i not in errors], errors
+
+
+def create(forms, owner):
+    """Insert the domains of valid forms and their checks."""
+    domains = []
+    for form in forms:
+        # Validation has built the unsaved instances
+        domain = form.instance
+        domain.owner = owner
+        domain._checks = [f.instance for f in form.checks.forms if f.has_changed()]
+        domains.append(domain)
+    with transaction.atomic():
+        Domain.objects.bulk_create(domains)
+        # Bulk inserts don't set the primary keys on all databases
+        pks = dict(Domain.objects.filter(
+            name__in=[d.name for d in domains]).values_list('name', 'pk'))
+        checks = []
+        for domain in domains:
+            domain.pk = pks[domain.name]
+            for check in domain._checks:
+                check.domain = domain
+                checks.append(check)
+        DomainCheck.objects.bulk_create(checks)
+    return domains
+
+
+def provision(domains, owner, chunk_size=500):
+    """Create domains for the owner from an iterable of dicts.
+
+    Invalid domains are skipped. Returns the number of domains created and
+    the errors of the rest by their position in the iterable.
+    """
+    domains = iter(domains)
+    created, errors = 0, {}
+    for start in itertools.count(0, chunk_size):
+        chunk = list(itertools.islice(domains, chunk_size))
+        if not chunk:
+            break
+        forms, chunk_errors = validate(chunk)
+        created += len(create(forms, owner)) if forms else 0
+        errors.update((start + i, error) for i, error in chunk_errors.items())
+    return created, errors
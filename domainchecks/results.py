@@ -0,0 +1,189 @@
+"""Write path for check results.
+
+Probes hand their results to a backend rather than saving them directly.
+The default backend writes each result as soon as it is published. The
+queued backends instead hand compact records to an ingestion worker which
+inserts them in batches so probing workers don't need to hold on to a
+database connection.
+"""
+import collections
+import datetime
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils.module_loading import import_string
+from django.utils.timezone import utc
+
+from .models import CheckResult, DomainCheck
+from .signals import results_recorded
+
+
+def encode(result):
+    """Convert a result into a compact JSON serializable record."""
+    return [
+        result.domain_check_id,
+        result.checked_on.timestamp(),
+        result.status_code,
+        result.response_time,
+        result.response_body,
+        result.assertion_passed,
+        result.region,
+    ]
+
+
+def decode(record):
+    """Rebuild an unsaved result from a compact record."""
+    check, timestamp, status_code, response_time, response_body, passed, region = record
+    return CheckResult(
+        domain_check_id=check,
+        checked_on=datetime.datetime.fromtimestamp(timestamp, tz=utc),
+        status_code=status_code,
+        response_time=response_time,
+        response_body=response_body,
+        assertion_passed=passed,
+        region=region,
+    )
+
+
+def known_results(results):
+    """Leave out results for checks which were deleted after they ran."""
+    results = list(results)
+    known = set(DomainCheck.objects.filter(
+        pk__in=set(result.domain_check_id for result in results)).values_list('pk', flat=True))
+    return [result for result in results if result.domain_check_id in known]
+
+
+def compact_results(results):
+    """Store results, merging them into the latest run for their check.
+
+    A result extends the run when it has the same outcome and the run
+    doesn't span more than DOMAINCHECKS_COMPACT_MAX_SPAN seconds.
+    """
+    max_span = datetime.timedelta(seconds=settings.DOMAINCHECKS_COMPACT_MAX_SPAN)
+    checks = set(result.domain_check_id for result in results)
+    latest = CheckResult.objects.filter(domain_check__in=checks).values(
+        'domain_check', 'region').annotate(latest=Max('pk')).values_list('latest', flat=True)
+    runs = dict(
+        ((run.domain_check_id, run.region), run)
+        for run in CheckResult.objects.select_for_update().filter(pk__in=list(latest)))
+    created, extended = [], set()
+    for result in sorted(results, key=lambda r: r.checked_on):
+        key = (result.domain_check_id, result.region)
+        run = runs.get(key)
+        if (run is not None and run.outcome == result.outcome and
+                run.last_checked_on <= result.checked_on <= run.checked_on + max_span):
+            run.extend_run(result)
+            if run.pk is not None:
+                extended.add(run)
+        else:
+            created.append(result)
+            runs[key] = result
+    for run in extended:
+        run.save(update_fields=(
+            'last_checked_on', 'count', 'response_time',
+            'response_time_min', 'response_time_max', ))
+    CheckResult.objects.bulk_create(created)
+
+
+def record_results(results):
+    """Insert a batch of results and notify any listeners."""
+    results = list(results)
+    if results:
+        for result in results:
+            result.start_run()
+        with transaction.atomic():
+            if settings.DOMAINCHECKS_COMPACT_RESULTS:
+                compact_results(results)
+            else:
+                CheckResult.objects.bulk_create(results)
+        results_recorded.send(sender=CheckResult, results=results)
+    return len(results)
+
+
+class DatabaseBackend(object):
+    """Write each result to the database as soon as it is published."""
+
+    def publish(self, result):
+        record_results([result])
+
+    def publish_many(self, results):
+        record_results(results)
+
+    def flush(self):
+        pass
+
+
+class MemoryBackend(object):
+    """Hold published records in memory until they are drained.
+
+    This stands in for the broker when running the tests or a single
+    process which wants to control when results are written.
+    """
+
+    def __init__(self):
+        self.queue = collections.deque()
+
+    def publish(self, result):
+        self.queue.append(encode(result))
+
+    def publish_many(self, results):
+        self.queue.extend(encode(result) for result in results)
+
+    def flush(self):
+        pass
+
+    def drain(self, batch_size=None):
+        """Ingest the queued records and return the number written."""
+        batch_size = batch_size or settings.DOMAINCHECKS_INGEST_BATCH_SIZE
+        count = 0
+        while self.queue:
+            batch = []
+            while self.queue and len(batch) < batch_size:
+                batch.append(decode(self.queue.popleft()))
+            count += record_results(known_results(batch))
+        return count
+
+
+class CeleryBackend(object):
+    """Publish batches of records to be written by the ingestion task.
+
+    Probes in other threads of the process can publish at the same time.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def publish(self, result):
+        with self.lock:
+            self.pending.append(encode(result))
+            full = len(self.pending) >= settings.DOMAINCHECKS_INGEST_BATCH_SIZE
+        if full:
+            self.flush()
+
+    def publish_many(self, results):
+        with self.lock:
+            self.pending.extend(encode(result) for result in results)
+        self.flush()
+
+    def flush(self):
+        from .tasks import ingest_results
+
+        with self.lock:
+            records, self.pending = self.pending, []
+        if records:
+            ingest_results.delay(records)
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured result backend for this process."""
+    global _backend
+    path = settings.DOMAINCHECKS_RESULT_BACKEND
+    if _backend is None or _backend.__class__ != import_string(path):
+        _backend = import_string(path)()
+    return _backend
@@ -0,0 +1,111 @@
+"""Send dashboard reads to read replicas.
+
+Only reads made inside ``replica_reads()`` go to the replicas listed in
+DOMAINCHECKS_REPLICAS, everything else including all writes uses the
+primary ``default`` database. Replicas which have fallen more than
+DOMAINCHECKS_REPLICA_MAX_LAG seconds behind are skipped until they catch
+up, and users who have just made a change read from the primary for the
+same time so they see their own writes.
+"""
+import contextlib
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+
+_state = threading.local()
+
+# Replica lag is measured at most this often (in seconds) per process
+LAG_CHECK_INTERVAL = 5
+
+_lag = {}
+
+_choices = itertools.count()
+
+# Session key holding the time of the user's last change
+PIN_KEY = 'domainchecks_wrote_on'
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    """Read from a replica for the duration of the block."""
+    previous = getattr(_state, 'enabled', False)
+    _state.enabled = enabled
+    try:
+        yield
+    finally:
+        _state.enabled = previous
+
+
+def pin_to_primary(request):
+    """Read the user's own writes from the primary for a while."""
+    if hasattr(request, 'session'):
+        request.session[PIN_KEY] = time.time()
+
+
+def is_pinned(request):
+    wrote_on = getattr(request, 'session', {}).get(PIN_KEY)
+    return wrote_on is not None and time.time() - wrote_on < settings.DOMAINCHECKS_REPLICA_MAX_LAG
+
+
+def measure_lag(alias):
+    """Seconds the replica is behind the primary or None if it can't be reached."""
+    connection = connections[alias]
+    try:
+        if connection.vendor != 'postgresql':
+            # Other backends don't report replication lag
+            connection.ensure_connection()
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_is_in_recovery(), '
+                'EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())')
+            recovering, lag = cursor.fetchone()
+    except DatabaseError:
+        return None
+    # The replay time doesn't move while the primary is idle, which can't
+    # last long with results being written every few seconds.
+    return (lag or 0) if recovering else 0
+
+
+def replica_lag(alias):
+    """Recently measured lag of the replica."""
+    measured_on, lag = _lag.get(alias, (None, None))
+    if measured_on is None or time.time() - measured_on > LAG_CHECK_INTERVAL:
+        lag = measure_lag(alias)
+        _lag[alias] = (time.time(), lag)
+    return lag
+
+
+def get_replica():
+    """Pick the next replica which is up to date enough, if any."""
+    replicas = list(settings.DOMAINCHECKS_REPLICAS)
+    start = next(_choices)
+    for i in range(len(replicas)):
+        alias = replicas[(start + i) % len(replicas)]
+        lag = replica_lag(alias)
+        if lag is not None and lag <= settings.DOMAINCHECKS_REPLICA_MAX_LAG:
+            return alias
+    return None
+
+
+class ReplicaRouter(object):
+    """Route reads inside ``replica_reads()`` to the replicas."""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'enabled', False):
+            return get_replica() or 'default'
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model=None, **hints):
+        return db not in settings.DOMAINCHECKS_REPLICAS
@@ -0,0 +1,140 @@
+"""Spread check due times across their intervals.
+
+Each check is given a fixed offset within its interval which is derived
+from its primary key. Checks with the same interval become due at evenly
+spaced moments rather than all at once, and a given check always lands in
+the same slot so its results stay evenly spaced as well.
+
+When more checks are due than the probes can run they are shared out
+between owners so one large account can't crowd out the others.
+"""
+import collections
+import datetime
+import math
+
+from django.utils.timezone import utc
+
+
+# Fractional part of the golden ratio. Multiplying sequential ids by it
+# gives a low-discrepancy sequence so the offsets fill the interval evenly.
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
+
+# Shortest time (in seconds) between two runs of a check
+MIN_INTERVAL = 10
+
+
+def offset(check_id, interval):
+    """Deterministic offset (in seconds) of the check within its interval."""
+    return (check_id * GOLDEN_RATIO) % 1 * interval
+
+
+def next_due(check_id, interval, last_check=None):
+    """Time the check should next run.
+
+    Checks which have never run are due immediately. Otherwise this is the
+    first slot at least half an interval after the last check so a probe
+    which ran slightly early or late doesn't cause a double check.
+    """
+    if last_check is None:
+        return None
+    due = due_timestamp(check_id, interval, last_check.timestamp())
+    return datetime.datetime.fromtimestamp(due, tz=utc)
+
+
+def due_timestamp(check_id, interval, last_check):
+    """Same as ``next_due`` with the last check as a timestamp.
+
+    Intervals below MIN_INTERVAL, from rows saved without validation, are
+    treated as MIN_INTERVAL.
+    """
+    interval = max(interval, MIN_INTERVAL)
+    earliest = last_check + interval / 2
+    slot = offset(check_id, interval)
+    periods = math.ceil((earliest - slot) / interval)
+    return periods * interval + slot
+
+
+def is_due(check_id, interval, last_check, when, early=0):
+    """Whether the check is due at the time, or up to ``early`` seconds before."""
+    due = next_due(check_id, interval, last_check)
+    return due is None or due.timestamp() - early <= when.timestamp()
+
+
+def due_checks(checks, start, window):
+    """Find the checks which become due within the window.
+
+    ``checks`` is an iterable of ``(pk, interval, last_check, ...)`` tuples
+    and this yields each tuple with the number of seconds after ``start``
+    at which it should run.
+    """
+    end = start + window
+    for check in checks:
+        pk, interval, last_check = check[:3]
+        due = next_due(pk, interval, last_check)
+        if due is None or due <= start:
+            yield check, 0
+        elif due < end:
+            yield check, (due - start).total_seconds()
+
+
+def owner_queues(due, owner, quota=None, priority=None):
+    """Group due checks by owner, most urgent first, up to their quota."""
+    def due_on(item):
+        check, countdown = item
+        due = next_due(*check[:3])
+        return (
+            0 if priority is None else priority(check),
+            countdown, -math.inf if due is None else due.timestamp())
+
+    queues = collections.OrderedDict()
+    for check, countdown in sorted(due, key=due_on):
+        queues.setdefault(owner(check), collections.deque()).append((check, countdown))
+    for key, queue in queues.items():
+        limit = None if quota is None else quota(key)
+        while limit is not None and len(queue) > limit:
+            queue.pop()
+    return queues
+
+
+def round_robin(queues, capacity, weights):
+    """Take up to capacity checks from the owner queues by their weights."""
+    shared = [(key, queue) for key, queue in queues.items() if weights[key] > 0]
+    chosen = []
+    deficits = collections.Counter()
+    while len(chosen) < capacity and any(queue for key, queue in shared):
+        for key, queue in shared:
+            deficits[key] += weights[key]
+            while queue and deficits[key] >= 1 and len(chosen) < capacity:
+                chosen.append(queue.popleft())
+                deficits[key] -= 1
+    # Owners without a weight only get the spare capacity
+    for queue in queues.values():
+        while queue and len(chosen) < capacity:
+            chosen.append(queue.popleft())
+    return chosen
+
+
+def fair_share(due, owner, capacity=None, quota=None, weight=None, priority=None):
+    """Pick the due checks to run, sharing the capacity between owners.
+
+    ``due`` is an iterable of ``(check, countdown)`` pairs as yielded by
+    ``due_checks`` and ``owner`` returns the owner of a check. Checks with
+    a lower ``priority(check)`` go first, then the most overdue. Each
+    owner runs at most ``quota(owner)`` checks and when there are more
+    than ``capacity`` in total each priority in turn is shared out in a
+    deficit round robin weighted by ``weight(owner)``. The remaining
+    checks stay due for the next window.
+    """
+    queues = owner_queues(due, owner, quota=quota, priority=priority)
+    if capacity is None:
+        return [item for queue in queues.values() for item in queue]
+    weights = dict((key, 1 if weight is None else weight(key)) for key in queues)
+    lanes = collections.defaultdict(collections.OrderedDict)
+    for key, queue in queues.items():
+        for check, countdown in queue:
+            lane = lanes[0 if priority is None else priority(check)]
+            lane.setdefault(key, collections.deque()).append((check, countdown))
+    chosen = []
+    for level in sorted(lanes):
+        chosen.extend(round_robin(lanes[level], capacity - len(chosen), weights))
+    return chosen
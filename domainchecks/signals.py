@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+
+# Sent once per batch after check results have been written to the database.
+# ``results`` is the list of new CheckResult instances, one per probe.
+# With compact storage some of them were merged into existing rows.
+results_recorded = Signal(providing_args=['results'])
@@ -0,0 +1,56 @@
+(function ($) {
+    'use strict';
+
+    var $live = $('.live-updates[data-url]'),
+        url = $live.data('url'),
+        statuses = 'good fair poor unknown';
+
+    function updateStatus($section, item) {
+        var rate = item['success_rate'],
+            $rate = $section.find('.success-rate');
+        $rate.removeClass(statuses).addClass(item['status']);
+        $rate.find('.value')
+            .attr('title', item['successes'] + ' of ' + (item['pings'] || 0))
+            .text((rate === null ? 'Unknown' : rate) + '%');
+        $section.find('.last-check .value').text('0 minutes ago');
+    }
+
+    function applyChanges(data) {
+        (data.checks || data.domains || []).forEach(function (item) {
+            updateStatus($('section[data-id="' + item['id'] + '"]'), item);
+        });
+        $.each(data.points || {}, function (check, points) {
+            $('section[data-id="' + check + '"] .charts').trigger('points', [points]);
+        });
+    }
+
+    function poll(version) {
+        var params = {version: version},
+            statusWindow = $live.data('window');
+        if (statusWindow) {
+            params.window = statusWindow;
+        }
+        $.getJSON(url, params).done(function (data) {
+            if (data.reset) {
+                location.reload();
+                return;
+            }
+            applyChanges(data);
+            setTimeout(function () {
+                poll(data.version);
+            }, (data.retry || 0) * 1000);
+        }).fail(function () {
+            // Back off before asking again
+            setTimeout(function () {
+                poll(version);
+            }, 10000);
+        });
+    }
+
+    if (url) {
+        $.getJSON(url).done(function (data) {
+            poll(data.version);
+        });
+    }
+
+})(jQuery);
@@ -3,14 +3,28 @@
 
     var chartOptions = JSON.parse($('#chartOptions').text());
 
+    function expandRuns(data) {
+        // Compacted results span a run of checks so plot both ends.
+        // Results are newest first so the end of the run comes first.
+        var points = [];
+        data.forEach(function (item) {
+            if (item['count'] > 1 && item['last_checked_on'] !== item['checked_on']) {
+                points.push($.extend({}, item, {'checked_on': item['last_checked_on']}));
+            }
+            points.push(item);
+        });
+        return points;
+    }
+
     function renderResponseTimes(elem, data) {
-        var series = data.map(function (item) {
+        var points = expandRuns(data),
+            series = points.map(function (item) {
                 return [
                     Date.parse(item['checked_on']),
                     item['response_time'] * 1000
                 ];
             }),
-            errors = data.map(function (item) {
+            errors = points.map(function (item) {
                 return [
                     Date.parse(item['checked_on']),
                     item['status_code'] > 299 ? item['response_time'] * 1000 || 0 : null
@@ -28,7 +42,39 @@
             .replace(/\.\d+Z$/, ' ');
     }
 
-    $('.charts[data-url]').each(function (row) {
+    function whenVisible(elems, callback) {
+        // Run the callback once for each element as it is scrolled into view
+        if (!('IntersectionObserver' in window)) {
+            elems.each(function () {
+                callback.call(this);
+            });
+            return;
+        }
+        var observer = new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    callback.call(entry.target);
+                }
+            });
+        }, {rootMargin: '200px'});
+        elems.each(function () {
+            observer.observe(this);
+        });
+    }
+
+    $('.charts[data-url]').on('points', function (e, points) {
+        // New results pushed by the live updates, oldest first
+        var $row = $(this),
+            results = $row.data('results');
+        if (results) {
+            results = points.slice().reverse().concat(results);
+            $row.data('results', results);
+            renderResponseTimes($row.find('.response-time'), results);
+        }
+    });
+
+    whenVisible($('.charts[data-url]'), function () {
         var $row = $(this),
             url = $row.data('url'),
             responseTime = $row.find('.response-time'),
@@ -44,6 +90,7 @@
             start.setHours(now.getHours() - offset);
             params.start = dateString(start);
             $.getJSON(url, params).done(function (data) {
+                $row.data('results', data.results);
                 renderResponseTimes(responseTime, data.results);
             });
         });
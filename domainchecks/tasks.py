@@ -1,34 +1,255 @@
+import collections
 import datetime
+import time
 
 from celery import group, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
 
-from . import models
+from django.conf import settings
+from django.utils.timezone import now
+
+from . import alerts, duequeue, models, results, scheduling, workers
 
 
 logger = get_task_logger(__name__)
 
 
-@shared_task
-def check_domain(name, minutes=10, timeout=10):
-    """Run active and stale checks for the given domain."""
-    cutoff = datetime.timedelta(minutes=minutes)
-    checks = models.DomainCheck.objects.active().stale(cutoff=cutoff).filter(
+def time_limits(timeout, count):
+    """Soft and hard time limits (in seconds) for probing count checks."""
+    margin = settings.DOMAINCHECKS_PROBE_TIME_MARGIN
+    soft = (timeout + margin) * max(count, 1)
+    return soft, soft + margin
+
+
+# Lanes of due checks, in the order they are given capacity
+PRIORITY_HIGH, PRIORITY_NORMAL = 0, 1
+
+
+def check_priority(check):
+    """Checks with an uncertain status are run first.
+
+    These are checks which have never run and the ones which are failing
+    or waiting to change status.
+    """
+    pk, interval, last_check, name, status, pending, owner = check
+    if last_check is None or status in ('fair', 'poor') or pending:
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+def fair_share(due, window):
+    """Limit the due checks to the owner quotas and the room the probes have."""
+    quotas = dict((q.owner_id, q) for q in models.OwnerQuota.objects.all())
+    default_rate = settings.DOMAINCHECKS_OWNER_PROBE_RATE
+    capacity = settings.DOMAINCHECKS_PROBE_CAPACITY
+
+    def quota(owner):
+        rate = getattr(quotas.get(owner), 'probes_per_minute', None) or default_rate
+        return None if rate is None else max(1, int(rate * window / 60))
+
+    def weight(owner):
+        return getattr(quotas.get(owner), 'weight', 1)
+
+    if capacity is not None:
+        capacity = max(1, int(capacity * window / 60))
+    room = workers.available_capacity()
+    if room is not None:
+        capacity = room if capacity is None else min(capacity, room)
+    return scheduling.fair_share(
+        due, owner=lambda check: check[-1], quota=quota, weight=weight,
+        priority=check_priority, capacity=capacity)
+
+
+@shared_task(acks_late=True)
+def check_domain(name, minutes=10, timeout=10, checks=None, queued_on=None):
+    """Run active and stale checks for the given domain.
+
+    When the scheduler passes the ids of the due ``checks`` only those are
+    run and the stale cutoff isn't used. Checks which have run since they
+    were queued, by another task for the same slot, are skipped. The
+    message is acknowledged once the checks have run so they are picked up
+    again if the worker is lost. When the worker is shutting down, or the
+    soft time limit is reached, the checks which haven't started are queued
+    again. The same happens once the time left is too short for another
+    probe, so the checks are queued again before the soft limit in pools
+    which don't enforce it (gevent and eventlet only have the hard limit).
+    ``queued_on`` is the minute the checks were counted as in flight.
+    """
+    queryset = models.DomainCheck.objects.active().filter(
         domain__name=name).select_related('domain')
+    if checks is None:
+        cutoff = datetime.timedelta(minutes=minutes)
+        queryset = queryset.stale(cutoff=cutoff)
+    else:
+        queryset = queryset.filter(pk__in=checks).last_checked()
+    # Countdowns are whole seconds so tasks can start just before the slot
+    early = settings.DOMAINCHECKS_PROBE_TIME_MARGIN
     count = 0
-    for check in checks:
-        logger.debug('Running check %s', check)
-        check.run_check(timeout=timeout)
-        count += 1
+    remaining = []
+    pending = list(queryset.order_by('pk'))
+    started = 0
+    soft, hard = time_limits(timeout, len(pending))
+    deadline = time.monotonic() + soft - timeout
+    try:
+        for check in pending:
+            started += 1
+            if checks is not None and not scheduling.is_due(
+                    check.pk, check.interval, check.last_check, now(), early=early):
+                logger.info('Skipping check %s which has run since it was queued', check)
+                continue
+            if workers.is_draining() or time.monotonic() > deadline:
+                remaining.append(check.pk)
+                continue
+            logger.debug('Running check %s', check)
+            check.run_check(timeout=timeout)
+            count += 1
+    except SoftTimeLimitExceeded:
+        logger.warning('Time limit reached after %d check(s) for %s', count, name)
+        # The probe in progress is given up and the ones after it run later
+        remaining.extend(check.pk for check in pending[started:])
+    finally:
+        results.get_backend().flush()
+        if remaining:
+            requeue(name, timeout, remaining, queued_on)
+        if queued_on is not None:
+            workers.remove_in_flight(len(checks) - len(remaining), queued_on)
     logger.info('Completed %d check(s) for %s', count, name)
 
 
-@shared_task
-def queue_domains(minutes=10, timeout=10):
-    """Queue domains to be checked."""
-    domains = models.DomainCheck.objects.active().values_list(
-        'domain__name', flat=True).distinct()
-    subtasks = group(*(
-        check_domain.s(name, minutes=minutes, timeout=timeout)
-        for name in domains))
+def requeue(name, timeout, checks, queued_on):
+    """Queue the checks a task didn't get to again on the same queue."""
+    soft, hard = time_limits(timeout, len(checks))
+    options = {'soft_time_limit': soft, 'time_limit': hard}
+    queue = (check_domain.request.delivery_info or {}).get('routing_key')
+    if queue:
+        options['queue'] = queue
+    check_domain.apply_async(
+        (name, ), {'timeout': timeout, 'checks': checks, 'queued_on': queued_on}, **options)
+    logger.warning('Queued %d check(s) for %s again', len(checks), name)
+
+
+def taken_checks(queryset, pks, batch_size=500):
+    """Read the checks taken from the due queue in batches.
+
+    Their latest results are read again since other processes may have
+    run or queued them since this process's queue was updated.
+    """
+    for i in range(0, len(pks), batch_size):
+        yield from queryset.filter(pk__in=pks[i:i + batch_size])
+
+
+def return_checks(queue, taken, checks, chosen, start):
+    """Schedule the checks taken from the due queue again.
+
+    Queued checks are expected to run in their slot and the others are
+    scheduled from their latest result. Checks which are no longer active
+    were dropped from the query and are removed.
+    """
+    slots = dict((check[0], start.timestamp() + countdown) for check, countdown in chosen)
+    for check in checks:
+        pk, interval, last_check = check[:3]
+        queue.finish(pk, slots.get(pk, duequeue.timestamp(last_check)))
+    for pk in set(taken) - set(check[0] for check in checks):
+        queue.remove(pk)
+
+
+def send_checks(checks, start, window, timeout):
+    """Queue the due checks within the limits in per-domain batches.
+
+    Returns the due checks and the ones which were queued with their
+    countdowns.
+    """
+    batches = collections.defaultdict(list)
+    due = list(scheduling.due_checks(
+        checks, start=start, window=datetime.timedelta(seconds=window)))
+    due = workers.not_queued(due)
+    chosen = fair_share(due, window)
+    workers.mark_queued(chosen)
+    for check, countdown in chosen:
+        batches[(check_priority(check), check[3], int(countdown))].append(check[0])
+    kwargs = {'timeout': timeout}
+    if workers.max_in_flight() is not None:
+        kwargs['queued_on'] = workers.current_minute()
+        workers.add_in_flight(len(chosen), kwargs['queued_on'])
+    size = settings.DOMAINCHECKS_PROBE_BATCH_SIZE
+    subtasks = []
+    for (priority, name, countdown), pks in sorted(batches.items()):
+        for i in range(0, len(pks), size):
+            soft, hard = time_limits(timeout, len(pks[i:i + size]))
+            options = {'countdown': countdown, 'soft_time_limit': soft, 'time_limit': hard}
+            if priority == PRIORITY_HIGH:
+                options['queue'] = settings.DOMAINCHECKS_PRIORITY_QUEUE
+            subtasks.append(
+                check_domain.s(name, checks=pks[i:i + size], **kwargs).set(**options))
+    subtasks = group(*subtasks)
     subtasks.delay()
+    logger.info('Queued %d domain batch(es)', len(subtasks))
+    return due, chosen
+
+
+@shared_task
+def queue_domains(window=60, timeout=10):
+    """Queue the checks which become due in the next window (in seconds).
+
+    Each domain's due checks are sent with a countdown to their slot so the
+    probes are spread out evenly instead of all starting together. Checks
+    already queued for their slot aren't queued again. Checks with an
+    uncertain status go to DOMAINCHECKS_PRIORITY_QUEUE. With
+    DOMAINCHECKS_DUE_QUEUE only the checks the in-memory due queue has
+    due in the window are read from the database. If queueing fails the
+    checks taken from the due queue are put back at their due time.
+    """
+    start = now()
+    end = start + datetime.timedelta(seconds=window)
+    queryset = models.DomainCheck.objects.active().last_checked().values_list(
+        'pk', 'interval', 'last_check', 'domain__name',
+        'checkstate__status', 'checkstate__pending_status', 'domain__owner')
+    if not settings.DOMAINCHECKS_DUE_QUEUE:
+        due, chosen = send_checks(queryset, start, window, timeout)
+    else:
+        queue = duequeue.get_queue()
+        taken = queue.pop_due(end.timestamp())
+        try:
+            checks = list(taken_checks(queryset, taken))
+            due, chosen = send_checks(checks, start, window, timeout)
+        except Exception:
+            # Taken checks are only scheduled again once they are returned
+            for pk in taken:
+                queue.release(pk)
+            raise
+        return_checks(queue, taken, checks, chosen, start)
+    if len(chosen) < len(due):
+        logger.warning('Deferred %d due check(s) over the limits', len(due) - len(chosen))
+
+
+@shared_task
+def ingest_results(records):
+    """Write a batch of compact result records published by the probes.
+
+    Records for checks which have been deleted since they were probed are
+    dropped so they don't fail the rest of the batch.
+    """
+    batch = [results.decode(r) for r in records]
+    count = results.record_results(results.known_results(batch))
+    if count < len(batch):
+        logger.warning('Dropped %d result(s) for deleted checks', len(batch) - count)
+    logger.info('Ingested %d result(s)', count)
+
+
+@shared_task
+def prune_status_buckets():
+    """Remove status buckets older than the retention period."""
+    retention = datetime.timedelta(seconds=settings.DOMAINCHECKS_STATUS_RETENTION)
+    models.StatusBucket.objects.prune(before=now() - retention)
+    models.DomainStatusBucket.objects.prune(before=now() - retention)
+
+
+@shared_task
+def deliver_alerts():
+    """Send queued alerts and remove delivered ones past the retention period."""
+    count = alerts.deliver_alerts()
+    if count:
+        logger.info('Delivered %d alert(s)', count)
+    retention = datetime.timedelta(days=settings.DOMAINCHECKS_ALERT_RETENTION)
+    models.AlertEvent.objects.filter(delivered_on__lt=now() - retention).delete()
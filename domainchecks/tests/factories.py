@@ -1,10 +1,13 @@
 import random
 import string
 
+from unittest.mock import Mock
+
 from django.contrib.auth import get_user_model
 from django.utils.timezone import now
 
 from .. import models
+from ..signals import results_recorded
 
 
 def create_user(**kwargs):
@@ -65,7 +68,9 @@ def create_check_result(**kwargs):
     values.update(kwargs)
     if 'domain_check' not in values:
         values['domain_check'] = create_domain_check()
-    return models.CheckResult.objects.create(**values)
+    result = models.CheckResult.objects.create(**values)
+    results_recorded.send(sender=models.CheckResult, results=[result])
+    return result
 
 
 def build_domain_form_data(domain=None):
@@ -91,6 +96,10 @@ def build_domain_form_data(domain=None):
                 'checks-{}-path'.format(i): check.path,
                 'checks-{}-method'.format(i): check.method,
                 'checks-{}-is_active'.format(i): 'on' if check.is_active else '',
+                'checks-{}-interval'.format(i): check.interval,
+                'checks-{}-status_only'.format(i): 'on' if check.status_only else '',
+                'checks-{}-assertion'.format(i): check.assertion,
+                'checks-{}-assertion_value'.format(i): check.assertion_value,
                 'checks-{}-id'.format(i): check.pk,
                 'checks-{}-domain'.format(i): domain.pk,
             })
@@ -100,7 +109,23 @@ def build_domain_form_data(domain=None):
                 'checks-{}-path'.format(i): '/' if domain is None and i == 0 else '',
                 'checks-{}-method'.format(i): 'get',
                 'checks-{}-is_active'.format(i): 'on',
+                'checks-{}-interval'.format(i): '120',
                 'checks-{}-id'.format(i): '',
                 'checks-{}-domain'.format(i): domain.pk if domain else '',
             })
     return data
+
+
+def build_response(status_code=200, body='Ok', **kwargs):
+    """Build a mock streamed response from requests."""
+    values = {
+        'status_code': status_code,
+        'encoding': 'utf-8',
+        'headers': {},
+    }
+    values.update(kwargs)
+    response = Mock(**values)
+    content = body.encode('utf-8')
+    response.iter_content.side_effect = lambda size: (
+        content[i:i + size] for i in range(0, len(content), size))
+    return response
@@ -136,3 +136,15 @@ class DomainCheckAdminTestCase(TestCase):
         not_selected.refresh_from_db()
         self.assertFalse(selected.is_active)
         self.assertTrue(not_selected.is_active)
+
+    def test_mark_inactive_changed(self):
+        """Checks made inactive are marked as changed."""
+        selected = factories.create_domain_check()
+        before = now()
+        request = self.factory.get('/admin/')
+        qs = self.admin.get_queryset(request).filter(pk=selected.pk)
+        with patch.object(self.admin, 'message_user'):
+            self.admin.mark_inactive(request, qs)
+        self.assertQuerysetEqual(
+            models.DomainCheck.objects.changed_since(before), [selected.pk],
+            transform=lambda x: x.pk)
@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, patch
+
+from requests.exceptions import ConnectionError
+
+from django.test import SimpleTestCase
+
+from .. import agent, probes
+
+
+class AgentTestCase(SimpleTestCase):
+    """Standalone probe agent."""
+
+    def setUp(self):
+        self.agent = agent.Agent('http://status.example.com/', 'secret', limit=2)
+        self.agent.session = Mock()
+        self.checks = {
+            'fields': ['id', 'method', 'url', 'status_only',
+                       'assertion', 'assertion_value', 'max_bytes'],
+            'checks': [
+                [1, 'get', 'http://example.com/', False, '', '', 100],
+                [2, 'head', 'http://example.com/x/', True, '', '', 100],
+            ],
+        }
+
+    def test_key_header(self):
+        """Requests are authenticated with the agent key."""
+        result = agent.Agent('http://status.example.com', 'secret')
+        self.assertEqual(result.session.headers['Authorization'], 'Token secret')
+
+    def test_fetch_checks(self):
+        """Checks are built from the server's fields."""
+        self.agent.session.get.return_value.json.return_value = self.checks
+        checks = self.agent.fetch_checks()
+        self.agent.session.get.assert_called_once_with(
+            'http://status.example.com/agent/checks/', params={'limit': 2}, timeout=10)
+        self.assertEqual(len(checks), 2)
+        self.assertEqual(checks[0].id, 1)
+        self.assertEqual(checks[1].url, 'http://example.com/x/')
+        self.assertTrue(checks[1].status_only)
+
+    @patch('domainchecks.agent.probes.probe')
+    def test_run_check(self, mock_probe):
+        """Result record matches the format expected by the server."""
+        mock_probe.return_value = probes.ProbeResult(200, 0.5, 'Ok', None)
+        self.agent.session.get.return_value.json.return_value = self.checks
+        check = self.agent.fetch_checks()[0]
+        record = self.agent.run_check(check)
+        mock_probe.assert_called_once_with(
+            check, timeout=10, max_bytes=100, breaker=None)
+        self.assertEqual(record[0], 1)
+        self.assertEqual(record[2:], [200, 0.5, 'Ok', None])
+
+    @patch('domainchecks.agent.probes.probe')
+    def test_run_once(self, mock_probe):
+        """Batch of checks are probed and the results pushed together."""
+        mock_probe.return_value = probes.ProbeResult(200, 0.5, 'Ok', None)
+        self.agent.session.get.return_value.json.return_value = self.checks
+        self.agent.session.post.return_value.json.return_value = {'accepted': 2}
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            count = self.agent.run_once(pool)
+        self.assertEqual(count, 2)
+        self.assertEqual(mock_probe.call_count, 2)
+        args, kwargs = self.agent.session.post.call_args
+        self.assertEqual(args, ('http://status.example.com/agent/results/', ))
+        self.assertEqual([r[0] for r in kwargs['json']['results']], [1, 2])
+
+    def test_nothing_due(self):
+        """Nothing is pushed when there are no due checks."""
+        self.agent.session.get.return_value.json.return_value = {
+            'fields': self.checks['fields'], 'checks': []}
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            count = self.agent.run_once(pool)
+        self.assertEqual(count, 0)
+        self.assertFalse(self.agent.session.post.called)
+
+    @patch('domainchecks.agent.logger')
+    def test_server_unavailable(self, mock_logger):
+        """Agent keeps running when the server can't be reached."""
+        self.agent.session.get.side_effect = ConnectionError
+        self.agent.run(once=True)
+        self.assertTrue(mock_logger.warning.called)
+        self.assertFalse(self.agent.session.post.called)
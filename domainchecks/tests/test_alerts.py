@@ -0,0 +1,155 @@
+import datetime
+import json
+import os
+import tempfile
+
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from .. import alerts, models
+from . import factories
+
+
+@override_settings(
+    DOMAINCHECKS_ALERT_CONFIRM=2, DOMAINCHECKS_ALERT_HYSTERESIS=5,
+    DOMAINCHECKS_ALERT_FLAP_LIMIT=2, DOMAINCHECKS_ALERT_FLAP_WINDOW=3600)
+class CheckStateTestCase(TestCase):
+    """Status transitions of a single check."""
+
+    def setUp(self):
+        self.state = models.CheckState(status='good')
+        self.when = now()
+
+    def evaluate(self, *rates):
+        kinds = []
+        for rate in rates:
+            self.when += datetime.timedelta(minutes=1)
+            kinds.append(self.state.evaluate(rate, self.when))
+        return kinds
+
+    def test_hysteresis(self):
+        """The rate must be well past the threshold to change status."""
+        self.assertEqual(self.state.classify(88), 'good')
+        self.assertEqual(self.state.classify(84), 'fair')
+        self.state.status = 'poor'
+        self.assertEqual(self.state.classify(77), 'poor')
+        self.assertEqual(self.state.classify(81), 'fair')
+        self.assertEqual(self.state.classify(100), 'good')
+
+    def test_confirm_transition(self):
+        """A new status must hold for consecutive evaluations."""
+        self.assertEqual(self.evaluate(50, 100, 50, 50), [None, None, None, 'transition'])
+        self.assertEqual(self.state.status, 'poor')
+        self.assertEqual(self.state.changed_on, self.when)
+        self.assertEqual(self.state.pending_count, 0)
+
+    def test_first_status(self):
+        """New checks only alert when they don't start out good."""
+        self.state.status = 'unknown'
+        self.assertEqual(self.evaluate(100, 100), [None, None])
+        self.assertEqual(self.state.status, 'good')
+        self.state.status = 'unknown'
+        self.assertEqual(self.evaluate(0, 0), [None, 'transition'])
+
+    def test_flapping(self):
+        """Repeated transitions are reported once as flapping."""
+        kinds = self.evaluate(50, 50, 100, 100, 50, 50, 100, 100)
+        self.assertEqual(
+            [kind for kind in kinds if kind], ['transition', 'transition', 'flapping'])
+        self.assertTrue(self.state.is_flapping)
+        self.assertEqual(self.state.status, 'good')
+
+    def test_stable(self):
+        """Flapping checks alert again once they have settled."""
+        self.evaluate(50, 50, 100, 100, 50, 50)
+        self.assertTrue(self.state.is_flapping)
+        self.when += datetime.timedelta(hours=1)
+        self.assertEqual(self.evaluate(50), ['stable'])
+        self.assertFalse(self.state.is_flapping)
+        self.assertEqual(self.evaluate(100, 100), [None, 'transition'])
+
+
+@override_settings(DOMAINCHECKS_ALERT_CONFIRM=1)
+class EvaluateChecksTestCase(TestCase):
+    """Evaluating checks as their results are recorded."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+
+    def test_transition_event(self):
+        """A transition adds an event to the outbox."""
+        factories.create_check_result(domain_check=self.check)
+        self.assertFalse(models.AlertEvent.objects.exists())
+        self.assertEqual(models.CheckState.objects.get(pk=self.check.pk).status, 'good')
+        factories.create_check_result(domain_check=self.check, status_code=500)
+        factories.create_check_result(domain_check=self.check, status_code=500)
+        event = models.AlertEvent.objects.get()
+        self.assertEqual(event.domain_check, self.check)
+        self.assertEqual(event.kind, 'transition')
+        self.assertEqual((event.previous_status, event.status), ('good', 'poor'))
+        self.assertEqual(event.success_rate, 50)
+        self.assertIsNone(event.delivered_on)
+
+    def test_only_recorded_checks(self):
+        """Checks without new results aren't evaluated."""
+        other = factories.create_domain_check(domain='other.com')
+        factories.create_check_result(domain_check=self.check)
+        self.assertFalse(models.CheckState.objects.filter(pk=other.pk).exists())
+
+    def test_unknown_check(self):
+        """Deleted checks are skipped."""
+        self.assertEqual(alerts.evaluate_checks([self.check.pk + 1]), 0)
+
+
+class DeliverAlertsTestCase(TestCase):
+    """Sending the outbox to the notifiers."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+        self.events = [
+            models.AlertEvent.objects.create(
+                domain_check=self.check, kind='transition',
+                previous_status='good', status=status, success_rate=50)
+            for status in ('poor', 'fair', 'good')
+        ]
+        self.file = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        self.file.close()
+        self.addCleanup(os.remove, self.file.name)
+
+    def test_file_notifier(self):
+        """Alerts are written as JSON lines in batches."""
+        with self.settings(
+                DOMAINCHECKS_ALERT_NOTIFIERS=['domainchecks.alerts.FileNotifier'],
+                DOMAINCHECKS_ALERT_FILE=self.file.name):
+            self.assertEqual(alerts.deliver_alerts(batch_size=2), 3)
+        with open(self.file.name) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['status'] for line in lines], ['poor', 'fair', 'good'])
+        self.assertEqual(lines[0]['url'], self.check.url)
+        self.assertFalse(models.AlertEvent.objects.filter(delivered_on__isnull=True).exists())
+
+    @patch('domainchecks.alerts.requests.post')
+    def test_webhook_notifier(self, mock_post):
+        """Each batch is posted to the webhook."""
+        with self.settings(
+                DOMAINCHECKS_ALERT_NOTIFIERS=['domainchecks.alerts.WebhookNotifier'],
+                DOMAINCHECKS_ALERT_WEBHOOK='http://example.com/hook'):
+            alerts.deliver_alerts()
+        args, kwargs = mock_post.call_args
+        self.assertEqual(args, ('http://example.com/hook', ))
+        self.assertEqual(len(json.loads(kwargs['data'])['alerts']), 3)
+
+    @patch('domainchecks.alerts.logger')
+    @patch('domainchecks.alerts.requests.post')
+    def test_failed_notifier(self, mock_post, mock_logger):
+        """Alerts stay in the outbox when a notifier fails."""
+        mock_post.return_value.raise_for_status.side_effect = ValueError('Bad gateway')
+        with self.settings(
+                DOMAINCHECKS_ALERT_NOTIFIERS=[
+                    'domainchecks.alerts.FileNotifier', 'domainchecks.alerts.WebhookNotifier'],
+                DOMAINCHECKS_ALERT_FILE=self.file.name):
+            self.assertEqual(alerts.deliver_alerts(), 0)
+        self.assertTrue(mock_logger.exception.called)
+        self.assertEqual(models.AlertEvent.objects.filter(delivered_on__isnull=True).count(), 3)
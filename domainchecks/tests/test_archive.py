@@ -0,0 +1,99 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.utils.timezone import utc
+
+from .. import archive, export, models
+from . import factories
+
+
+class ArchiveTestCase(TestCase):
+    """Moving old results to the archive and reading them back."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = override_settings(DOMAINCHECKS_ARCHIVE_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.check = factories.create_domain_check()
+        self.old = datetime.datetime(2026, 1, 31, 23, 59, tzinfo=utc)
+        self.results = [
+            factories.create_check_result(
+                domain_check=self.check, checked_on=self.old + datetime.timedelta(minutes=i),
+                response_time=i / 10, region='east' if i else '')
+            for i in range(4)
+        ]
+        self.results.append(factories.create_check_result(
+            domain_check=self.check, checked_on=self.old + datetime.timedelta(minutes=1),
+            status_code=None, response_time=None, assertion_passed=False))
+
+    def test_archive_results(self):
+        """Old results are moved to a file per check and month."""
+        newer = factories.create_check_result(domain_check=self.check)
+        moved = archive.archive_results(before=self.old + datetime.timedelta(days=30))
+        self.assertEqual(moved, 5)
+        self.assertEqual(list(models.CheckResult.objects.all()), [newer])
+        months = sorted(os.listdir(os.path.join(self.directory, str(self.check.pk))))
+        self.assertEqual(months, ['2026-01.bin', '2026-02.bin'])
+
+    def test_read_results(self):
+        """Archived results overlapping the range are read newest first."""
+        archive.archive_results(before=self.old + datetime.timedelta(days=30))
+        results = archive.read_results(
+            self.check.pk, self.old, self.old + datetime.timedelta(minutes=2))
+        self.assertEqual(
+            [r['id'] for r in results],
+            [self.results[2].pk, self.results[4].pk, self.results[1].pk, self.results[0].pk])
+        failed, first = results[1], results[-1]
+        self.assertEqual(first['checked_on'], self.old)
+        self.assertEqual(first['response_time'], 0)
+        self.assertEqual(first['region'], '')
+        self.assertIsNone(first['assertion_passed'])
+        self.assertIsNone(failed['status_code'])
+        self.assertIsNone(failed['response_time'])
+        self.assertFalse(failed['assertion_passed'])
+        self.assertEqual(results[0]['region'], 'east')
+
+    def test_overlapping_run(self):
+        """Runs which started before the range are included."""
+        self.results[0].last_checked_on = self.old + datetime.timedelta(minutes=10)
+        self.results[0].save()
+        archive.archive_results(before=self.old + datetime.timedelta(days=30))
+        start = self.old + datetime.timedelta(minutes=5)
+        results = archive.read_results(self.check.pk, start, start + datetime.timedelta(hours=1))
+        self.assertEqual([r['id'] for r in results], [self.results[0].pk])
+
+    def test_repeat_archive(self):
+        """Results archived twice are only kept once."""
+        rows = list(models.CheckResult.objects.values_list(*archive.FIELDS))
+        month = archive.month_start(self.old)
+        archive.write_month(self.check.pk, month, rows[:1])
+        archive.write_month(self.check.pk, month, rows[:1])
+        results = archive.read_results(self.check.pk, self.old, self.old)
+        self.assertEqual(len(results), 1)
+
+    def test_no_archive(self):
+        """No results without archived files."""
+        self.assertEqual(archive.read_results(self.check.pk, self.old, self.old), [])
+
+    def test_export(self):
+        """Exports merge the archived results with the ones still stored."""
+        archive.archive_results(before=self.old + datetime.timedelta(minutes=2))
+        rows = list(models.CheckResult.objects.order_by('pk').values_list(*archive.FIELDS))
+        # Interrupted run which left a result in both
+        archive.write_month(self.check.pk, archive.month_start(rows[0][1]), rows[:1])
+        batches = list(export.merge_archived(
+            export.result_batches(models.CheckResult.objects.all()), [self.check],
+            self.old, self.old + datetime.timedelta(hours=1), batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        exported = [row for batch in batches for row in batch]
+        self.assertEqual(
+            [row[0] for row in exported],
+            [self.results[i].pk for i in (0, 1, 4, 2, 3)])
+        self.assertEqual(exported[0][1], self.check.pk)
+        self.assertEqual(exported[0][-1], '')
+        self.assertEqual(exported[-1][-1], 'Ok')
@@ -1,10 +1,15 @@
+import json
+import tempfile
+
 from datetime import timedelta
 from io import StringIO
 from unittest.mock import Mock, patch
 
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from django.utils.timezone import now
 
+from .. import models
 from . import factories
 
 
@@ -62,10 +67,108 @@ class CheckDomainsCommandTestCase(TestCase):
         """Run command defaults with actual domain record."""
         stale = factories.create_domain_check()
         # Still want to mock the remote call
-        with patch('domainchecks.models.requests') as mock_requests:
-            mock_requests.request.return_value = Mock(
-                status_code=200, text='Ok')
+        with patch('domainchecks.probes.requests') as mock_requests:
+            mock_requests.request.return_value = factories.build_response()
             stdout, stderr = self.call_command()
             mock_requests.request.assert_called_once_with(
-                stale.method, stale.url, allow_redirects=False, timeout=10)
+                stale.method, stale.url, allow_redirects=False, timeout=10,
+                stream=True, headers={'Range': 'bytes=0-65535'})
         self.assertIn('1 domain status updated', stdout.getvalue())
+
+    @patch('domainchecks.management.commands.checkdomains.daemon')
+    def test_daemon(self, mock_daemon):
+        """Daemon option keeps running the checks until stopped."""
+        mock_daemon.run.return_value = 3
+        stdout, stderr = self.call_command(daemon=True, concurrency=5, refresh=60)
+        self.assertTrue(mock_daemon.run.called)
+        args, kwargs = mock_daemon.run.call_args
+        self.assertEqual(kwargs['concurrency'], 5)
+        self.assertEqual(kwargs['timeout'], 10)
+        self.assertEqual(kwargs['refresh_interval'], 60)
+        self.assertFalse(kwargs['stop'].is_set())
+        self.assertIn('3 domain statuses updated', stdout.getvalue())
+
+
+class ExportResultsCommandTestCase(TestCase):
+    """Management command for exporting check results."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check(domain='example.com')
+        self.result = factories.create_check_result(domain_check=self.check)
+        self.start = (self.result.checked_on - timedelta(days=40)).isoformat()
+        self.end = (self.result.checked_on + timedelta(minutes=1)).isoformat()
+
+    def call_command(self, *args):
+        with tempfile.NamedTemporaryFile() as output:
+            call_command(
+                'exportresults', '--start', self.start, '--end', self.end,
+                '--output', output.name, *args)
+            return output.read().decode('utf-8')
+
+    def test_export_check(self):
+        """Export the results of a check."""
+        output = self.call_command('--check', str(self.check.pk), '--format', 'jsonl')
+        self.assertEqual(json.loads(output)['id'], self.result.pk)
+
+    def test_export_domain(self):
+        """Export all of the checks of a domain."""
+        output = self.call_command('--domain', 'example.com')
+        self.assertEqual(len(output.splitlines()), 2)
+
+    def test_invalid_options(self):
+        """Missing checks are reported as errors."""
+        with self.assertRaises(CommandError):
+            self.call_command('--domain', 'unknown.com')
+
+
+class ArchiveResultsCommandTestCase(TestCase):
+    """Management command for archiving old results."""
+
+    @patch('domainchecks.management.commands.archiveresults.archive_results')
+    def test_archive(self, mock_archive):
+        """Results older than the given days are archived."""
+        mock_archive.return_value = 3
+        stdout = StringIO()
+        call_command('archiveresults', days=30, stdout=stdout)
+        before = mock_archive.call_args[1]['before']
+        self.assertAlmostEqual(
+            (now() - before).total_seconds(), timedelta(days=30).total_seconds(), delta=5)
+        self.assertIn('3 results archived', stdout.getvalue())
+
+
+class ProvisionDomainsCommandTestCase(TestCase):
+    """Management command for creating domains in bulk."""
+
+    def setUp(self):
+        self.user = factories.create_user()
+
+    def call_command(self, lines):
+        stdout, stderr = StringIO(), StringIO()
+        with tempfile.NamedTemporaryFile('w') as source:
+            source.write('\n'.join(lines))
+            source.flush()
+            call_command(
+                'provisiondomains', self.user.username, source.name,
+                stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_provision(self):
+        """Domains are read one per line and errors reported."""
+        stdout, stderr = self.call_command([
+            json.dumps({'name': 'a.com', 'checks': [{'path': '/'}]}),
+            '',
+            json.dumps({'name': 'b.com', 'checks': []}),
+        ])
+        self.assertIn('1 domain created, 1 skipped', stdout)
+        self.assertIn('Domain 2:', stderr)
+        self.assertTrue(models.Domain.objects.filter(name='a.com', owner=self.user).exists())
+
+    def test_invalid_json(self):
+        """Lines which aren't JSON stop the command."""
+        with self.assertRaises(CommandError):
+            self.call_command(['{"name": '])
+
+    def test_unknown_owner(self):
+        """The owner must exist."""
+        with self.assertRaises(CommandError):
+            call_command('provisiondomains', 'nobody', '-')
@@ -0,0 +1,105 @@
+import threading
+
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+from django.utils.timezone import now
+
+from .. import daemon, duequeue
+from . import factories
+
+
+class RunTestCase(TestCase):
+    """Probing the due checks continuously."""
+
+    def setUp(self):
+        self.checks = [factories.create_domain_check() for i in range(3)]
+        self.stop = threading.Event()
+        self.ran = []
+
+    def run_check(self, check, timeout):
+        self.ran.append(check.pk)
+        if len(self.ran) == len(self.checks):
+            self.stop.set()
+        return now()
+
+    def test_run(self):
+        """Each due check is run once until stopped."""
+        with patch('domainchecks.daemon.run_check', side_effect=self.run_check):
+            count = daemon.run(concurrency=2, stop=self.stop)
+        self.assertEqual(count, 3)
+        self.assertEqual(sorted(self.ran), sorted(check.pk for check in self.checks))
+
+    def test_database_unavailable(self):
+        """Errors reading the checks are retried after a delay."""
+        from django.db import DatabaseError
+
+        refresh = duequeue.refresh
+        errors = [DatabaseError('Connection refused'), None]
+
+        def flaky_refresh(queue):
+            error = errors.pop(0) if errors else None
+            if error is not None:
+                raise error
+            return refresh(queue)
+
+        with patch('domainchecks.daemon.refresh', side_effect=flaky_refresh):
+            with patch('domainchecks.daemon.logger') as mock_logger:
+                with patch('domainchecks.daemon.connection') as mock_connection:
+                    with patch('domainchecks.daemon.POLL_INTERVAL', 0.01):
+                        with patch('domainchecks.daemon.run_check', side_effect=self.run_check):
+                            count = daemon.run(concurrency=2, stop=self.stop)
+        self.assertEqual(count, 3)
+        self.assertTrue(mock_logger.exception.called)
+        mock_connection.close.assert_called_once_with()
+
+    def test_load_error(self):
+        """Checks which couldn't be loaded are put back in the queue."""
+        from django.db import DatabaseError
+
+        queue = duequeue.DueQueue()
+        duequeue.refresh(queue)
+        with patch('domainchecks.daemon.load_checks', side_effect=DatabaseError()):
+            with self.assertRaises(DatabaseError):
+                daemon.take_checks(queue, 10)
+        self.assertEqual(len(queue.pop_due(now().timestamp())), 3)
+
+    def test_stopped(self):
+        """Nothing is run once stopped."""
+        self.stop.set()
+        with patch('domainchecks.daemon.run_check') as mock_run:
+            self.assertEqual(daemon.run(stop=self.stop), 0)
+        self.assertFalse(mock_run.called)
+
+    def test_load_checks(self):
+        """Checks taken from the queue are loaded with their domain."""
+        queue = duequeue.DueQueue()
+        duequeue.refresh(queue)
+        inactive = self.checks[0]
+        inactive.is_active = False
+        inactive.save()
+        pks = queue.pop_due(now().timestamp())
+        with self.assertNumQueries(1):
+            checks = daemon.load_checks(queue, pks)
+            self.assertEqual(
+                sorted(check.url for check in checks),
+                sorted(check.url for check in self.checks[1:]))
+        self.assertNotIn(inactive.pk, queue)
+
+    @patch('domainchecks.daemon.get_session')
+    def test_run_check(self, mock_session):
+        """Checks are probed with the session of the thread."""
+        check = Mock()
+        daemon.run_check(check, timeout=5)
+        check.run_check.assert_called_once_with(timeout=5, session=mock_session.return_value)
+
+    @patch('domainchecks.daemon.connection')
+    def test_database_error(self, mock_connection):
+        """Database errors close the connection of the thread."""
+        from django.db import DatabaseError
+
+        check = Mock()
+        check.run_check.side_effect = DatabaseError()
+        with patch('domainchecks.daemon.logger'):
+            daemon.run_check(check, timeout=5)
+        mock_connection.close.assert_called_once_with()
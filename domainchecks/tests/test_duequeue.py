@@ -0,0 +1,199 @@
+import datetime
+
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+
+from .. import duequeue, models, scheduling
+from . import factories
+
+
+class DueQueueTestCase(SimpleTestCase):
+    """In-memory heap of checks by their next due time."""
+
+    def setUp(self):
+        self.queue = duequeue.DueQueue()
+        self.now = now().timestamp()
+
+    def test_never_checked(self):
+        """Checks which have never run are due immediately."""
+        self.queue.add(1, 60)
+        self.assertEqual(len(self.queue), 1)
+        self.assertIn(1, self.queue)
+        self.assertEqual(self.queue.next_due(), 0)
+        self.assertEqual(self.queue.pop_due(self.now), [1])
+        self.assertTrue(self.queue.is_taken(1))
+        self.assertIsNone(self.queue.next_due())
+
+    def test_due_order(self):
+        """Checks are taken in the order they become due up to the limit."""
+        self.queue.add(1, 60, self.now)
+        self.queue.add(2, 60, self.now - 300)
+        self.queue.add(3, 60)
+        self.assertEqual(self.queue.pop_due(self.now), [3, 2])
+        self.queue.add(4, 60)
+        self.queue.add(5, 60)
+        self.assertEqual(len(self.queue.pop_due(self.now, limit=1)), 1)
+
+    def test_due_time(self):
+        """Checks are due in their slot after the last check."""
+        self.queue.add(7, 120, self.now)
+        expected = scheduling.next_due(7, 120, now().fromtimestamp(self.now)).timestamp()
+        self.assertAlmostEqual(self.queue.next_due(), expected, places=2)
+        self.assertEqual(self.queue.pop_due(expected - 1), [])
+        self.assertEqual(self.queue.pop_due(expected + 1), [7])
+
+    def test_finish(self):
+        """Finished checks are due again in their next slot."""
+        self.queue.add(1, 60)
+        self.queue.pop_due(self.now)
+        self.queue.finish(1, self.now)
+        self.assertFalse(self.queue.is_taken(1))
+        self.assertAlmostEqual(
+            self.queue.next_due(), scheduling.due_timestamp(1, 60, self.now), places=2)
+        self.assertEqual(self.queue.pop_due(self.now), [])
+
+    def test_release(self):
+        """Released checks are due at the same time again."""
+        self.queue.add(1, 60, self.now - 300)
+        due = self.queue.next_due()
+        self.queue.pop_due(self.now)
+        self.queue.release(1)
+        self.assertEqual(self.queue.next_due(), due)
+
+    def test_change_interval(self):
+        """Changed checks are scheduled with their new interval."""
+        self.queue.add(1, 3600, self.now - 300)
+        self.queue.add(1, 60)
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.pop_due(self.now), [1])
+        self.assertEqual(self.queue.pop_due(self.now), [])
+
+    def test_change_taken(self):
+        """Checks changed while taken are scheduled once they finish."""
+        self.queue.add(1, 60)
+        self.queue.pop_due(self.now)
+        self.queue.add(1, 120)
+        self.assertIsNone(self.queue.next_due())
+        self.queue.finish(1, self.now)
+        self.assertAlmostEqual(
+            self.queue.next_due(), scheduling.due_timestamp(1, 120, self.now), places=2)
+
+    def test_remove(self):
+        """Removed checks are skipped, even when they finish later."""
+        self.queue.add(1, 60)
+        self.queue.add(2, 60)
+        self.queue.pop_due(self.now, limit=1)
+        self.queue.remove(1)
+        self.queue.remove(2)
+        self.assertIsNone(self.queue.next_due())
+        self.queue.finish(1, self.now)
+        self.assertIsNone(self.queue.next_due())
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(list(self.queue), [])
+
+    def test_compact(self):
+        """Unused heap entries are dropped once they pile up."""
+        self.queue.add(1, 60)
+        for i in range(3000):
+            self.queue.add(1, 60, self.now + i)
+        self.assertLess(len(self.queue.heap), 1100)
+        self.assertEqual(self.queue.pop_due(self.now + 4000), [1])
+
+    def test_large_ids(self):
+        """Memory depends on the number of checks rather than their ids."""
+        self.queue.add(1 << 40, 60)
+        self.queue.add(100000000, 60, self.now)
+        self.assertEqual(len(self.queue.ids), 2)
+        self.assertEqual(self.queue.pop_due(self.now), [1 << 40])
+        self.assertEqual(self.queue.interval(100000000), 60)
+
+    def test_reuse_slots(self):
+        """Slots of removed checks are given to new ones."""
+        self.queue.add(1, 60)
+        self.queue.add(2, 60)
+        self.queue.remove(1)
+        self.queue.add(3, 120)
+        self.assertEqual(len(self.queue.ids), 2)
+        self.assertEqual(sorted(self.queue), [2, 3])
+        self.assertEqual(sorted(self.queue.pop_due(self.now)), [2, 3])
+        self.assertFalse(self.queue.is_taken(1))
+
+
+class RefreshTestCase(TestCase):
+    """Loading the active checks into a due queue."""
+
+    def setUp(self):
+        self.queue = duequeue.DueQueue()
+        self.check = factories.create_domain_check()
+
+    def test_load(self):
+        """Active checks are loaded with their latest result."""
+        factories.create_domain_check(is_active=False)
+        result = factories.create_check_result(domain_check=self.check)
+        self.assertEqual(duequeue.refresh(self.queue), 1)
+        self.assertEqual(list(self.queue), [self.check.pk])
+        self.assertEqual(
+            self.queue.last_check(self.check.pk), result.last_checked_on.timestamp())
+
+    def test_unchanged(self):
+        """Unchanged checks aren't loaded again."""
+        duequeue.refresh(self.queue)
+        with self.assertNumQueries(1):
+            self.assertEqual(duequeue.refresh(self.queue), 0)
+
+    def test_new(self):
+        """New checks are added."""
+        duequeue.refresh(self.queue)
+        other = factories.create_domain_check()
+        self.assertEqual(duequeue.refresh(self.queue), 1)
+        self.assertEqual(sorted(self.queue), sorted([self.check.pk, other.pk]))
+        self.assertEqual(self.queue.last_check(other.pk), 0)
+
+    def test_changed(self):
+        """Changed intervals are updated."""
+        duequeue.refresh(self.queue)
+        self.check.interval = 600
+        self.check.save()
+        self.assertEqual(duequeue.refresh(self.queue), 1)
+        self.assertEqual(self.queue.interval(self.check.pk), 600)
+
+    def test_deactivated(self):
+        """Checks which are no longer active are removed."""
+        duequeue.refresh(self.queue)
+        factories.create_domain_check()
+        self.check.is_active = False
+        self.check.save()
+        duequeue.refresh(self.queue)
+        self.assertNotIn(self.check.pk, self.queue)
+        self.assertEqual(len(self.queue), 1)
+
+    def test_reactivated(self):
+        """Checks which are active again are added back."""
+        duequeue.refresh(self.queue)
+        models.DomainCheck.objects.filter(pk=self.check.pk).update(is_active=False)
+        duequeue.refresh(self.queue)
+        models.DomainCheck.objects.filter(pk=self.check.pk).update(is_active=True)
+        self.assertEqual(duequeue.refresh(self.queue), 1)
+        self.assertIn(self.check.pk, self.queue)
+
+    @override_settings(DOMAINCHECKS_CHANGES_OVERLAP=60)
+    def test_only_changes(self):
+        """Only the checks changed since the last refresh are read."""
+        other = factories.create_domain_check()
+        duequeue.refresh(self.queue)
+        past = now() - datetime.timedelta(minutes=5)
+        models.DomainCheck.objects.filter(pk=other.pk).update(updated_on=past)
+        self.queue.remove(other.pk)
+        self.assertEqual(duequeue.refresh(self.queue), 0)
+        self.assertNotIn(other.pk, self.queue)
+
+    def test_get_queue(self):
+        """Each process keeps one queue which is refreshed when it is used."""
+        with patch.object(duequeue, '_queue', None):
+            queue = duequeue.get_queue()
+            self.assertEqual(list(queue), [self.check.pk])
+            other = factories.create_domain_check(path='/other/')
+            self.assertIs(duequeue.get_queue(), queue)
+            self.assertIn(other.pk, queue)
@@ -0,0 +1,111 @@
+import csv
+import datetime
+import io
+import json
+import math
+
+from django.test import TestCase
+from django.utils.timezone import now
+
+from .. import export, models
+from . import factories
+
+
+class ResultBatchesTestCase(TestCase):
+    """Reading results in keyset order."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+        self.start = now().replace(microsecond=0)
+        for i in range(5):
+            factories.create_check_result(
+                domain_check=self.check, checked_on=self.start + datetime.timedelta(seconds=i))
+        # Same time as the last result so the keyset must fall back to the id
+        factories.create_check_result(
+            domain_check=self.check, checked_on=self.start + datetime.timedelta(seconds=4))
+
+    def test_batches(self):
+        """All results should be read once in (checked_on, id) order."""
+        batches = list(export.result_batches(models.CheckResult.objects.all(), batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+        rows = [row for batch in batches for row in batch]
+        expected = list(models.CheckResult.objects.order_by(
+            'checked_on', 'pk').values_list('pk', flat=True))
+        self.assertEqual([row[0] for row in rows], expected)
+
+    def test_batch_queries(self):
+        """Each batch should take a single query."""
+        with self.assertNumQueries(4):
+            list(export.result_batches(models.CheckResult.objects.all(), batch_size=2))
+
+    def test_empty(self):
+        """No batches without results."""
+        batches = export.result_batches(models.CheckResult.objects.none(), batch_size=2)
+        self.assertEqual(list(batches), [])
+
+
+class ExportFormatsTestCase(TestCase):
+    """Encoding exported results."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+        self.start = now()
+        self.first = factories.create_check_result(
+            domain_check=self.check, checked_on=self.start, response_body='Ok, “fine”')
+        self.second = factories.create_check_result(
+            domain_check=self.check, checked_on=self.start + datetime.timedelta(minutes=1),
+            status_code=None, response_time=None, response_body='', region='eu')
+        self.end = self.start + datetime.timedelta(minutes=2)
+
+    def export(self, format, **kwargs):
+        return b''.join(export.export_results(
+            [self.check], self.start, self.end, format, **kwargs))
+
+    def test_csv(self):
+        """CSV has a header and a row for each result."""
+        rows = list(csv.reader(io.StringIO(self.export('csv').decode('utf-8'))))
+        self.assertEqual(tuple(rows[0]), export.FIELDS)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][0], str(self.first.pk))
+        self.assertEqual(rows[1][2], self.start.isoformat())
+        self.assertEqual(rows[1][-1], 'Ok, “fine”')
+
+    def test_empty_csv(self):
+        """An empty export still has the header."""
+        self.start = self.end
+        self.end = self.end + datetime.timedelta(minutes=1)
+        self.assertEqual(self.export('csv').decode('utf-8').strip(), ','.join(export.FIELDS))
+
+    def test_jsonl(self):
+        """JSON lines has an object for each result."""
+        lines = self.export('jsonl', batch_size=1).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 2)
+        second = json.loads(lines[1])
+        self.assertEqual(second['id'], self.second.pk)
+        self.assertEqual(second['region'], 'eu')
+        self.assertIsNone(second['status_code'])
+
+    def test_columnar(self):
+        """Columnar exports should read back to the same values."""
+        blocks = list(export.read_columnar(io.BytesIO(self.export('columnar', batch_size=1))))
+        self.assertEqual(len(blocks), 2)
+        first, second = blocks
+        self.assertEqual(list(first['id']), [self.first.pk])
+        self.assertEqual(first['checked_on'][0], self.start.timestamp())
+        self.assertEqual(first['status_code'][0], 200)
+        self.assertEqual(first['response_body'], ['Ok, “fine”'])
+        self.assertEqual(second['status_code'][0], -1)
+        self.assertTrue(math.isnan(second['response_time'][0]))
+        self.assertEqual(second['assertion_passed'][0], -1)
+        self.assertEqual(second['region'], ['eu'])
+
+    def test_columnar_invalid(self):
+        """Other files are rejected."""
+        with self.assertRaises(ValueError):
+            list(export.read_columnar(io.BytesIO(b'id,domain_check\n')))
+
+    def test_time_range(self):
+        """Only results which started in the range are exported."""
+        self.end = self.second.checked_on
+        lines = self.export('jsonl').decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.first.pk])
@@ -137,6 +137,22 @@ class DomainFormTestCase(TestCase):
         form = self.get_form(instance=domain, data=data)
         self.assertFalse(form.is_valid())
 
+    def test_check_settings(self):
+        """Interval and content assertions are validated with the checks."""
+        data = factories.build_domain_form_data(domain=None)
+        data.update({
+            'checks-0-interval': '300', 'checks-0-assertion': 'contains',
+            'checks-0-assertion_value': 'Welcome'})
+        form = self.get_form(instance=None, data=data)
+        self.assertTrue(form.is_valid())
+        check = form.checks.forms[0].instance
+        self.assertEqual((check.interval, check.assertion_value), (300, 'Welcome'))
+        for field, value in (('interval', '0'), ('assertion_value', '')):
+            invalid = dict(data, **{'checks-0-' + field: value})
+            form = self.get_form(instance=None, data=invalid)
+            self.assertFalse(form.is_valid())
+            self.assertIn(field, form.checks.errors[0])
+
     def test_name_unique(self):
         """Domain name must be unique."""
         domain = factories.create_domain()
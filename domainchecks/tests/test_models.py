@@ -1,10 +1,11 @@
 import datetime
 
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 
-from requests import ConnectionError, HTTPError, Timeout
+from requests import ConnectionError, Timeout
 
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.test import TestCase, override_settings
 from django.utils.timezone import now
 
 from .. import models
@@ -48,6 +49,14 @@ class DomainChecksTestCase(TestCase):
         self.assertQuerysetEqual(
             result, [stale.pk, no_results.pk], transform=lambda x: x.pk)
 
+    def test_last_checked(self):
+        """Last check times are read from the status buckets, not the results."""
+        check = factories.create_domain_check()
+        result = factories.create_check_result(domain_check=check)
+        queryset = models.DomainCheck.objects.last_checked().filter(pk=check.pk)
+        self.assertNotIn('checkresult', str(queryset.query))
+        self.assertEqual(queryset.get().last_check, result.checked_on)
+
     def test_active_stale_domains(self):
         """Query only active domains which haven't been checked recently."""
         # Domain with a recent check
@@ -148,10 +157,49 @@ class DomainChecksTestCase(TestCase):
             result, ['good', 'fair', 'poor', 'unknown', ],
             transform=lambda x: x.status)
 
+    def test_failed_assertion_status(self):
+        """Results with a failed content assertion are not successes."""
+        check = factories.create_domain_check()
+        factories.create_check_result(domain_check=check, assertion_passed=True)
+        factories.create_check_result(domain_check=check, assertion_passed=False)
+        factories.create_check_result(domain_check=check)
+        result = models.DomainCheck.objects.status().get(pk=check.pk)
+        self.assertEqual(result.successes, 2)
+        self.assertEqual(result.pings, 3)
+
+    def test_clean_assertion(self):
+        """Content assertions are validated."""
+        check = factories.create_domain_check(assertion='contains')
+        with self.assertRaises(ValidationError):
+            check.clean()
+        check.assertion_value = 'Welcome'
+        check.clean()
+        check.status_only = True
+        with self.assertRaises(ValidationError):
+            check.clean()
+
+    def test_clean_interval(self):
+        """Checks can't run more often than the minimum interval."""
+        check = factories.create_domain_check(interval=0)
+        with self.assertRaises(ValidationError):
+            check.full_clean()
+        check.interval = 10
+        check.full_clean()
+
+    def test_clean_invalid_pattern(self):
+        """Regular expressions and JSON paths must be valid."""
+        check = factories.create_domain_check(assertion='regex', assertion_value='(')
+        with self.assertRaises(ValidationError):
+            check.clean()
+        check.assertion = 'json'
+        check.assertion_value = '$.items[x]'
+        with self.assertRaises(ValidationError):
+            check.clean()
+
     @patch('requests.request')
     def test_run_check_success(self, mock_fetch):
         """Fetch a page succesfully and save the result."""
-        mock_fetch.return_value = Mock(status_code=200, text='Ok')
+        mock_fetch.return_value = factories.build_response()
         domain = factories.create_domain_check()
         domain.run_check()
         checks = domain.checkresult_set.all()
@@ -165,9 +213,7 @@ class DomainChecksTestCase(TestCase):
     @patch('requests.request')
     def test_run_check_failure(self, mock_fetch):
         """Fetch a page with an error status and save the result."""
-        result = Mock(status_code=404, text='Not Found')
-        result.raise_for_status.side_effect = HTTPError
-        mock_fetch.return_value = result
+        mock_fetch.return_value = factories.build_response(404, 'Not Found')
         domain = factories.create_domain_check()
         domain.run_check()
         checks = domain.checkresult_set.all()
@@ -205,3 +251,204 @@ class DomainChecksTestCase(TestCase):
         self.assertGreater(check.response_time, 0)
         self.assertIsNone(check.status_code)
         self.assertEqual(check.response_body, '')
+
+    @patch('requests.request')
+    def test_run_check_status_only(self, mock_fetch):
+        """Status only checks don't store the response body."""
+        response = factories.build_response()
+        mock_fetch.return_value = response
+        domain = factories.create_domain_check(status_only=True)
+        domain.run_check()
+        check = domain.checkresult_set.get()
+        self.assertEqual(check.status_code, 200)
+        self.assertEqual(check.response_body, '')
+        self.assertFalse(response.iter_content.called)
+        response.close.assert_called_once_with()
+
+    @patch('requests.request')
+    def test_run_check_assertion(self, mock_fetch):
+        """Content assertion verdict is stored with an excerpt of the body."""
+        mock_fetch.return_value = factories.build_response(
+            200, 'x' * 1000 + 'Welcome' + 'y' * 1000)
+        domain = factories.create_domain_check(
+            assertion='contains', assertion_value='Welcome')
+        domain.run_check()
+        check = domain.checkresult_set.get()
+        self.assertTrue(check.assertion_passed)
+        self.assertEqual(check.response_body, 'x' * 100 + 'Welcome' + 'y' * 100)
+
+    @override_settings(DOMAINCHECKS_BREAKER_THRESHOLD=1)
+    @patch('requests.request')
+    def test_run_check_host_down(self, mock_fetch):
+        """Checks for a host which is down are recorded without a request."""
+        mock_fetch.side_effect = ConnectionError
+        first = factories.create_domain_check(domain='down.example.com')
+        second = factories.create_domain_check(domain=first.domain, path='/other/')
+        first.run_check()
+        second.run_check()
+        self.assertEqual(mock_fetch.call_count, 1)
+        result = second.checkresult_set.get()
+        self.assertIsNone(result.status_code)
+        self.assertIsNone(result.response_time)
+        self.assertEqual(result.response_body, 'Skipped: down.example.com is unreachable.')
+
+
+class StatusBucketTestCase(TestCase):
+    """Incremental success counts used for the check status."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+
+    def build_result(self, checked_on, status_code=200, **kwargs):
+        return models.CheckResult(
+            domain_check=self.check, checked_on=checked_on,
+            status_code=status_code, response_time=0.1, **kwargs)
+
+    def test_record_batch(self):
+        """Results in the same bucket are counted together."""
+        start = models.bucket_start(now())
+        models.StatusBucket.objects.record([
+            self.build_result(start + datetime.timedelta(seconds=10)),
+            self.build_result(start, status_code=500),
+            self.build_result(start - datetime.timedelta(seconds=1)),
+        ])
+        buckets = self.check.statusbucket_set.order_by('started_on')
+        self.assertEqual(
+            [(b.successes, b.pings) for b in buckets], [(1, 1), (1, 2)])
+        self.assertEqual(buckets[1].started_on, start)
+        self.assertEqual(buckets[1].last_checked_on, start + datetime.timedelta(seconds=10))
+
+    def test_record_existing_bucket(self):
+        """Later batches add to the existing bucket."""
+        start = models.bucket_start(now())
+        later = start + datetime.timedelta(seconds=30)
+        models.StatusBucket.objects.record([self.build_result(later)])
+        models.StatusBucket.objects.record([
+            self.build_result(start, assertion_passed=False)])
+        bucket = self.check.statusbucket_set.get()
+        self.assertEqual((bucket.successes, bucket.pings), (1, 2))
+        self.assertEqual(bucket.last_checked_on, later)
+
+    def test_count_deleted_check(self):
+        """Results for a check deleted since aren't counted for a domain."""
+        deleted = models.CheckResult(
+            domain_check_id=self.check.pk + 1000, checked_on=now(), status_code=200)
+        models.count_results(
+            sender=models.CheckResult, results=[self.build_result(now()), deleted])
+        bucket = self.check.domain.domainstatusbucket_set.get()
+        self.assertEqual(bucket.pings, 1)
+
+    def test_status_window(self):
+        """Any window can be read from the same buckets."""
+        factories.create_check_result(domain_check=self.check)
+        factories.create_check_result(
+            domain_check=self.check, status_code=500,
+            checked_on=now() - datetime.timedelta(minutes=90))
+        queryset = models.DomainCheck.objects.filter(pk=self.check.pk)
+        result = queryset.status().get()
+        self.assertEqual((result.successes, result.pings), (1, 1))
+        result = queryset.status(cutoff=datetime.timedelta(hours=2)).get()
+        self.assertEqual((result.successes, result.pings), (1, 2))
+
+    def test_prune(self):
+        """Old buckets are removed apart from the latest for each check."""
+        old = now() - datetime.timedelta(days=2)
+        factories.create_check_result(domain_check=self.check, checked_on=old)
+        factories.create_check_result(
+            domain_check=self.check, checked_on=old + datetime.timedelta(hours=1))
+        other = factories.create_check_result().domain_check
+        models.StatusBucket.objects.prune(before=now() - datetime.timedelta(days=1))
+        self.assertEqual(self.check.statusbucket_set.count(), 1)
+        self.assertEqual(other.statusbucket_set.count(), 1)
+        result = models.DomainCheck.objects.status().get(pk=self.check.pk)
+        self.assertEqual(result.last_check, old + datetime.timedelta(hours=1))
+        self.assertEqual(result.status, 'unknown')
+
+
+class DomainStatusTestCase(TestCase):
+    """Status rolled up for all checks of a domain."""
+
+    def test_domain_status(self):
+        """Counts from all checks of the domain are added together."""
+        check = factories.create_domain_check()
+        other = factories.create_domain_check(domain=check.domain, path='/other/')
+        factories.create_check_result(domain_check=check)
+        factories.create_check_result(domain_check=other)
+        factories.create_check_result(domain_check=other, status_code=500)
+        factories.create_check_result(
+            domain_check=factories.create_domain_check(domain='other.com'))
+        result = models.Domain.objects.status().get(pk=check.domain.pk)
+        self.assertEqual(result.successes, 2)
+        self.assertEqual(result.pings, 3)
+        self.assertEqual(result.status, 'poor')
+
+    def test_no_results(self):
+        """Domains without recent results have an unknown status."""
+        check = factories.create_domain_check()
+        result = models.Domain.objects.status().get(pk=check.domain.pk)
+        self.assertEqual(result.status, 'unknown')
+        self.assertIsNone(result.last_check)
+
+    def test_active(self):
+        """Only domains with an active check are included."""
+        check = factories.create_domain_check()
+        factories.create_domain_check(domain=check.domain, path='/other/')
+        factories.create_domain_check(is_active=False)
+        self.assertQuerysetEqual(
+            models.Domain.objects.active(), [check.domain.pk], transform=lambda x: x.pk)
+
+
+class ChangeTrackingTestCase(TestCase):
+    """Time domains and checks were last changed."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+        self.past = now() - datetime.timedelta(hours=1)
+        models.Domain.objects.update(updated_on=self.past)
+        self.before = now()
+
+    def changed(self):
+        return list(models.DomainCheck.objects.changed_since(
+            self.before).values_list('pk', flat=True))
+
+    def test_save(self):
+        """Saving a check marks it as changed."""
+        self.check.interval = 600
+        self.check.save()
+        self.assertEqual(self.changed(), [self.check.pk])
+        self.assertGreaterEqual(self.check.updated_on, self.before)
+
+    def test_save_fields(self):
+        """Saves limited to some fields also mark the check as changed."""
+        self.check.interval = 600
+        self.check.save(update_fields=['interval'])
+        self.check.refresh_from_db()
+        self.assertGreaterEqual(self.check.updated_on, self.before)
+
+    def test_update(self):
+        """Bulk updates mark the checks as changed."""
+        other = factories.create_domain_check(interval=60)
+        models.DomainCheck.objects.update(updated_on=self.past)
+        models.DomainCheck.objects.filter(interval=60).update(interval=300)
+        self.assertEqual(self.changed(), [other.pk])
+
+    def test_domain_save(self):
+        """Changes to a domain mark its checks as changed."""
+        factories.create_domain_check(domain='other.com')
+        models.Domain.objects.update(updated_on=self.past)
+        domain = self.check.domain
+        domain.name = 'renamed.com'
+        domain.save()
+        self.assertEqual(self.changed(), [self.check.pk])
+        self.assertEqual(
+            list(models.Domain.objects.changed_since(self.before)), [domain])
+
+    def test_domain_update(self):
+        """Bulk updates of domains mark their checks as changed."""
+        domain = self.check.domain
+        models.Domain.objects.filter(name=domain.name).update(name='renamed.com')
+        self.assertEqual(self.changed(), [self.check.pk])
+
+    def test_unchanged(self):
+        """Checks changed before the time aren't included."""
+        self.assertEqual(self.changed(), [])
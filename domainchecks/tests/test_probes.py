@@ -0,0 +1,317 @@
+from unittest.mock import Mock, patch
+
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+
+from django.test import SimpleTestCase
+
+from .. import probes
+from . import factories
+
+
+def build_check(**kwargs):
+    values = {
+        'method': 'get',
+        'url': 'http://example.com/',
+        'status_only': False,
+        'assertion': '',
+        'assertion_value': '',
+    }
+    values.update(kwargs)
+    return Mock(**values)
+
+
+@patch('domainchecks.probes.requests.request')
+class ProbeTestCase(SimpleTestCase):
+    """Streamed HTTP requests for checks."""
+
+    def test_range_request(self, mock_request):
+        """Content checks only ask for the first bytes of the body."""
+        mock_request.return_value = factories.build_response(206, 'Ok')
+        result = probes.probe(build_check(), timeout=5, max_bytes=100)
+        mock_request.assert_called_once_with(
+            'get', 'http://example.com/', allow_redirects=False, timeout=5,
+            stream=True, headers={'Range': 'bytes=0-99'})
+        self.assertEqual(result.status_code, 206)
+        self.assertEqual(result.response_body, 'Ok')
+        self.assertGreater(result.response_time, 0)
+
+    def test_limit_body(self, mock_request):
+        """Servers ignoring the range are not read past the limit."""
+        response = factories.build_response(200, 'x' * 1000)
+        mock_request.return_value = response
+        result = probes.probe(build_check(), max_bytes=10)
+        self.assertEqual(result.response_body, 'x' * 10)
+        response.iter_content.assert_called_once_with(10)
+        response.close.assert_called_once_with()
+
+    def test_status_only(self, mock_request):
+        """Status only checks close the response without reading it."""
+        response = factories.build_response(200, 'Ok')
+        mock_request.return_value = response
+        result = probes.probe(build_check(status_only=True), max_bytes=100)
+        mock_request.assert_called_once_with(
+            'get', 'http://example.com/', allow_redirects=False, timeout=10,
+            stream=True, headers={})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.response_body, '')
+        self.assertFalse(response.iter_content.called)
+        response.close.assert_called_once_with()
+
+    def test_session(self, mock_request):
+        """Requests go through the session when one is given."""
+        session = Mock()
+        session.request.return_value = factories.build_response(200, 'Ok')
+        result = probes.probe(build_check(status_only=True), session=session)
+        session.request.assert_called_once_with(
+            'get', 'http://example.com/', allow_redirects=False, timeout=10,
+            stream=True, headers={})
+        self.assertFalse(mock_request.called)
+        self.assertEqual(result.status_code, 200)
+
+    def test_no_range_for_other_methods(self, mock_request):
+        """Only GET requests ask for a range."""
+        mock_request.return_value = factories.build_response(200, '')
+        probes.probe(build_check(method='head'), max_bytes=100)
+        mock_request.assert_called_once_with(
+            'head', 'http://example.com/', allow_redirects=False, timeout=10,
+            stream=True, headers={})
+
+    def test_unsatisfiable_range(self, mock_request):
+        """Retry empty resources without the range."""
+        unsatisfiable = factories.build_response(416, '')
+        mock_request.side_effect = [unsatisfiable, factories.build_response(200, '')]
+        result = probes.probe(build_check(), max_bytes=100)
+        self.assertEqual(mock_request.call_count, 2)
+        mock_request.assert_called_with(
+            'get', 'http://example.com/', allow_redirects=False, timeout=10,
+            stream=True, headers={})
+        unsatisfiable.close.assert_called_once_with()
+        self.assertEqual(result.status_code, 200)
+
+    def test_unknown_encoding(self, mock_request):
+        """Fall back to UTF-8 if the server sends an unknown encoding."""
+        mock_request.return_value = factories.build_response(
+            200, 'Ok', encoding='not-an-encoding')
+        result = probes.probe(build_check(), max_bytes=100)
+        self.assertEqual(result.response_body, 'Ok')
+
+    def test_broken_body(self, mock_request):
+        """Keep the status code if the body can't be read."""
+        response = factories.build_response(200, 'Ok')
+        response.iter_content.side_effect = ChunkedEncodingError
+        mock_request.return_value = response
+        result = probes.probe(build_check(), max_bytes=100)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.response_body, '')
+        response.close.assert_called_once_with()
+
+
+class ContainsMatcherTestCase(SimpleTestCase):
+    """Streamed search for a substring."""
+
+    def test_match_in_chunk(self):
+        """Verdict is known as soon as the text is found."""
+        matcher = probes.ContainsMatcher('needle')
+        self.assertFalse(matcher.feed(b'hay hay'))
+        self.assertTrue(matcher.feed(b'hay needle hay'))
+        self.assertTrue(matcher.passed)
+        self.assertIn(b'needle', matcher.excerpt)
+
+    def test_match_across_chunks(self):
+        """Matches split between chunks are found."""
+        matcher = probes.ContainsMatcher('needle')
+        self.assertFalse(matcher.feed(b'x' * 500 + b'nee'))
+        self.assertTrue(matcher.feed(b'dle'))
+        self.assertTrue(matcher.passed)
+
+    def test_no_match(self):
+        """Excerpt is the start of the body when nothing was found."""
+        matcher = probes.ContainsMatcher('needle')
+        matcher.feed(b'a' * 500)
+        matcher.feed(b'b' * 500)
+        matcher.finish()
+        self.assertFalse(matcher.passed)
+        self.assertEqual(matcher.excerpt, b'a' * probes.EXCERPT_LENGTH)
+
+    def test_excerpt_length(self):
+        """Excerpt only keeps context around the match."""
+        matcher = probes.ContainsMatcher('needle')
+        matcher.feed(b'a' * 1000 + b'needle' + b'b' * 1000)
+        expected = b'a' * probes.EXCERPT_LENGTH + b'needle' + b'b' * probes.EXCERPT_LENGTH
+        self.assertEqual(matcher.excerpt, expected)
+
+
+class RegexMatcherTestCase(SimpleTestCase):
+    """Streamed search for a regular expression."""
+
+    def test_match(self):
+        """Find a pattern in the body."""
+        matcher = probes.RegexMatcher(r'version \d+\.\d+')
+        self.assertFalse(matcher.feed(b'running version 1.'))
+        self.assertTrue(matcher.feed(b'8 of the site'))
+        self.assertIn(b'version 1.8', matcher.excerpt)
+
+    def test_no_match(self):
+        """Body without a match fails."""
+        matcher = probes.RegexMatcher(r'^Error')
+        matcher.feed(b'All good')
+        matcher.finish()
+        self.assertFalse(matcher.passed)
+
+
+class JSONMatcherTestCase(SimpleTestCase):
+    """Check a value in a JSON document."""
+
+    def check(self, assertion, body):
+        matcher = probes.JSONMatcher(assertion)
+        for i in range(0, len(body), 4):
+            self.assertFalse(matcher.feed(body[i:i + 4]))
+        matcher.finish()
+        return matcher
+
+    def test_path_exists(self):
+        """Path without a value only needs to exist."""
+        matcher = self.check('$.items[1].name', b'{"items": [{}, {"name": "b"}]}')
+        self.assertTrue(matcher.passed)
+        self.assertEqual(matcher.excerpt, b'"b"')
+
+    def test_path_missing(self):
+        """Missing paths fail."""
+        matcher = self.check('$.items[2]', b'{"items": [{}, {"name": "b"}]}')
+        self.assertFalse(matcher.passed)
+
+    def test_expected_value(self):
+        """Value after == is compared with the path's value."""
+        self.assertTrue(self.check('status == "ok"', b'{"status": "ok"}').passed)
+        self.assertFalse(self.check('status == "ok"', b'{"status": "down"}').passed)
+
+    def test_invalid_document(self):
+        """Bodies which aren't JSON fail."""
+        self.assertFalse(self.check('$.status', b'<html></html>').passed)
+
+    def test_invalid_path(self):
+        """Paths are validated when the matcher is built."""
+        with self.assertRaises(ValueError):
+            probes.JSONMatcher('$.items[x]')
+
+
+@patch('domainchecks.probes.requests.request')
+class ProbeAssertionTestCase(SimpleTestCase):
+    """Content assertions evaluated while the body is streamed."""
+
+    def test_stop_reading(self, mock_request):
+        """Reading stops once the assertion has passed."""
+        response = factories.build_response(200, 'needle' + 'x' * 100000)
+        mock_request.return_value = response
+        check = build_check(assertion='contains', assertion_value='needle')
+        result = probes.probe(check, max_bytes=1000000)
+        self.assertTrue(result.assertion_passed)
+        self.assertEqual(result.response_body, 'needle' + 'x' * probes.EXCERPT_LENGTH)
+        response.close.assert_called_once_with()
+
+    def test_failed_assertion(self, mock_request):
+        """Verdict is stored when the assertion doesn't pass."""
+        mock_request.return_value = factories.build_response(200, 'hay')
+        check = build_check(assertion='contains', assertion_value='needle')
+        result = probes.probe(check, max_bytes=1000)
+        self.assertEqual(result.status_code, 200)
+        self.assertFalse(result.assertion_passed)
+        self.assertEqual(result.response_body, 'hay')
+
+    def test_status_only(self, mock_request):
+        """Assertions are skipped for status only checks."""
+        mock_request.return_value = factories.build_response(200, 'needle')
+        check = build_check(
+            status_only=True, assertion='contains', assertion_value='needle')
+        result = probes.probe(check, max_bytes=1000)
+        self.assertIsNone(result.assertion_passed)
+
+
+@patch('domainchecks.probes.time.time')
+class CircuitBreakerTestCase(SimpleTestCase):
+    """Skip requests to hosts which keep failing."""
+
+    def setUp(self):
+        self.breaker = probes.CircuitBreaker(threshold=2, reset_timeout=60)
+
+    def test_closed(self, mock_time):
+        """Requests are allowed until the threshold is reached."""
+        mock_time.return_value = 0
+        self.assertTrue(self.breaker.allow('example.com'))
+        self.breaker.record('example.com', False)
+        self.assertTrue(self.breaker.allow('example.com'))
+        self.breaker.record('example.com', False)
+        self.assertFalse(self.breaker.allow('example.com'))
+        self.assertTrue(self.breaker.allow('other.com'))
+
+    def test_success_resets(self, mock_time):
+        """Failures must be consecutive."""
+        mock_time.return_value = 0
+        self.breaker.record('example.com', False)
+        self.breaker.record('example.com', True)
+        self.breaker.record('example.com', False)
+        self.assertTrue(self.breaker.allow('example.com'))
+
+    def test_canary(self, mock_time):
+        """A single request is allowed once the reset timeout has passed."""
+        mock_time.return_value = 0
+        self.breaker.record('example.com', False)
+        self.breaker.record('example.com', False)
+        mock_time.return_value = 59
+        self.assertFalse(self.breaker.allow('example.com'))
+        mock_time.return_value = 60
+        self.assertTrue(self.breaker.allow('example.com'))
+        self.assertFalse(self.breaker.allow('example.com'))
+
+    def test_canary_success(self, mock_time):
+        """Circuit closes when the canary succeeds."""
+        mock_time.return_value = 0
+        self.breaker.record('example.com', False)
+        self.breaker.record('example.com', False)
+        mock_time.return_value = 60
+        self.assertTrue(self.breaker.allow('example.com'))
+        self.breaker.record('example.com', True)
+        self.assertFalse(self.breaker.is_open('example.com'))
+        self.assertTrue(self.breaker.allow('example.com'))
+        self.assertTrue(self.breaker.allow('example.com'))
+
+    def test_canary_failure(self, mock_time):
+        """Circuit stays open for another interval when the canary fails."""
+        mock_time.return_value = 0
+        self.breaker.record('example.com', False)
+        self.breaker.record('example.com', False)
+        mock_time.return_value = 60
+        self.assertTrue(self.breaker.allow('example.com'))
+        self.breaker.record('example.com', False)
+        mock_time.return_value = 100
+        self.assertFalse(self.breaker.allow('example.com'))
+        mock_time.return_value = 120
+        self.assertTrue(self.breaker.allow('example.com'))
+
+
+@patch('domainchecks.probes.requests.request')
+class ProbeCircuitBreakerTestCase(SimpleTestCase):
+    """Probes skip hosts with an open circuit."""
+
+    def setUp(self):
+        self.breaker = probes.CircuitBreaker(threshold=1, reset_timeout=60)
+
+    def test_skip_request(self, mock_request):
+        """No request is made while the circuit is open."""
+        mock_request.side_effect = ConnectionError
+        first = probes.probe(build_check(), breaker=self.breaker)
+        self.assertIsNone(first.status_code)
+        second = probes.probe(
+            build_check(url='http://example.com/other/'), breaker=self.breaker)
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertIsNone(second.status_code)
+        self.assertIsNone(second.response_time)
+        self.assertEqual(second.response_body, 'Skipped: example.com is unreachable.')
+
+    def test_error_status(self, mock_request):
+        """Hosts which respond with an error status are not down."""
+        mock_request.return_value = factories.build_response(503, 'Down')
+        probes.probe(build_check(), breaker=self.breaker)
+        probes.probe(build_check(), breaker=self.breaker)
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertFalse(self.breaker.is_open('example.com'))
@@ -0,0 +1,106 @@
+from django.test import TestCase
+
+from .. import models, provisioning
+from . import factories
+
+
+class ProvisionTestCase(TestCase):
+    """Creating domains in bulk."""
+
+    def setUp(self):
+        self.user = factories.create_user()
+
+    def test_create(self):
+        """Valid domains and their checks are created for the owner."""
+        domains = [
+            {'name': 'a.com', 'checks': [{'path': '/'}, {'path': '/api/', 'method': 'head'}]},
+            {'name': 'b.com', 'checks': [
+                {'path': '/', 'protocol': 'https'}, {'path': '/old/', 'is_active': False}]},
+        ]
+        created, errors = provisioning.provision(domains, self.user)
+        self.assertEqual((created, errors), (2, {}))
+        a = models.Domain.objects.get(name='a.com')
+        self.assertEqual(a.owner, self.user)
+        self.assertEqual(
+            sorted(a.domaincheck_set.values_list('path', 'method')),
+            [('/', 'get'), ('/api/', 'head')])
+        b = models.Domain.objects.get(name='b.com')
+        self.assertEqual(
+            sorted(b.domaincheck_set.values_list('path', 'protocol', 'is_active')),
+            [('/', 'https', True), ('/old/', 'http', False)])
+
+    def test_check_settings(self):
+        """Checks can set their interval and content assertion."""
+        domains = [
+            {'name': 'a.com', 'checks': [{
+                'path': '/', 'interval': 60, 'assertion': 'regex',
+                'assertion_value': 'Welcome|Hello'}]},
+            {'name': 'b.com', 'checks': [{'path': '/', 'status_only': True}]},
+            {'name': 'c.com', 'checks': [{
+                'path': '/', 'status_only': True, 'assertion': 'contains',
+                'assertion_value': 'Ok'}]},
+        ]
+        created, errors = provisioning.provision(domains, self.user)
+        self.assertEqual(created, 2)
+        self.assertEqual(list(errors), [2])
+        check = models.DomainCheck.objects.get(domain__name='a.com')
+        self.assertEqual(
+            (check.interval, check.assertion, check.assertion_value),
+            (60, 'regex', 'Welcome|Hello'))
+        self.assertTrue(models.DomainCheck.objects.get(domain__name='b.com').status_only)
+
+    def test_errors(self):
+        """Invalid domains are skipped with the form errors."""
+        factories.create_domain(name='taken.com')
+        domains = [
+            {'name': 'ok.com', 'checks': [{'path': '/'}]},
+            {'name': 'taken.com', 'checks': [{'path': '/'}]},
+            {'name': 'inactive.com', 'checks': [{'path': '/', 'is_active': False}]},
+            {'name': 'many.com', 'checks': [{'path': '/{}/'.format(i)} for i in range(4)]},
+            {'name': 'ok.com', 'checks': [{'path': '/'}]},
+            {'checks': [{'path': '/'}]},
+        ]
+        created, errors = provisioning.provision(domains, self.user, chunk_size=4)
+        self.assertEqual(created, 1)
+        self.assertEqual(sorted(errors), [1, 2, 3, 4, 5])
+        self.assertIn('name', errors[1])
+        self.assertEqual(errors[2], {'checks': ['A domain must have at least one active check.']})
+        self.assertIn('checks', errors[3])
+        # Created by the previous chunk
+        self.assertIn('name', errors[4])
+        self.assertIn('name', errors[5])
+        self.assertEqual(models.DomainCheck.objects.filter(domain__name='ok.com').count(), 1)
+
+    def test_invalid_shape(self):
+        """Domains and checks which aren't objects are skipped with an error."""
+        domains = [
+            {'name': 'a.com', 'checks': ['x']},
+            {'name': 'b.com', 'checks': 'abc'},
+            'c.com',
+            {'name': 'd.com', 'checks': [{'path': '/'}]},
+        ]
+        created, errors = provisioning.provision(domains, self.user)
+        self.assertEqual(created, 1)
+        self.assertEqual(errors[0], {'checks': ['Checks must be a list of objects.']})
+        self.assertEqual(errors[1], {'checks': ['Checks must be a list of objects.']})
+        self.assertEqual(errors[2], {'__all__': ['Domain must be an object.']})
+        self.assertEqual(sorted(errors), [0, 1, 2])
+
+    def test_duplicate_in_chunk(self):
+        """Names listed twice in a chunk are only created once."""
+        domains = [{'name': 'a.com', 'checks': [{'path': '/'}]}] * 2
+        created, errors = provisioning.provision(domains, self.user)
+        self.assertEqual(created, 1)
+        self.assertEqual(list(errors), [1])
+
+    def test_queries(self):
+        """Each chunk takes a fixed number of queries."""
+        domains = [
+            {'name': '{}.com'.format(i), 'checks': [{'path': '/'}, {'path': '/a/'}]}
+            for i in range(40)
+        ]
+        # Unique names, insert domains, read their ids, insert checks and
+        # the savepoint around the inserts
+        with self.assertNumQueries(6):
+            provisioning.provision(domains, self.user)
+        self.assertEqual(models.DomainCheck.objects.count(), 80)
@@ -0,0 +1,246 @@
+import datetime
+
+from unittest.mock import Mock, patch
+
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from .. import models, results
+from ..signals import results_recorded
+from . import factories
+
+
+class RecordEncodingTestCase(TestCase):
+    """Compact records passed between the probes and the ingestion worker."""
+
+    def test_round_trip(self):
+        """Decoded record should match the original result."""
+        check = factories.create_domain_check()
+        original = models.CheckResult(
+            domain_check=check, checked_on=now(), status_code=200,
+            response_time=0.25, response_body='Ok')
+        record = results.encode(original)
+        self.assertEqual(record[0], check.pk)
+        result = results.decode(record)
+        self.assertIsNone(result.pk)
+        self.assertEqual(result.domain_check_id, check.pk)
+        self.assertEqual(result.checked_on, original.checked_on)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.response_time, 0.25)
+        self.assertEqual(result.response_body, 'Ok')
+
+    def test_missing_values(self):
+        """Failed requests have no status code."""
+        check = factories.create_domain_check()
+        original = models.CheckResult(
+            domain_check=check, checked_on=now(), response_time=10.0)
+        result = results.decode(results.encode(original))
+        self.assertIsNone(result.status_code)
+        self.assertEqual(result.response_body, '')
+
+
+class RecordResultsTestCase(TestCase):
+    """Batch insert of check results."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+
+    def build_result(self, **kwargs):
+        values = {
+            'domain_check': self.check,
+            'checked_on': now(),
+            'status_code': 200,
+            'response_time': 0.1,
+        }
+        values.update(kwargs)
+        return models.CheckResult(**values)
+
+    def test_insert_batch(self):
+        """All results should be saved."""
+        count = results.record_results([self.build_result(), self.build_result()])
+        self.assertEqual(count, 2)
+        self.assertEqual(self.check.checkresult_set.count(), 2)
+
+    def test_signal_sent(self):
+        """Listeners are notified of the new results."""
+        handler = Mock()
+        results_recorded.connect(handler)
+        self.addCleanup(results_recorded.disconnect, handler)
+        batch = [self.build_result()]
+        results.record_results(batch)
+        handler.assert_called_once_with(
+            signal=results_recorded, sender=models.CheckResult, results=batch)
+
+    def test_empty_batch(self):
+        """No signal is sent when there is nothing to write."""
+        handler = Mock()
+        results_recorded.connect(handler)
+        self.addCleanup(results_recorded.disconnect, handler)
+        self.assertEqual(results.record_results([]), 0)
+        self.assertFalse(handler.called)
+
+
+class BackendTestCase(TestCase):
+    """Result backends used by the probes."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+
+    def build_result(self):
+        return models.CheckResult(
+            domain_check=self.check, checked_on=now(), status_code=200,
+            response_time=0.1, response_body='Ok')
+
+    def test_default_backend(self):
+        """Results are written to the database by default."""
+        backend = results.get_backend()
+        self.assertIsInstance(backend, results.DatabaseBackend)
+        backend.publish(self.build_result())
+        self.assertEqual(self.check.checkresult_set.count(), 1)
+
+    def test_publish_many(self):
+        """Batches are written together with a single signal."""
+        handler = Mock()
+        results_recorded.connect(handler)
+        self.addCleanup(results_recorded.disconnect, handler)
+        results.DatabaseBackend().publish_many([self.build_result(), self.build_result()])
+        self.assertEqual(self.check.checkresult_set.count(), 2)
+        self.assertEqual(handler.call_count, 1)
+        self.assertEqual(len(handler.call_args[1]['results']), 2)
+
+    @override_settings(DOMAINCHECKS_RESULT_BACKEND='domainchecks.results.MemoryBackend')
+    def test_configured_backend(self):
+        """Backend is loaded from the settings."""
+        backend = results.get_backend()
+        self.assertIsInstance(backend, results.MemoryBackend)
+        self.assertIs(results.get_backend(), backend)
+
+    def test_memory_backend(self):
+        """Records are held until the queue is drained."""
+        backend = results.MemoryBackend()
+        backend.publish(self.build_result())
+        backend.publish(self.build_result())
+        backend.publish_many([self.build_result()])
+        backend.flush()
+        self.assertEqual(self.check.checkresult_set.count(), 0)
+        self.assertEqual(backend.drain(batch_size=1), 3)
+        self.assertEqual(self.check.checkresult_set.count(), 3)
+        self.assertEqual(len(backend.queue), 0)
+
+    @patch('domainchecks.tasks.ingest_results')
+    def test_celery_backend(self, mock_task):
+        """Records are sent to the ingestion task on flush."""
+        backend = results.CeleryBackend()
+        result = self.build_result()
+        backend.publish(result)
+        self.assertFalse(mock_task.delay.called)
+        backend.flush()
+        mock_task.delay.assert_called_once_with([results.encode(result)])
+        self.assertEqual(self.check.checkresult_set.count(), 0)
+        backend.flush()
+        self.assertEqual(mock_task.delay.call_count, 1)
+
+    @patch('domainchecks.tasks.ingest_results')
+    def test_celery_backend_publish_many(self, mock_task):
+        """Batches are sent to the ingestion task straight away."""
+        backend = results.CeleryBackend()
+        batch = [self.build_result(), self.build_result()]
+        backend.publish_many(batch)
+        mock_task.delay.assert_called_once_with([results.encode(r) for r in batch])
+
+    @override_settings(DOMAINCHECKS_INGEST_BATCH_SIZE=2)
+    @patch('domainchecks.tasks.ingest_results')
+    def test_celery_backend_batch_size(self, mock_task):
+        """Full batches are sent without waiting for a flush."""
+        backend = results.CeleryBackend()
+        for i in range(3):
+            backend.publish(self.build_result())
+        self.assertEqual(mock_task.delay.call_count, 1)
+        self.assertEqual(len(mock_task.delay.call_args[0][0]), 2)
+        self.assertEqual(len(backend.pending), 1)
+
+
+@override_settings(DOMAINCHECKS_COMPACT_RESULTS=True, DOMAINCHECKS_COMPACT_MAX_SPAN=600)
+class CompactResultsTestCase(TestCase):
+    """Merge consecutive results with the same outcome."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+        self.start = now() - datetime.timedelta(minutes=30)
+
+    def build_result(self, minutes=0, **kwargs):
+        values = {
+            'domain_check': self.check,
+            'checked_on': self.start + datetime.timedelta(minutes=minutes),
+            'status_code': 200,
+            'response_time': 0.1,
+        }
+        values.update(kwargs)
+        return models.CheckResult(**values)
+
+    def test_merge_same_outcome(self):
+        """Results with the same status extend the latest run."""
+        results.record_results([self.build_result(0, response_time=0.1)])
+        results.record_results([self.build_result(2, response_time=0.3)])
+        results.record_results([self.build_result(4, response_time=0.2)])
+        run = self.check.checkresult_set.get()
+        self.assertEqual(run.count, 3)
+        self.assertEqual(run.checked_on, self.start)
+        self.assertEqual(run.last_checked_on, self.start + datetime.timedelta(minutes=4))
+        self.assertAlmostEqual(run.response_time, 0.2)
+        self.assertEqual(run.response_time_min, 0.1)
+        self.assertEqual(run.response_time_max, 0.3)
+
+    def test_merge_within_batch(self):
+        """Results in the same batch are merged together."""
+        results.record_results([
+            self.build_result(0), self.build_result(2), self.build_result(4, status_code=500),
+        ])
+        runs = self.check.checkresult_set.order_by('checked_on')
+        self.assertEqual([(r.count, r.status_code) for r in runs], [(2, 200), (1, 500)])
+
+    def test_outcome_changed(self):
+        """A different status or verdict starts a new run."""
+        results.record_results([self.build_result(0)])
+        results.record_results([self.build_result(2, status_code=500)])
+        results.record_results([self.build_result(4, status_code=500, assertion_passed=False)])
+        results.record_results([self.build_result(6)])
+        self.assertEqual(self.check.checkresult_set.count(), 4)
+
+    def test_regions(self):
+        """Runs are kept separately for each region."""
+        results.record_results([
+            self.build_result(0, region='east'), self.build_result(1, region='west')])
+        results.record_results([
+            self.build_result(2, region='east'), self.build_result(3, region='west')])
+        runs = self.check.checkresult_set.order_by('region')
+        self.assertEqual([(r.region, r.count) for r in runs], [('east', 2), ('west', 2)])
+
+    def test_max_span(self):
+        """Runs are split once they span the maximum time."""
+        results.record_results([self.build_result(minutes) for minutes in range(0, 21, 2)])
+        runs = self.check.checkresult_set.order_by('checked_on')
+        self.assertEqual([r.count for r in runs], [6, 5])
+
+    def test_skipped_requests(self):
+        """Requests skipped by the circuit breaker don't merge with timeouts."""
+        results.record_results([
+            self.build_result(0, status_code=None, response_time=10.0),
+            self.build_result(2, status_code=None, response_time=None),
+        ])
+        self.assertEqual(self.check.checkresult_set.count(), 2)
+
+    def test_status(self):
+        """Status counts each check in a run."""
+        results.record_results([self.build_result(minutes) for minutes in range(0, 10, 2)])
+        results.record_results([self.build_result(10, status_code=500)])
+        result = models.DomainCheck.objects.status().get(pk=self.check.pk)
+        self.assertEqual(result.successes, 5)
+        self.assertEqual(result.pings, 6)
+        self.assertEqual(result.last_check, self.start + datetime.timedelta(minutes=10))
+
+    def test_stale(self):
+        """Stale checks use the end of the latest run."""
+        results.record_results([self.build_result(0), self.build_result(25)])
+        self.assertFalse(models.DomainCheck.objects.stale(
+            cutoff=datetime.timedelta(minutes=10)).exists())
@@ -0,0 +1,96 @@
+import time
+
+from unittest.mock import Mock, patch
+
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from .. import models, routers
+from . import factories
+
+
+@override_settings(DOMAINCHECKS_REPLICAS=['replica1'], DOMAINCHECKS_REPLICA_MAX_LAG=30)
+class ReplicaRouterTestCase(SimpleTestCase):
+    """Route dashboard reads to the replicas."""
+
+    def setUp(self):
+        routers._lag.clear()
+        self.router = routers.ReplicaRouter()
+        patched = patch('domainchecks.routers.measure_lag', return_value=0)
+        self.measure_lag = patched.start()
+        self.addCleanup(patched.stop)
+
+    def test_default_reads(self):
+        """Reads go to the primary unless replica reads are enabled."""
+        self.assertEqual(self.router.db_for_read(models.Domain), 'default')
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(models.Domain), 'replica1')
+            with routers.replica_reads(False):
+                self.assertEqual(self.router.db_for_read(models.Domain), 'default')
+            self.assertEqual(self.router.db_for_read(models.Domain), 'replica1')
+
+    def test_writes(self):
+        """Writes always go to the primary."""
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_write(models.Domain), 'default')
+
+    def test_lagging_replica(self):
+        """Replicas too far behind or unreachable are skipped."""
+        for lag in (60, None):
+            routers._lag.clear()
+            self.measure_lag.return_value = lag
+            with routers.replica_reads():
+                self.assertEqual(self.router.db_for_read(models.Domain), 'default')
+
+    def test_lag_measured_periodically(self):
+        """Lag isn't measured for every read."""
+        with routers.replica_reads():
+            self.router.db_for_read(models.Domain)
+            self.router.db_for_read(models.Domain)
+        self.assertEqual(self.measure_lag.call_count, 1)
+
+    @override_settings(DOMAINCHECKS_REPLICAS=[])
+    def test_no_replicas(self):
+        """Reads use the primary when there are no replicas."""
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(models.Domain), 'default')
+
+    def test_migrations(self):
+        """Replicas aren't migrated."""
+        self.assertTrue(self.router.allow_migrate('default', 'domainchecks'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'domainchecks'))
+
+    def test_pinned(self):
+        """Users read from the primary for a while after making a change."""
+        request = Mock(session={})
+        self.assertFalse(routers.is_pinned(request))
+        routers.pin_to_primary(request)
+        self.assertTrue(routers.is_pinned(request))
+        request.session[routers.PIN_KEY] = time.time() - 60
+        self.assertFalse(routers.is_pinned(request))
+
+
+@override_settings(DOMAINCHECKS_REPLICAS=['replica1'])
+class ReplicaReadsTestCase(TransactionTestCase):
+    """Read committed data through the replica connection."""
+
+    def setUp(self):
+        routers._lag.clear()
+
+    def test_status_from_replica(self):
+        """Status reads use the replica inside replica_reads()."""
+        check = factories.create_check_result().domain_check
+        with routers.replica_reads():
+            queryset = models.DomainCheck.objects.status()
+            self.assertEqual(queryset.db, 'replica1')
+            self.assertEqual(queryset.get().pk, check.pk)
+        self.assertEqual(models.DomainCheck.objects.status().db, 'default')
+
+    def test_status_page(self):
+        """Status pages are rendered from the replica."""
+        check = factories.create_check_result().domain_check
+        with patch('domainchecks.routers.get_replica', return_value='replica1') as replica:
+            response = self.client.get(
+                reverse('public-status-detail', kwargs={'domain': check.domain.name}))
+        self.assertContains(response, check.path)
+        self.assertTrue(replica.called)
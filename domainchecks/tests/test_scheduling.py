@@ -0,0 +1,167 @@
+import collections
+import datetime
+
+from django.test import SimpleTestCase
+from django.utils.timezone import now
+
+from .. import scheduling
+
+
+class OffsetTestCase(SimpleTestCase):
+    """Deterministic jitter for each check."""
+
+    def test_within_interval(self):
+        """Offset should always fall inside the interval."""
+        for pk in range(1, 1000):
+            result = scheduling.offset(pk, 120)
+            self.assertGreaterEqual(result, 0)
+            self.assertLess(result, 120)
+
+    def test_deterministic(self):
+        """Same check always gets the same offset."""
+        self.assertEqual(scheduling.offset(42, 300), scheduling.offset(42, 300))
+
+    def test_even_spread(self):
+        """Sequential checks should be spread evenly across the interval."""
+        buckets = collections.Counter(
+            int(scheduling.offset(pk, 100) // 10) for pk in range(1, 1001))
+        self.assertEqual(len(buckets), 10)
+        for count in buckets.values():
+            self.assertAlmostEqual(count, 100, delta=5)
+
+
+class NextDueTestCase(SimpleTestCase):
+    """Calculate when a check should next run."""
+
+    def test_never_checked(self):
+        """Checks without a result are due immediately."""
+        self.assertIsNone(scheduling.next_due(1, 60))
+
+    def test_aligned_to_slot(self):
+        """Due time should be the check's offset within the interval."""
+        last_check = now()
+        result = scheduling.next_due(7, 60, last_check)
+        self.assertAlmostEqual(
+            result.timestamp() % 60, scheduling.offset(7, 60), places=3)
+
+    def test_spacing(self):
+        """Next check is between a half and one and a half intervals away."""
+        last_check = now()
+        for pk in range(1, 100):
+            result = scheduling.next_due(pk, 60, last_check)
+            delta = (result - last_check).total_seconds()
+            self.assertGreaterEqual(delta, 30)
+            self.assertLessEqual(delta, 90)
+
+    def test_stable_slot(self):
+        """Checks which run slightly late keep the same slot."""
+        first = scheduling.next_due(3, 60, now())
+        second = scheduling.next_due(3, 60, first + datetime.timedelta(seconds=2))
+        self.assertEqual((second - first).total_seconds(), 60)
+
+    def test_is_due(self):
+        """Checks are due from their slot, allowing for an early start."""
+        last_check = now()
+        due = scheduling.next_due(3, 60, last_check)
+        self.assertTrue(scheduling.is_due(3, 60, None, last_check))
+        self.assertFalse(scheduling.is_due(3, 60, last_check, due - datetime.timedelta(seconds=2)))
+        self.assertTrue(scheduling.is_due(
+            3, 60, last_check, due - datetime.timedelta(seconds=2), early=5))
+        self.assertTrue(scheduling.is_due(3, 60, last_check, due))
+
+    def test_short_interval(self):
+        """Intervals below the minimum are treated as the minimum."""
+        last_check = now()
+        self.assertEqual(
+            scheduling.next_due(1, 0, last_check),
+            scheduling.next_due(1, scheduling.MIN_INTERVAL, last_check))
+
+
+class DueChecksTestCase(SimpleTestCase):
+    """Select the checks due within a window."""
+
+    def test_due_checks(self):
+        """Overdue checks run now and upcoming checks get a delay."""
+        start = now()
+        window = datetime.timedelta(seconds=60)
+        upcoming = scheduling.next_due(2, 60, start - datetime.timedelta(seconds=45))
+        checks = [
+            (1, 60, None),
+            (2, 60, start - datetime.timedelta(seconds=45)),
+            (3, 60, start - datetime.timedelta(days=1)),
+            (4, 600, start),
+        ]
+        result = dict(
+            (check[0], countdown)
+            for check, countdown in scheduling.due_checks(checks, start, window))
+        self.assertEqual(result[1], 0)
+        self.assertEqual(result[3], 0)
+        self.assertNotIn(4, result)
+        if upcoming > start:
+            self.assertAlmostEqual(result[2], (upcoming - start).total_seconds())
+        else:
+            self.assertEqual(result[2], 0)
+
+
+class FairShareTestCase(SimpleTestCase):
+    """Share the due checks between owners."""
+
+    def setUp(self):
+        start = now()
+        # Owner 'big' has 20 overdue checks, 'small' has 2
+        self.due = [
+            ((pk, 60, start - datetime.timedelta(minutes=pk), 'big'), 0)
+            for pk in range(1, 21)
+        ] + [
+            ((pk, 60, start - datetime.timedelta(minutes=5), 'small'), 0)
+            for pk in (21, 22)
+        ]
+
+    def fair_share(self, **kwargs):
+        chosen = scheduling.fair_share(self.due, owner=lambda check: check[-1], **kwargs)
+        return [check[0] for check, countdown in chosen]
+
+    def test_unlimited(self):
+        """Without limits all checks are run."""
+        self.assertEqual(len(self.fair_share()), 22)
+
+    def test_quota(self):
+        """Owners run up to their quota, most overdue first."""
+        chosen = self.fair_share(quota=lambda owner: 3 if owner == 'big' else None)
+        self.assertEqual(sorted(chosen), [18, 19, 20, 21, 22])
+
+    def test_capacity(self):
+        """Capacity is shared evenly between owners."""
+        chosen = self.fair_share(capacity=6)
+        self.assertEqual(len(chosen), 6)
+        self.assertIn(21, chosen)
+        self.assertIn(22, chosen)
+
+    def test_weights(self):
+        """Owners get capacity in proportion to their weight."""
+        self.due.extend(
+            ((pk, 60, None, 'medium'), 0) for pk in range(23, 43))
+        weights = {'big': 2, 'medium': 1, 'small': 1}
+        chosen = self.fair_share(capacity=12, weight=weights.get)
+        owners = collections.Counter(
+            'big' if pk <= 20 else 'small' if pk <= 22 else 'medium' for pk in chosen)
+        self.assertEqual(owners, {'big': 6, 'medium': 4, 'small': 2})
+
+    def test_zero_weight(self):
+        """Owners without a weight only use spare capacity."""
+        weights = {'big': 0, 'small': 1}
+        self.assertEqual(sorted(self.fair_share(capacity=2, weight=weights.get)), [21, 22])
+        self.assertEqual(len(self.fair_share(capacity=5, weight=weights.get)), 5)
+
+    def test_upcoming_after_overdue(self):
+        """Checks due later in the window are picked after overdue ones."""
+        self.due.append(((23, 60, now(), 'small'), 30))
+        chosen = self.fair_share(quota=lambda owner: 2)
+        self.assertNotIn(23, chosen)
+
+    def test_priority(self):
+        """Higher priority checks take the capacity first across all owners."""
+        urgent = set(range(15, 21))
+        chosen = self.fair_share(
+            capacity=6, priority=lambda check: 0 if check[0] in urgent else 1)
+        self.assertEqual(sorted(chosen), sorted(urgent))
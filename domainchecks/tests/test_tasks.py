@@ -1,14 +1,19 @@
 import datetime
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 
-from django.test import TestCase
+from celery.exceptions import SoftTimeLimitExceeded
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils.timezone import now
 
-from .. import tasks
+from .. import duequeue, models, scheduling, tasks, workers
 from . import factories
 
 
-@patch('domainchecks.models.requests')
+RANGE = {'Range': 'bytes=0-65535'}
+
+
+@patch('domainchecks.probes.requests')
 class CheckDomainTestCase(TestCase):
     """Task to update the status of all checks for a given domain."""
 
@@ -18,21 +23,21 @@ class CheckDomainTestCase(TestCase):
 
     def test_defaults(self, mock_requests):
         """Call task with default arguments to run check."""
-        mock_requests.request.return_value = Mock(
-            status_code=200, text='Ok')
+        mock_requests.request.return_value = factories.build_response()
         tasks.check_domain(name=self.domain.name)
         mock_requests.request.assert_called_once_with(
             self.check.method, self.check.url,
-            allow_redirects=False, timeout=10)
+            allow_redirects=False, timeout=10,
+            stream=True, headers=RANGE)
 
     def test_configure_timeout(self, mock_requests):
         """Timeout for the server request is configurable."""
-        mock_requests.request.return_value = Mock(
-            status_code=200, text='Ok')
+        mock_requests.request.return_value = factories.build_response()
         tasks.check_domain(name=self.domain.name, timeout=60)
         mock_requests.request.assert_called_once_with(
             self.check.method, self.check.url,
-            allow_redirects=False, timeout=60)
+            allow_redirects=False, timeout=60,
+            stream=True, headers=RANGE)
 
     def test_invalid_domain(self, mock_requests):
         """Handle the case where the domain doesn't exist."""
@@ -65,45 +70,389 @@ class CheckDomainTestCase(TestCase):
             domain_check=other, checked_on=now() - datetime.timedelta(minutes=5))
         recent = factories.create_domain_check(domain=self.domain, path='/recent/')
         factories.create_check_result(domain_check=recent)
-        mock_requests.request.return_value = Mock(
-            status_code=200, text='Ok')
+        mock_requests.request.return_value = factories.build_response()
         tasks.check_domain(name=self.domain.name, minutes=4)
         self.assertEqual(mock_requests.request.call_count, 2)
         mock_requests.request.assert_any_call(
             self.check.method, self.check.url,
-            allow_redirects=False, timeout=10)
+            allow_redirects=False, timeout=10,
+            stream=True, headers=RANGE)
         mock_requests.request.assert_any_call(
             other.method, other.url,
-            allow_redirects=False, timeout=10)
+            allow_redirects=False, timeout=10,
+            stream=True, headers=RANGE)
+
+    def test_scheduled_checks(self, mock_requests):
+        """Only the given checks are run when they are passed by the scheduler."""
+        factories.create_check_result(
+            domain_check=self.check, checked_on=now() - datetime.timedelta(hours=1))
+        other = factories.create_domain_check(domain=self.domain, path='/other/')
+        mock_requests.request.return_value = factories.build_response()
+        tasks.check_domain(name=self.domain.name, checks=[self.check.pk])
+        mock_requests.request.assert_called_once_with(
+            self.check.method, self.check.url,
+            allow_redirects=False, timeout=10,
+            stream=True, headers=RANGE)
+        self.assertEqual(other.checkresult_set.count(), 0)
+
+    def test_already_run(self, mock_requests):
+        """Scheduled checks which have run since they were queued are skipped."""
+        factories.create_check_result(domain_check=self.check)
+        tasks.check_domain(name=self.domain.name, checks=[self.check.pk])
+        self.assertFalse(mock_requests.request.called)
+
+    def test_time_limit(self, mock_requests):
+        """Checks stop at the soft time limit and pending results are sent."""
+        other = factories.create_domain_check(domain=self.domain, path='/other/')
+        with patch('domainchecks.models.DomainCheck.run_check') as mock_run:
+            mock_run.side_effect = [None, SoftTimeLimitExceeded()]
+            with patch('domainchecks.tasks.results.get_backend') as mock_backend:
+                tasks.check_domain(
+                    name=self.domain.name, checks=[self.check.pk, other.pk])
+        self.assertEqual(mock_run.call_count, 2)
+        mock_backend.return_value.flush.assert_called_once_with()
+
+    def test_time_limit_requeue(self, mock_requests):
+        """Checks which didn't start before the time limit are queued again."""
+        other = factories.create_domain_check(domain=self.domain, path='/other/')
+        last = factories.create_domain_check(domain=self.domain, path='/last/')
+        workers.add_in_flight(3, 100)
+        self.addCleanup(cache.clear)
+        with patch('domainchecks.models.DomainCheck.run_check') as mock_run:
+            mock_run.side_effect = [None, SoftTimeLimitExceeded()]
+            with patch('domainchecks.tasks.check_domain.apply_async') as mock_apply:
+                tasks.check_domain(
+                    name=self.domain.name, checks=[self.check.pk, other.pk, last.pk],
+                    queued_on=100)
+        args, kwargs = mock_apply.call_args
+        self.assertEqual(args[1]['checks'], [last.pk])
+        self.assertEqual(cache.get(workers.in_flight_key(100)), 1)
+
+    def test_time_budget(self, mock_requests):
+        """Checks which would run past the soft limit are queued again."""
+        other = factories.create_domain_check(domain=self.domain, path='/other/')
+        last = factories.create_domain_check(domain=self.domain, path='/last/')
+        clock = [1000]
+
+        def run_check(timeout):
+            # Soft limit is 45 seconds so a probe can't start after 35
+            clock[0] += 36
+
+        with patch('domainchecks.tasks.time.monotonic', side_effect=lambda: clock[0]):
+            with patch('domainchecks.models.DomainCheck.run_check', side_effect=run_check):
+                with patch('domainchecks.tasks.check_domain.apply_async') as mock_apply:
+                    tasks.check_domain(
+                        name=self.domain.name, checks=[self.check.pk, other.pk, last.pk])
+        args, kwargs = mock_apply.call_args
+        self.assertEqual(args[1]['checks'], [other.pk, last.pk])
+
+    def test_drain(self, mock_requests):
+        """Checks which haven't started when draining are queued again."""
+        other = factories.create_domain_check(domain=self.domain, path='/other/')
+        workers.add_in_flight(2, 100)
+        self.addCleanup(cache.clear)
+
+        def run_check(timeout):
+            workers._draining.set()
+
+        self.addCleanup(workers._draining.clear)
+        with patch('domainchecks.models.DomainCheck.run_check', side_effect=run_check):
+            with patch('domainchecks.tasks.check_domain.apply_async') as mock_apply:
+                tasks.check_domain(
+                    name=self.domain.name, checks=[self.check.pk, other.pk], queued_on=100)
+        args, kwargs = mock_apply.call_args
+        self.assertEqual(args, (
+            (self.domain.name, ), {'timeout': 10, 'checks': [other.pk], 'queued_on': 100}))
+        self.assertEqual(kwargs, {'soft_time_limit': 15, 'time_limit': 20})
+        self.assertEqual(cache.get(workers.in_flight_key(100)), 1)
+
+    def test_time_limits(self, mock_requests):
+        """Limits allow the timeout and a margin for each check."""
+        with self.settings(DOMAINCHECKS_PROBE_TIME_MARGIN=2):
+            self.assertEqual(tasks.time_limits(10, 3), (36, 38))
+            self.assertEqual(tasks.time_limits(10, 0), (12, 14))
 
 
 @patch('domainchecks.tasks.group')
 @patch('domainchecks.tasks.check_domain.s')
 class QueueDomainsTestCase(TestCase):
-    """Fan out checks for domains with active checks."""
+    """Fan out checks which are due to be run."""
 
     def setUp(self):
         self.check = factories.create_domain_check()
         self.domain = self.check.domain
+        self.addCleanup(cache.clear)
 
     def test_queue_domains(self, mock_check, mock_group):
-        """Queue active domains to be checked."""
+        """Queue active checks which have never been run."""
         factories.create_domain_check(is_active=False)
         tasks.queue_domains()
         mock_check.assert_called_once_with(
-            self.domain.name, minutes=10, timeout=10)
-        mock_group.assert_called_once_with(mock_check.return_value)
-        mock_group.return_value.delay.assert_called_one_with()
+            self.domain.name, timeout=10, checks=[self.check.pk])
+        mock_check.return_value.set.assert_called_once_with(
+            countdown=0, soft_time_limit=15, time_limit=20, queue='probes-priority')
+        mock_group.assert_called_once_with(mock_check.return_value.set.return_value)
+        mock_group.return_value.delay.assert_called_once_with()
 
     def test_pass_arguments(self, mock_check, mock_group):
-        """Minutes and timeout arguments should be passed to the subtask."""
-        tasks.queue_domains(minutes=5, timeout=1)
+        """Timeout argument should be passed to the subtask."""
+        tasks.queue_domains(timeout=1)
         mock_check.assert_called_once_with(
-            self.domain.name, minutes=5, timeout=1)
+            self.domain.name, timeout=1, checks=[self.check.pk])
 
     def test_multiple_checks(self, mock_check, mock_group):
-        """Domains with multiple checks should only be queued once."""
-        factories.create_domain_check(domain=self.domain, path='/other/')
+        """Due checks for a domain should be queued together."""
+        other = factories.create_domain_check(domain=self.domain, path='/other/')
+        tasks.queue_domains()
+        mock_check.assert_called_once_with(
+            self.domain.name, timeout=10, checks=[self.check.pk, other.pk])
+        mock_check.return_value.set.assert_called_once_with(
+            countdown=0, soft_time_limit=30, time_limit=35, queue='probes-priority')
+
+    def test_not_due(self, mock_check, mock_group):
+        """Recently run checks are not queued."""
+        factories.create_check_result(domain_check=self.check)
         tasks.queue_domains()
+        self.assertFalse(mock_check.called)
+        mock_group.assert_called_once_with()
+
+    def test_countdown(self, mock_check, mock_group):
+        """Checks due later in the window are delayed until their slot."""
+        self.check.interval = 60
+        self.check.save(update_fields=('interval', ))
+        last_check = now() - datetime.timedelta(seconds=30)
+        factories.create_check_result(domain_check=self.check, checked_on=last_check)
+        models.CheckState.objects.filter(pk=self.check.pk).update(
+            status='good', pending_status='', pending_count=0)
+        with patch('domainchecks.tasks.now') as mock_now:
+            mock_now.return_value = last_check + datetime.timedelta(seconds=30)
+            tasks.queue_domains(window=60)
+            start = mock_now.return_value
+        due = scheduling.next_due(self.check.pk, 60, last_check)
         mock_check.assert_called_once_with(
-            self.domain.name, minutes=10, timeout=10)
+            self.domain.name, timeout=10, checks=[self.check.pk])
+        expected = max(0, int((due - start).total_seconds()))
+        mock_check.return_value.set.assert_called_once_with(
+            countdown=expected, soft_time_limit=15, time_limit=20)
+
+    def test_priority_queue(self, mock_check, mock_group):
+        """Failing checks are queued ahead of healthy ones."""
+        healthy = factories.create_domain_check(domain='other.com')
+        for check, status in ((self.check, 'poor'), (healthy, 'good')):
+            factories.create_check_result(
+                domain_check=check, checked_on=now() - datetime.timedelta(hours=1))
+            models.CheckState.objects.filter(pk=check.pk).update(
+                status=status, pending_status='', pending_count=0)
+        tasks.queue_domains()
+        queues = dict(
+            (call[1]['checks'][0], options[1].get('queue'))
+            for call, options in zip(
+                mock_check.call_args_list, mock_check.return_value.set.call_args_list))
+        self.assertEqual(queues, {self.check.pk: 'probes-priority', healthy.pk: None})
+
+    def test_check_priority(self, mock_check, mock_group):
+        """New, failing and changing checks have a high priority."""
+        last_check = now()
+        self.assertEqual(
+            tasks.check_priority((1, 60, None, 'a.com', None, None, 1)), tasks.PRIORITY_HIGH)
+        self.assertEqual(
+            tasks.check_priority((1, 60, last_check, 'a.com', 'poor', '', 1)),
+            tasks.PRIORITY_HIGH)
+        self.assertEqual(
+            tasks.check_priority((1, 60, last_check, 'a.com', 'good', 'fair', 1)),
+            tasks.PRIORITY_HIGH)
+        self.assertEqual(
+            tasks.check_priority((1, 60, last_check, 'a.com', 'good', '', 1)),
+            tasks.PRIORITY_NORMAL)
+
+    def test_owner_quota(self, mock_check, mock_group):
+        """Owners are limited to their probe rate over the window."""
+        models.OwnerQuota.objects.create(owner=self.domain.owner, probes_per_minute=2)
+        for path in ('/a/', '/b/', '/c/'):
+            factories.create_domain_check(domain=self.domain, path=path)
+        tasks.queue_domains(window=60)
+        self.assertEqual(len(mock_check.call_args[1]['checks']), 2)
+
+    def test_probe_capacity(self, mock_check, mock_group):
+        """Capacity is shared between owners when workers are saturated."""
+        for path in ('/a/', '/b/', '/c/'):
+            factories.create_domain_check(domain=self.domain, path=path)
+        other = factories.create_domain_check(domain='other.com')
+        with self.settings(DOMAINCHECKS_PROBE_CAPACITY=2):
+            tasks.queue_domains(window=60)
+        queued = [call[1]['checks'] for call in mock_check.call_args_list]
+        self.assertEqual(sorted(len(checks) for checks in queued), [1, 1])
+        self.assertIn([other.pk], queued)
+
+    def test_batch_size(self, mock_check, mock_group):
+        """A domain's due checks are split into tasks of the batch size."""
+        for path in ('/a/', '/b/', '/c/', '/d/'):
+            factories.create_domain_check(domain=self.domain, path=path)
+        with self.settings(DOMAINCHECKS_PROBE_BATCH_SIZE=2):
+            tasks.queue_domains()
+        self.assertEqual(
+            [len(call[1]['checks']) for call in mock_check.call_args_list], [2, 2, 1])
+
+    def test_zero_interval(self, mock_check, mock_group):
+        """Checks saved without validation don't stop the others being queued."""
+        other = factories.create_domain_check(domain='other.com', interval=0)
+        factories.create_check_result(domain_check=other)
+        tasks.queue_domains()
+        mock_check.assert_any_call(self.domain.name, timeout=10, checks=[self.check.pk])
+
+    @patch('domainchecks.workers.is_shared_cache', return_value=True)
+    def test_in_flight(self, mock_shared, mock_check, mock_group):
+        """Queued checks are counted as in flight."""
+        self.addCleanup(cache.clear)
+        with self.settings(DOMAINCHECKS_MAX_IN_FLIGHT=10):
+            tasks.queue_domains()
+            self.assertEqual(workers.in_flight(), 1)
+        self.assertEqual(
+            mock_check.call_args[1]['queued_on'], workers.current_minute())
+
+    def test_already_queued(self, mock_check, mock_group):
+        """Checks already queued for their slot aren't queued again."""
+        other = factories.create_domain_check(domain='other.com')
+        tasks.queue_domains()
+        self.assertEqual(mock_check.call_count, 2)
+        factories.create_check_result(
+            domain_check=other, checked_on=now() - datetime.timedelta(hours=1))
+        mock_check.reset_mock()
+        tasks.queue_domains()
+        mock_check.assert_called_once_with('other.com', timeout=10, checks=[other.pk])
+
+    @patch('domainchecks.tasks.workers.available_capacity', return_value=0)
+    def test_backpressure(self, mock_capacity, mock_check, mock_group):
+        """Nothing is queued when the workers have no room."""
+        tasks.queue_domains()
+        self.assertFalse(mock_check.called)
+
+
+@patch('domainchecks.tasks.group')
+@patch('domainchecks.tasks.check_domain.s')
+@override_settings(DOMAINCHECKS_DUE_QUEUE=True)
+class QueueDomainsDueQueueTestCase(TestCase):
+    """Fan out the due checks from the in-memory due queue."""
+
+    def setUp(self):
+        self.check = factories.create_domain_check()
+        patched = patch.object(duequeue, '_queue', None)
+        patched.start()
+        self.addCleanup(patched.stop)
+        self.addCleanup(cache.clear)
+
+    def test_queue_domains(self, mock_check, mock_group):
+        """Due checks are queued and then expected to run in their slot."""
+        tasks.queue_domains()
+        mock_check.assert_called_once_with(
+            self.check.domain.name, timeout=10, checks=[self.check.pk])
+        queue = duequeue.get_queue()
+        self.assertGreater(queue.next_due(), now().timestamp())
+        mock_check.reset_mock()
+        tasks.queue_domains()
+        self.assertFalse(mock_check.called)
+
+    def test_checked_elsewhere(self, mock_check, mock_group):
+        """Checks which have run since the queue was updated aren't queued."""
+        queue = duequeue.get_queue()
+        self.assertEqual(queue.next_due(), 0)
+        result = factories.create_check_result(domain_check=self.check)
+        with patch('domainchecks.duequeue.refresh'):
+            tasks.queue_domains()
+        self.assertFalse(mock_check.called)
+        self.assertEqual(queue.last_check(self.check.pk), result.last_checked_on.timestamp())
+        self.assertGreater(queue.next_due(), now().timestamp())
+
+    def test_deferred(self, mock_check, mock_group):
+        """Checks over the limits stay due for the next window."""
+        other = factories.create_domain_check(domain='other.com')
+        with self.settings(DOMAINCHECKS_PROBE_CAPACITY=1):
+            tasks.queue_domains()
+        self.assertEqual(mock_check.call_count, 1)
+        queued = mock_check.call_args[1]['checks']
+        mock_check.reset_mock()
+        tasks.queue_domains()
+        self.assertEqual(mock_check.call_count, 1)
+        self.assertNotEqual(mock_check.call_args[1]['checks'], queued)
+        self.assertIn(other.pk, queued + mock_check.call_args[1]['checks'])
+
+    def test_failure(self, mock_check, mock_group):
+        """Taken checks are put back in the queue when queueing fails."""
+        mock_group.return_value.delay.side_effect = OSError('Broker is down')
+        with self.assertRaises(OSError):
+            tasks.queue_domains()
+        queue = duequeue.get_queue()
+        self.assertFalse(queue.is_taken(self.check.pk))
+        self.assertEqual(queue.pop_due(now().timestamp()), [self.check.pk])
+
+    def test_deactivated(self, mock_check, mock_group):
+        """Checks which are no longer active are dropped from the queue."""
+        queue = duequeue.get_queue()
+        models.DomainCheck.objects.filter(pk=self.check.pk).update(is_active=False)
+        queue.add(self.check.pk, 120)
+        with patch('domainchecks.duequeue.refresh'):
+            tasks.queue_domains()
+        self.assertFalse(mock_check.called)
+        self.assertNotIn(self.check.pk, queue)
+
+
+class IngestResultsTestCase(TestCase):
+    """Write result records published by the probes."""
+
+    def test_ingest(self):
+        """Records should be written as check results."""
+        check = factories.create_domain_check()
+        record = [check.pk, now().timestamp(), 200, 0.5, 'Ok', None, '']
+        tasks.ingest_results([record, record])
+        self.assertEqual(check.checkresult_set.count(), 2)
+        result = check.checkresult_set.all()[0]
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.response_time, 0.5)
+
+    def test_deleted_check(self):
+        """Records for deleted checks are dropped without losing the batch."""
+        check = factories.create_domain_check()
+        deleted = factories.create_domain_check()
+        records = [
+            [pk, now().timestamp(), 200, 0.5, 'Ok', None, '']
+            for pk in (check.pk, deleted.pk)]
+        deleted.delete()
+        with patch('domainchecks.tasks.logger'):
+            tasks.ingest_results(records)
+        self.assertEqual(check.checkresult_set.count(), 1)
+        self.assertEqual(models.CheckResult.objects.count(), 1)
+
+
+class PruneStatusBucketsTestCase(TestCase):
+    """Remove expired status buckets."""
+
+    def test_prune(self):
+        """Buckets older than the retention period are deleted."""
+        check = factories.create_domain_check()
+        factories.create_check_result(
+            domain_check=check, checked_on=now() - datetime.timedelta(days=2))
+        factories.create_check_result(domain_check=check)
+        tasks.prune_status_buckets()
+        bucket = models.StatusBucket.objects.get()
+        self.assertEqual(bucket.pings, 1)
+        self.assertEqual(models.DomainStatusBucket.objects.get().pings, 1)
+        self.assertGreater(bucket.started_on, now() - datetime.timedelta(days=1))
+
+
+class DeliverAlertsTaskTestCase(TestCase):
+    """Send queued alerts."""
+
+    @patch('domainchecks.tasks.alerts.deliver_alerts')
+    def test_prune_delivered(self, mock_deliver):
+        """Delivered alerts past the retention period are deleted."""
+        check = factories.create_domain_check()
+        old, recent, queued = [
+            models.AlertEvent.objects.create(
+                domain_check=check, kind='transition', previous_status='good',
+                status='poor', delivered_on=delivered_on)
+            for delivered_on in (now() - datetime.timedelta(days=31), now(), None)]
+        tasks.deliver_alerts()
+        self.assertTrue(mock_deliver.called)
+        self.assertQuerysetEqual(
+            models.AlertEvent.objects.order_by('pk'), [recent.pk, queued.pk],
+            transform=lambda event: event.pk)
@@ -0,0 +1,94 @@
+import threading
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .. import updates
+from . import factories
+
+
+@override_settings(DOMAINCHECKS_UPDATES_HISTORY=3)
+class MemoryChannelTestCase(SimpleTestCase):
+    """In-process publishing of live updates."""
+
+    def setUp(self):
+        self.channel = updates.MemoryChannel()
+
+    def test_read_events(self):
+        """Events after the given version are returned."""
+        self.assertEqual(self.channel.read('a', 0), (0, []))
+        self.channel.publish('a', 1)
+        self.channel.publish('a', 2)
+        self.channel.publish('b', 3)
+        self.assertEqual(self.channel.read('a', 0), (2, [1, 2]))
+        self.assertEqual(self.channel.read('a', 1), (2, [2]))
+        self.assertEqual(self.channel.read('a', 2), (2, []))
+        self.assertEqual(self.channel.version('b'), 1)
+
+    def test_missed_events(self):
+        """Clients which are too far behind must reset."""
+        for i in range(5):
+            self.channel.publish('a', i)
+        self.assertEqual(self.channel.read('a', 1), (5, None))
+        self.assertEqual(self.channel.read('a', 2), (5, [2, 3, 4]))
+        self.assertEqual(self.channel.read('a', 7), (5, None))
+
+    def test_wait_timeout(self):
+        """Waiting returns no events once the timeout passes."""
+        self.assertEqual(self.channel.wait('a', 0, timeout=0.01), (0, []))
+
+    def test_wait_wakeup(self):
+        """Waiting requests are woken as soon as an event is published."""
+        timer = threading.Timer(0.05, self.channel.publish, args=('a', 'new'))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(self.channel.wait('a', 0, timeout=5), (1, ['new']))
+
+
+@override_settings(DOMAINCHECKS_UPDATES_HISTORY=3, DOMAINCHECKS_UPDATES_POLL=0.01)
+class CacheChannelTestCase(SimpleTestCase):
+    """Live updates shared through the cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.channel = updates.CacheChannel()
+
+    def test_read_events(self):
+        """Events after the given version are returned."""
+        self.assertEqual(self.channel.read('a', 0), (0, []))
+        self.channel.publish('a', 1)
+        self.channel.publish('a', 2)
+        self.assertEqual(self.channel.read('a', 0), (2, [1, 2]))
+        self.assertEqual(self.channel.read('a', 2), (2, []))
+
+    def test_missed_events(self):
+        """Clients which are too far behind or missed an event must reset."""
+        for i in range(5):
+            self.channel.publish('a', i)
+        self.assertEqual(self.channel.read('a', 1), (5, None))
+        cache.delete(self.channel.key('a', 4))
+        self.assertEqual(self.channel.read('a', 3), (5, None))
+
+    def test_publishing(self):
+        """Events which are still being published are read later."""
+        self.channel.publish('a', 1)
+        cache.incr(self.channel.key('a'))
+        self.assertEqual(self.channel.read('a', 0), (1, [1]))
+        self.assertEqual(self.channel.wait('a', 1, timeout=0.02), (2, None))
+
+
+@override_settings(DOMAINCHECKS_UPDATES_CHANNEL='domainchecks.updates.MemoryChannel')
+class PublishResultsTestCase(TestCase):
+    """Events published when results are recorded."""
+
+    def test_publish(self):
+        """New points are sent for the domain and changed domains for the owner."""
+        check = factories.create_domain_check()
+        channel = updates.get_channel()
+        result = factories.create_check_result(domain_check=check, status_code=500)
+        domain = updates.domain_topic(check.domain.pk)
+        owner = updates.owner_topic(check.domain.owner.pk)
+        version, events = channel.read(domain, channel.version(domain) - 1)
+        self.assertEqual(events[0], {'points': {check.pk: [updates.timeline_point(result)]}})
+        version, events = channel.read(owner, channel.version(owner) - 1)
+        self.assertEqual(events[0], {'domains': [check.domain.pk]})
@@ -1,13 +1,19 @@
 import datetime
+import json
+import shutil
+import tempfile
 
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
-from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.core.urlresolvers import reverse
 from django.http import Http404
-from django.test import RequestFactory, TestCase
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.utils.timezone import now
 
-from .. import models, views
+from .. import archive, models, updates, views
+from ..signals import results_recorded
 from . import factories
 
 
@@ -38,6 +44,38 @@ class StatusListViewTestCase(TestCase):
             self.assertNotContains(response, 'evil.com')
             self.assertNotContains(response, other.name)
 
+    def get_page(self, view, **params):
+        view.request = self.factory.get(self.url, params)
+        view.request.user = self.user
+        view.args, view.kwargs = [], {}
+        view.object_list = view.get_queryset()
+        return view.get_context_data()
+
+    def test_paginate_domains(self):
+        """Domains are shown a page at a time with their rolled up status."""
+        for name in ('c.com', 'a.com', 'b.com'):
+            check = factories.create_domain_check(
+                domain=factories.create_domain(name=name, owner=self.user))
+            factories.create_check_result(domain_check=check)
+        view = views.StatusList()
+        view.paginate_by = 2
+        context = self.get_page(view)
+        self.assertTrue(context['is_paginated'])
+        self.assertEqual([d.name for d in context['domains']], ['a.com', 'b.com'])
+        self.assertEqual(context['domains'][0].status, 'good')
+        self.assertEqual(context['next_after'], context['domains'][1].pk)
+        context = self.get_page(view, after=context['next_after'])
+        self.assertEqual([d.name for d in context['domains']], ['c.com'])
+        self.assertIsNone(context['next_after'])
+
+    def test_invalid_page_start(self):
+        """Unknown page starts show the first page."""
+        factories.create_domain_check(
+            domain=factories.create_domain(name='a.com', owner=self.user))
+        context = self.get_page(views.StatusList(), after='x')
+        self.assertEqual([d.name for d in context['domains']], ['a.com'])
+        self.assertFalse(context['is_paginated'])
+
     def test_no_domains(self):
         """Page will still render if there are no domains."""
         request = self.factory.get(self.url)
@@ -89,6 +127,48 @@ class StatusDetailViewTestCase(TestCase):
         self.assertQuerysetEqual(
             qs, [check.pk, ], transform=lambda x: x.pk)
 
+    def test_keyset_with_duplicates(self):
+        """Checks with the same path are ordered by their pk."""
+        first = factories.create_domain_check()
+        second = factories.create_domain_check(domain=first.domain, method='post')
+        third = factories.create_domain_check(domain=first.domain, path='/a/')
+        view = views.StatusDetail()
+        view.paginate_by = 1
+        view.args = []
+        view.kwargs = {'domain': first.domain.name}
+        found, after = [], ''
+        for i in range(3):
+            view.request = self.factory.get('/', {'after': after} if after else {})
+            view.object_list = view.get_queryset()
+            context = view.get_context_data()
+            found.extend(check.pk for check in context['checks'])
+            after = context['next_after']
+        self.assertEqual(found, [first.pk, second.pk, third.pk])
+        self.assertIsNone(after)
+
+    def test_status_window(self):
+        """Status is computed for the requested window in minutes."""
+        check = factories.create_domain_check()
+        factories.create_check_result(
+            domain_check=check, checked_on=now() - datetime.timedelta(minutes=90))
+        url = reverse('public-status-detail', kwargs={'domain': check.domain.name})
+        view = views.StatusDetail()
+        view.args = []
+        view.kwargs = {'domain': check.domain.name}
+        view.request = self.factory.get(url)
+        self.assertEqual(view.get_queryset().get().status, 'unknown')
+        view.request = self.factory.get(url, {'window': '120'})
+        self.assertEqual(view.get_queryset().get().status, 'good')
+
+    def test_invalid_status_window(self):
+        """Invalid windows fall back to the default and are kept in range."""
+        request = self.factory.get('/', {'window': 'x'})
+        self.assertEqual(views.get_status_window(request), datetime.timedelta(hours=1))
+        request = self.factory.get('/', {'window': '0'})
+        self.assertEqual(views.get_status_window(request), datetime.timedelta(minutes=1))
+        request = self.factory.get('/', {'window': '100000'})
+        self.assertEqual(views.get_status_window(request), datetime.timedelta(days=1))
+
     def test_render_checks(self):
         """Render the active checks for a given domain."""
         check = factories.create_domain_check()
@@ -165,6 +245,76 @@ class PrivateStatusDetailViewTestCase(TestCase):
             self.view(request, domain=domain.name)
 
 
+@override_settings(
+    DOMAINCHECKS_UPDATES_CHANNEL='domainchecks.updates.MemoryChannel',
+    DOMAINCHECKS_UPDATES_TIMEOUT=0, DOMAINCHECKS_UPDATES_RETRY=10)
+class StatusUpdatesViewTestCase(TestCase):
+    """Long-polling for live status updates."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.view = views.StatusUpdates.as_view()
+        self.check = factories.create_domain_check()
+        self.domain = self.check.domain.name
+        self.url = reverse('status-updates', kwargs={'domain': self.domain})
+
+    def get(self, **params):
+        response = self.view(self.factory.get(self.url, params), domain=self.domain)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_current_version(self):
+        """Clients start with the current version."""
+        factories.create_check_result(domain_check=self.check)
+        version = updates.get_channel().version(updates.domain_topic(self.check.domain.pk))
+        self.assertEqual(self.get(), {'version': version, 'reset': False})
+
+    def test_changes(self):
+        """Changed checks and their new points are returned."""
+        version = self.get()['version']
+        factories.create_check_result(domain_check=self.check, status_code=500)
+        factories.create_check_result(domain_check=self.check)
+        data = self.get(version=version)
+        self.assertEqual(data['version'], version + 2)
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['retry'], 0)
+        self.assertEqual(len(data['points'][str(self.check.pk)]), 2)
+        status, = data['checks']
+        self.assertEqual(status['id'], self.check.pk)
+        self.assertEqual((status['successes'], status['pings']), (1, 2))
+        self.assertEqual(status['status'], 'poor')
+
+    def test_no_changes(self):
+        """Nothing is returned when the timeout passes without changes."""
+        version = self.get()['version']
+        self.assertEqual(
+            self.get(version=version), {'version': version, 'reset': False, 'retry': 10})
+
+    def test_reset(self):
+        """Clients ahead of the channel must reload."""
+        version = self.get()['version']
+        self.assertTrue(self.get(version=version + 5)['reset'])
+
+    def test_unknown_domain(self):
+        """Unknown domains are not found."""
+        request = self.factory.get('/')
+        with self.assertRaises(Http404):
+            self.view(request, domain='unknown.com')
+
+    def test_domain_changes(self):
+        """Changed domains of the current user are returned."""
+        view = views.StatusListUpdates.as_view()
+        request = self.factory.get('/')
+        request.user = self.check.domain.owner
+        version = json.loads(view(request).content.decode('utf-8'))['version']
+        factories.create_check_result(domain_check=self.check)
+        factories.create_check_result()
+        request = self.factory.get('/', {'version': version})
+        request.user = self.check.domain.owner
+        data = json.loads(view(request).content.decode('utf-8'))
+        self.assertEqual([d['name'] for d in data['domains']], [self.domain])
+        self.assertEqual(data['domains'][0]['status'], 'good')
+
+
 class CheckTimelineViewTestCase(TestCase):
     """JSON list of check results."""
 
@@ -216,6 +366,50 @@ class CheckTimelineViewTestCase(TestCase):
         with self.assertRaises(Http404):
             self.view(request, check=check.pk)
 
+    def test_overlapping_runs(self):
+        """Compacted runs which overlap the range are included."""
+        check = factories.create_domain_check()
+        factories.create_check_result(
+            domain_check=check, count=10,
+            checked_on=now() - datetime.timedelta(days=2),
+            last_checked_on=now() - datetime.timedelta(hours=20))
+        factories.create_check_result(
+            domain_check=check, checked_on=now() - datetime.timedelta(days=3))
+        url = reverse('status-timeline', kwargs={'check': check.pk})
+        today = datetime.datetime.now()
+        data = {
+            'start': (today - datetime.timedelta(days=1)).isoformat(sep=' '),
+            'end': today.isoformat(sep=' '),
+        }
+        request = self.factory.get(url, data=data)
+        response = self.view(request, check=check.pk)
+        results = json.loads(response.content.decode('utf-8'))['results']
+        self.assertEqual([r['count'] for r in results], [10])
+
+    def test_archived_results(self):
+        """Archived results are read along with the ones in the database."""
+        check = factories.create_domain_check()
+        factories.create_check_result(
+            domain_check=check, checked_on=now() - datetime.timedelta(hours=2))
+        factories.create_check_result(
+            domain_check=check, checked_on=now() - datetime.timedelta(hours=1), status_code=500)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.settings(DOMAINCHECKS_ARCHIVE_DIR=directory):
+            archive.archive_results(before=now() - datetime.timedelta(minutes=90))
+            factories.create_check_result(domain_check=check, status_code=404)
+            url = reverse('status-timeline', kwargs={'check': check.pk})
+            today = datetime.datetime.now()
+            data = {
+                'start': (today - datetime.timedelta(days=1)).isoformat(sep=' '),
+                'end': today.isoformat(sep=' '),
+            }
+            request = self.factory.get(url, data=data)
+            response = self.view(request, check=check.pk)
+        results = json.loads(response.content.decode('utf-8'))['results']
+        self.assertEqual([r['status_code'] for r in results], [404, 500, 200])
+        self.assertEqual(models.CheckResult.objects.filter(domain_check=check).count(), 2)
+
     def test_get_results(self):
         """Build result dictionary from context."""
         view = views.CheckTimeline()
@@ -258,11 +452,15 @@ class CheckTimelineViewTestCase(TestCase):
         expected = [
             {
                 'checked_on': convert_date(failure.checked_on),
+                'last_checked_on': convert_date(failure.checked_on),
+                'count': 1,
                 'status_code': failure.status_code,
                 'response_time': failure.response_time,
             },
             {
                 'checked_on': convert_date(success.checked_on),
+                'last_checked_on': convert_date(success.checked_on),
+                'count': 1,
                 'status_code': success.status_code,
                 'response_time': success.response_time,
             },
@@ -344,6 +542,97 @@ class CreateDomainViewTestCase(TestCase):
         self.assertContains(response, 'This field is required.')
 
 
+class ProvisionDomainsViewTestCase(TestCase):
+    """Adding domains in bulk."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.url = reverse('domain-bulk-add')
+        self.view = views.ProvisionDomains.as_view()
+        self.user = factories.create_user()
+        # Refused requests are logged as warnings
+        for logger in ('django.core.handlers.base.logger', 'django.middleware.csrf.logger'):
+            patched = patch(logger)
+            patched.start()
+            self.addCleanup(patched.stop)
+
+    def post(self, data):
+        request = self.factory.post(
+            self.url, data=json.dumps(data), content_type='application/json')
+        request.user = self.user
+        request._dont_enforce_csrf_checks = True
+        response = self.view(request)
+        return response, json.loads(response.content.decode('utf-8'))
+
+    def test_create_domains(self):
+        """Valid domains are created and errors returned by position."""
+        response, data = self.post({'domains': [
+            {'name': 'example.com', 'checks': [{'path': '/'}]},
+            {'name': 'example.com', 'checks': [{'path': '/'}]},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(list(data['errors']), ['1'])
+        domain = models.Domain.objects.get(name='example.com')
+        self.assertEqual(domain.owner, self.user)
+
+    def test_invalid_body(self):
+        """The body must have a list of domains."""
+        response, data = self.post({'domains': 'example.com'})
+        self.assertEqual(response.status_code, 400)
+        response, data = self.post([])
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_checks(self):
+        """Checks which aren't a list of objects are an error for their domain."""
+        response, data = self.post({'domains': [{'name': 'example.com', 'checks': ['x']}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, {
+            'created': 0, 'errors': {'0': {'checks': ['Checks must be a list of objects.']}}})
+
+    def test_api_key(self):
+        """Scripts authenticate with a key for the user instead of a session."""
+        client = Client(enforce_csrf_checks=True)
+        body = json.dumps({'domains': [{'name': 'example.com', 'checks': [{'path': '/'}]}]})
+        with self.settings(DOMAINCHECKS_API_KEYS={'secret': self.user.username}):
+            response = client.post(
+                self.url, body, content_type='application/json',
+                HTTP_AUTHORIZATION='Token secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(models.Domain.objects.get().owner, self.user)
+            response = client.post(
+                self.url, body, content_type='application/json',
+                HTTP_AUTHORIZATION='Token other')
+            self.assertEqual(response.status_code, 403)
+
+    def test_session_csrf(self):
+        """Calls with the user's session must pass the CSRF check."""
+        self.user.set_password('test')
+        self.user.save()
+        client = Client(enforce_csrf_checks=True)
+        client.login(username=self.user.username, password='test')
+        body = json.dumps({'domains': [{'name': 'example.com', 'checks': [{'path': '/'}]}]})
+        response = client.post(self.url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        client.get(reverse('domain-add'))
+        response = client.post(
+            self.url, body, content_type='application/json',
+            HTTP_X_CSRFTOKEN=client.cookies['csrftoken'].value)
+        self.assertEqual(response.status_code, 200)
+
+    def test_anonymous(self):
+        """Anonymous calls are refused."""
+        response = Client().post(self.url, '{"domains": []}', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_too_many(self):
+        """The number of domains per request is limited."""
+        with self.settings(DOMAINCHECKS_PROVISION_MAX=1):
+            response, data = self.post({'domains': [{}, {}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Domain.objects.exists())
+
+
 class EditDomainViewTestCase(TestCase):
     """Update an existing domain."""
 
@@ -448,3 +737,215 @@ class EditDomainViewTestCase(TestCase):
         self.view(request, domain=self.domain.name)
         self.check.refresh_from_db()
         self.assertEqual(self.check.path, '/test/')
+
+
+class ExportResultsViewTestCase(TestCase):
+    """Bulk export of the user's check results."""
+
+    def setUp(self):
+        self.url = reverse('export-results')
+        self.factory = RequestFactory()
+        self.view = views.ExportResults.as_view()
+        self.user = factories.create_user()
+        domain = factories.create_domain(owner=self.user)
+        self.check = factories.create_domain_check(domain=domain)
+        self.result = factories.create_check_result(domain_check=self.check)
+        self.params = {
+            'checks': self.check.pk,
+            'start': (self.result.checked_on - datetime.timedelta(days=31)).isoformat(),
+            'end': (self.result.checked_on + datetime.timedelta(minutes=1)).isoformat(),
+        }
+
+    def get(self, **params):
+        request = self.factory.get(self.url, dict(self.params, **params))
+        request.user = self.user
+        return self.view(request)
+
+    def test_stream_csv(self):
+        """Results are streamed as CSV by default over any time range."""
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('results.csv', response['Content-Disposition'])
+        rows = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith('{},{},'.format(self.result.pk, self.check.pk)))
+
+    def test_stream_jsonl(self):
+        """Results can be streamed as JSON lines."""
+        response = self.get(format='jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(data['id'], self.result.pk)
+
+    def test_other_owner(self):
+        """Checks of other users' domains can't be exported."""
+        other = factories.create_domain_check(domain='other.com')
+        response = self.get(checks=other.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('checks', json.loads(response.content.decode('utf-8'))['errors'])
+
+    def test_invalid_range(self):
+        """End must be after the start."""
+        response = self.get(end=self.params['start'])
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DOMAINCHECKS_AGENT_KEYS={'secret': 'east'})
+class AgentChecksViewTestCase(TestCase):
+    """Due checks handed out to probe agents."""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('agent-checks')
+        self.auth = {'HTTP_AUTHORIZATION': 'Token secret'}
+
+    def test_invalid_key(self):
+        """Agents must authenticate with a known key."""
+        view = views.AgentChecks.as_view()
+        factory = RequestFactory()
+        with self.assertRaises(PermissionDenied):
+            view(factory.get(self.url, HTTP_AUTHORIZATION='Token other'))
+        with self.assertRaises(PermissionDenied):
+            view(factory.get(self.url))
+
+    def test_due_checks(self):
+        """Checks without a recent result from the region are returned."""
+        check = factories.create_domain_check()
+        factories.create_check_result(domain_check=check, region='west')
+        recent = factories.create_domain_check()
+        factories.create_check_result(domain_check=recent, region='east')
+        factories.create_domain_check(is_active=False)
+        response = self.client.get(self.url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['region'], 'east')
+        self.assertEqual(len(data['checks']), 1)
+        result = dict(zip(data['fields'], data['checks'][0]))
+        self.assertEqual(result['id'], check.pk)
+        self.assertEqual(result['url'], check.url)
+        self.assertEqual(result['method'], 'get')
+        self.assertEqual(result['max_bytes'], 64 * 1024)
+
+    def test_unreachable_cache(self):
+        """Leases which can't be stored are an error rather than no checks."""
+        factories.create_domain_check()
+        view = views.AgentChecks.as_view()
+        request = RequestFactory().get(self.url, **self.auth)
+        with patch('domainchecks.views.cache') as mock_cache:
+            mock_cache.add.return_value = False
+            mock_cache.get.return_value = None
+            with self.assertRaises(ImproperlyConfigured):
+                view(request)
+
+    def test_leased_checks(self):
+        """Checks are not handed out again while they are leased."""
+        factories.create_domain_check()
+        factories.create_domain_check()
+        response = self.client.get(self.url, {'limit': 1}, **self.auth)
+        first = json.loads(response.content.decode('utf-8'))['checks']
+        response = self.client.get(self.url, **self.auth)
+        second = json.loads(response.content.decode('utf-8'))['checks']
+        response = self.client.get(self.url, **self.auth)
+        third = json.loads(response.content.decode('utf-8'))['checks']
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0][0], second[0][0])
+        self.assertEqual(third, [])
+
+    def test_old_results(self):
+        """Only recent results are read and checks without one are due."""
+        check = factories.create_domain_check(interval=60)
+        factories.create_check_result(
+            domain_check=check, region='east', checked_on=now() - datetime.timedelta(days=1))
+        recent = factories.create_domain_check(interval=60)
+        factories.create_check_result(domain_check=recent, region='east')
+        response = self.client.get(self.url, **self.auth)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([c[0] for c in data['checks']], [check.pk])
+
+    def test_invalid_limit(self):
+        """Limit must be a number."""
+        response = self.client.get(self.url, {'limit': 'x'}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DOMAINCHECKS_AGENT_KEYS={'secret': 'east'})
+class AgentResultsViewTestCase(TestCase):
+    """Results pushed by probe agents."""
+
+    def setUp(self):
+        self.url = reverse('agent-results')
+        self.auth = {'HTTP_AUTHORIZATION': 'Token secret'}
+        self.check = factories.create_domain_check()
+
+    def post(self, data, **kwargs):
+        return self.client.post(
+            self.url, json.dumps(data), content_type='application/json', **kwargs)
+
+    def test_invalid_key(self):
+        """Agents must authenticate with a known key."""
+        view = views.AgentResults.as_view()
+        request = RequestFactory().post(
+            self.url, '{"results": []}', content_type='application/json',
+            HTTP_AUTHORIZATION='Token other')
+        with self.assertRaises(PermissionDenied):
+            view(request)
+
+    def test_save_results(self):
+        """Results are stored with the agent's region."""
+        record = [self.check.pk, now().timestamp(), 200, 0.1, 'Ok', None]
+        response = self.post({'results': [record, record]}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(
+            response.content.decode('utf-8'), {'accepted': 2, 'rejected': 0})
+        saved = self.check.checkresult_set.all()
+        self.assertEqual(saved.count(), 2)
+        self.assertEqual(saved[0].region, 'east')
+        self.assertEqual(saved[0].status_code, 200)
+
+    def test_bulk_write(self):
+        """A push is written as one batch rather than result by result."""
+        handler = Mock()
+        results_recorded.connect(handler)
+        self.addCleanup(results_recorded.disconnect, handler)
+        record = [self.check.pk, now().timestamp(), 200, 0.1, 'Ok', None]
+        self.post({'results': [record, record, record]}, **self.auth)
+        self.assertEqual(handler.call_count, 1)
+        self.assertEqual(len(handler.call_args[1]['results']), 3)
+
+    def test_unknown_checks(self):
+        """Results for inactive or missing checks are rejected."""
+        inactive = factories.create_domain_check(is_active=False)
+        records = [
+            [inactive.pk, now().timestamp(), 200, 0.1, 'Ok', None],
+            [0, now().timestamp(), 200, 0.1, 'Ok', None],
+        ]
+        response = self.post({'results': records}, **self.auth)
+        self.assertJSONEqual(
+            response.content.decode('utf-8'), {'accepted': 0, 'rejected': 2})
+        self.assertEqual(models.CheckResult.objects.count(), 0)
+
+    def test_invalid_records(self):
+        """Malformed records are rejected."""
+        for data in ({}, {'results': 'x'}, {'results': [[1, 2]]},
+                     {'results': [['x', 'y', 200, 0.1, 'Ok', None]]},
+                     {'results': [[self.check.pk, 'y', 200, 0.1, 'Ok', None]]}):
+            response = self.post(data, **self.auth)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(models.CheckResult.objects.count(), 0)
+
+    def test_invalid_fields(self):
+        """Records with a value of the wrong type are rejected by position."""
+        valid = [self.check.pk, now().timestamp(), 200, 0.1, 'Ok', None]
+        for index, value in ((2, '200'), (1, '2015-01-01'), (4, None), (5, 'yes'),
+                             (0, True), (2, -1), (1, 1e20)):
+            record = list(valid)
+            record[index] = value
+            response = self.post({'results': [valid, record]}, **self.auth)
+            self.assertEqual(response.status_code, 400, value)
+            self.assertJSONEqual(
+                response.content.decode('utf-8'),
+                {'error': 'Invalid result record.', 'index': 1})
+        self.assertEqual(models.CheckResult.objects.count(), 0)
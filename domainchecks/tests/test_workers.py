@@ -0,0 +1,114 @@
+import os
+import signal
+
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from .. import workers
+
+
+@override_settings(DOMAINCHECKS_IN_FLIGHT_EXPIRES=600)
+class InFlightTestCase(SimpleTestCase):
+    """Counting the checks queued and running."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_count(self):
+        """Checks are counted in the minute they were queued."""
+        minute = workers.current_minute()
+        workers.add_in_flight(5)
+        workers.add_in_flight(3, minute - 1)
+        self.assertEqual(workers.in_flight(), 8)
+        workers.remove_in_flight(4, minute)
+        self.assertEqual(workers.in_flight(), 4)
+
+    def test_expired(self):
+        """Counts older than the expiry time are ignored."""
+        workers.add_in_flight(5, workers.current_minute() - 11)
+        self.assertEqual(workers.in_flight(), 0)
+
+    def test_remove_expired(self):
+        """Removing checks from an expired count is ignored."""
+        workers.remove_in_flight(2, workers.current_minute())
+        self.assertEqual(workers.in_flight(), 0)
+
+
+@override_settings(
+    DOMAINCHECKS_MAX_IN_FLIGHT=None, DOMAINCHECKS_MAX_QUEUE_DEPTH=None,
+    DOMAINCHECKS_PROBE_QUEUES=['probes'])
+class AvailableCapacityTestCase(SimpleTestCase):
+    """Room left before the backpressure limits."""
+
+    def test_no_limits(self):
+        """Capacity is unlimited by default."""
+        self.assertIsNone(workers.available_capacity())
+
+    @patch('domainchecks.workers.is_shared_cache', return_value=True)
+    @patch('domainchecks.workers.in_flight', return_value=70)
+    def test_in_flight(self, mock_in_flight, mock_shared):
+        """Room is what is left of the in flight limit."""
+        with self.settings(DOMAINCHECKS_MAX_IN_FLIGHT=100):
+            self.assertEqual(workers.available_capacity(), 30)
+        mock_in_flight.return_value = 120
+        with self.settings(DOMAINCHECKS_MAX_IN_FLIGHT=100):
+            self.assertEqual(workers.available_capacity(), 0)
+
+    @patch('domainchecks.workers.logger')
+    @patch('domainchecks.workers.in_flight', return_value=70)
+    def test_local_cache(self, mock_in_flight, mock_logger):
+        """The in flight limit is left off when the cache isn't shared."""
+        with self.settings(DOMAINCHECKS_MAX_IN_FLIGHT=50):
+            self.assertIsNone(workers.available_capacity())
+        self.assertTrue(mock_logger.error.called)
+        self.assertFalse(mock_in_flight.called)
+
+    @patch('domainchecks.workers.queue_depth', return_value=10)
+    def test_queue_depth(self, mock_depth):
+        """Nothing is queued while the probe queues are backed up."""
+        with self.settings(DOMAINCHECKS_MAX_QUEUE_DEPTH=50):
+            self.assertIsNone(workers.available_capacity())
+        with self.settings(DOMAINCHECKS_MAX_QUEUE_DEPTH=10):
+            self.assertEqual(workers.available_capacity(), 0)
+        mock_depth.assert_called_with(['probes'])
+
+    @patch('domainchecks.workers.logger')
+    @patch('domainchecks.workers.queue_depth', side_effect=OSError('Connection refused'))
+    def test_broker_down(self, mock_depth, mock_logger):
+        """Queue depth is skipped when the broker can't be reached."""
+        with self.settings(DOMAINCHECKS_MAX_QUEUE_DEPTH=10):
+            self.assertIsNone(workers.available_capacity())
+        self.assertTrue(mock_logger.exception.called)
+
+
+class DrainTestCase(SimpleTestCase):
+    """Draining probe tasks on SIGTERM."""
+
+    def setUp(self):
+        self.addCleanup(workers._draining.clear)
+        original = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, original)
+
+    @patch('domainchecks.workers.logger')
+    def test_drain_handler(self, mock_logger):
+        """The handler starts draining and calls the worker's own handler."""
+        previous = Mock()
+        signal.signal(signal.SIGTERM, previous)
+        workers.install_drain_handler()
+        self.assertFalse(workers.is_draining())
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        self.assertTrue(workers.is_draining())
+        previous.assert_called_once_with(signal.SIGTERM, None)
+
+    @patch('domainchecks.workers.os.kill')
+    @patch('domainchecks.workers.logger')
+    def test_default_handler(self, mock_logger, mock_kill):
+        """Pool processes with the default handler are still terminated."""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        workers.install_drain_handler()
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        self.assertEqual(signal.getsignal(signal.SIGTERM), signal.SIG_DFL)
+        mock_kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
@@ -0,0 +1,172 @@
+"""Live updates for the status pages.
+
+When results are recorded an event with the new timeline points of each
+check is published for its domain, and an event listing the changed
+domains is published for their owner. Status pages long-poll for the
+events after the last version they have seen so only the statuses which
+changed are computed again.
+
+Channels keep a short history of events for each topic. Clients which
+fall further behind are told to reload the page.
+"""
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import DomainCheck
+from .signals import results_recorded
+
+
+class MemoryChannel(object):
+    """Keep events in this process and wake waiting requests as they arrive.
+
+    This stands in for a shared channel when running the tests or a single
+    process which both records results and serves the status pages.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.versions = collections.Counter()
+        self.events = collections.defaultdict(
+            lambda: collections.deque(maxlen=settings.DOMAINCHECKS_UPDATES_HISTORY))
+
+    def version(self, topic):
+        with self.condition:
+            return self.versions[topic]
+
+    def publish(self, topic, event):
+        with self.condition:
+            self.versions[topic] += 1
+            self.events[topic].append((self.versions[topic], event))
+            self.condition.notify_all()
+            return self.versions[topic]
+
+    def read(self, topic, version):
+        """Return the latest version and the events after the given one.
+
+        The events are None when some of them are no longer available.
+        """
+        latest = self.versions[topic]
+        if version > latest or latest - version > len(self.events[topic]):
+            return latest, None
+        return latest, [event for v, event in self.events[topic] if v > version]
+
+    def wait(self, topic, version, timeout):
+        """Wait up to timeout seconds for events after the given version."""
+        deadline = time.time() + timeout
+        with self.condition:
+            latest, events = self.read(topic, version)
+            while events == [] and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+                latest, events = self.read(topic, version)
+            return latest, events
+
+
+class CacheChannel(object):
+    """Share events between processes through the default cache.
+
+    Waiting requests check the cache every DOMAINCHECKS_UPDATES_POLL
+    seconds. The cache must be shared by the processes recording results
+    and the ones serving the status pages, see CACHES in the settings.
+    """
+
+    # Time (in seconds) published events are kept
+    expires = 10 * 60
+
+    def key(self, topic, version=None):
+        key = 'domainchecks:updates:{}'.format(topic)
+        if version is not None:
+            key = '{}:{}'.format(key, version)
+        return key
+
+    def version(self, topic):
+        return cache.get(self.key(topic), 0)
+
+    def publish(self, topic, event):
+        cache.add(self.key(topic), 0, None)
+        version = cache.incr(self.key(topic))
+        cache.set(self.key(topic, version), event, self.expires)
+        return version
+
+    def read(self, topic, version):
+        latest = self.version(topic)
+        if version > latest or latest - version > settings.DOMAINCHECKS_UPDATES_HISTORY:
+            return latest, None
+        keys = [self.key(topic, v) for v in range(version + 1, latest + 1)]
+        found = cache.get_many(keys)
+        events = []
+        for key in keys:
+            if key not in found:
+                break
+            events.append(found[key])
+        if any(key in found for key in keys[len(events):]):
+            # An older event has expired
+            return latest, None
+        # Missing events at the end are still being published
+        return version + len(events), events
+
+    def wait(self, topic, version, timeout):
+        deadline = time.time() + timeout
+        latest, events = self.read(topic, version)
+        while events == [] and time.time() < deadline:
+            time.sleep(min(settings.DOMAINCHECKS_UPDATES_POLL, deadline - time.time()))
+            latest, events = self.read(topic, version)
+        if events == [] and self.version(topic) > version:
+            # Events which never arrived have expired
+            return self.version(topic), None
+        return latest, events
+
+
+_channel = None
+
+
+def get_channel():
+    """Return the configured live update channel for this process."""
+    global _channel
+    path = settings.DOMAINCHECKS_UPDATES_CHANNEL
+    if _channel is None or _channel.__class__ != import_string(path):
+        _channel = import_string(path)()
+    return _channel
+
+
+def domain_topic(domain_id):
+    return 'domain:{}'.format(domain_id)
+
+
+def owner_topic(owner_id):
+    return 'owner:{}'.format(owner_id)
+
+
+def timeline_point(result):
+    """Result in the same format as the timeline view."""
+    return {
+        'checked_on': result.checked_on,
+        'last_checked_on': result.checked_on,
+        'count': 1,
+        'response_time': result.response_time,
+        'status_code': result.status_code,
+    }
+
+
+@receiver(results_recorded)
+def publish_results(sender, results, **kwargs):
+    points = collections.defaultdict(list)
+    for result in sorted(results, key=lambda r: r.checked_on):
+        points[result.domain_check_id].append(timeline_point(result))
+    domains = collections.defaultdict(dict)
+    owners = collections.defaultdict(set)
+    checks = DomainCheck.objects.filter(pk__in=points).values_list(
+        'pk', 'domain', 'domain__owner')
+    for check, domain, owner in checks:
+        domains[domain][check] = points[check]
+        owners[owner].add(domain)
+    channel = get_channel()
+    for domain, changed in domains.items():
+        channel.publish(domain_topic(domain), {'points': changed})
+    for owner, changed in owners.items():
+        channel.publish(owner_topic(owner), {'domains': sorted(changed)})
@@ -7,13 +7,23 @@ from . import views
 urlpatterns = [
     url(r'^domains/add/$',
         login_required(views.CreateDomain.as_view()), name='domain-add'),
+    url(r'^domains/bulk/$',
+        views.ProvisionDomains.as_view(), name='domain-bulk-add'),
     url(r'^domains/(?P<domain>[-A-Za-z0-9.]{4,253})/$',
         login_required(views.PrivateStatusDetail.as_view()), name='status-detail'),
     url(r'^domains/(?P<domain>[-A-Za-z0-9.]{4,253})/edit/$',
         login_required(views.EditDomain.as_view()), name='domain-edit'),
+    url(r'^updates/$',
+        login_required(views.StatusListUpdates.as_view()), name='status-list-updates'),
+    url(r'^export/$',
+        login_required(views.ExportResults.as_view()), name='export-results'),
     url(r'^(?P<domain>[-A-Za-z0-9.]{4,253})/$',
         views.StatusDetail.as_view(), name='public-status-detail'),
+    url(r'^(?P<domain>[-A-Za-z0-9.]{4,253})/updates/$',
+        views.StatusUpdates.as_view(), name='status-updates'),
     url(r'^timeline/(?P<check>[0-9]{1,19})/$',
         views.CheckTimeline.as_view(), name='status-timeline'),
+    url(r'^agent/checks/$', views.AgentChecks.as_view(), name='agent-checks'),
+    url(r'^agent/results/$', views.AgentResults.as_view(), name='agent-results'),
     url(r'^$', login_required(views.StatusList.as_view()), name='status-list'),
 ]
@@ -1,33 +1,112 @@
-from django.core.exceptions import PermissionDenied
-from django.http import JsonResponse
-from django.views.generic import CreateView, ListView, UpdateView
+import datetime
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.db import router
+from django.db.models import Max, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.decorators import method_decorator
+from django.utils.timezone import now
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import CreateView, ListView, UpdateView, View
 from django.shortcuts import get_object_or_404
 
-from .forms import CheckResultFilter, DomainForm
+from . import archive, export, provisioning, results, routers, scheduling, updates
+from .forms import CheckResultFilter, DomainForm, ResultExportForm
 from .models import Domain, DomainCheck, CheckResult
 
 
-class StatusList(ListView):
+def get_status_window(request, default=60):
+    """Status window (in minutes) requested with the ``window`` parameter."""
+    longest = settings.DOMAINCHECKS_STATUS_RETENTION // 60
+    try:
+        minutes = int(request.GET.get('window', default))
+    except ValueError:
+        minutes = default
+    return datetime.timedelta(minutes=max(1, min(minutes, longest)))
+
+
+class ReplicaReadMixin(object):
+    """Read from a replica unless the user has just made a change."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with routers.replica_reads(not routers.is_pinned(request)):
+            response = super().dispatch(request, *args, **kwargs)
+            if callable(getattr(response, 'render', None)):
+                # Template responses are rendered lazily
+                response.render()
+            return response
+
+
+class KeysetPaginationMixin(object):
+    """Paginate by the position of the last object instead of page numbers.
+
+    The ``after`` parameter is the pk of the last object on the previous
+    page and the next page starts after its ``keyset`` values, so later
+    pages cost the same as the first one. Keysets must end with the pk.
+    """
+
+    paginate_by = 50
+    keyset = ('pk', )
+
+    def get_page_start(self, queryset, after):
+        """Filter to the objects after the given pk or return None if it is unknown."""
+        try:
+            values = queryset.model.objects.filter(pk=after).values_list(*self.keyset)[0]
+        except (IndexError, ValueError):
+            return None
+        start = Q()
+        for i, field in enumerate(self.keyset):
+            equal = dict(zip(self.keyset[:i], values[:i]))
+            start |= Q(**dict(equal, **{field + '__gt': values[i]}))
+        return queryset.filter(start)
+
+    def paginate_queryset(self, queryset, page_size):
+        queryset = queryset.order_by(*self.keyset)
+        page = None
+        if self.request.GET.get('after'):
+            page = self.get_page_start(queryset, self.request.GET['after'])
+        object_list = list((queryset if page is None else page)[:page_size + 1])
+        has_next = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        self.next_after = object_list[-1].pk if has_next else None
+        return (None, None, object_list, page is not None or has_next)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['next_after'] = getattr(self, 'next_after', None)
+        return context
+
+
+class StatusList(ReplicaReadMixin, KeysetPaginationMixin, ListView):
     template_name = 'domainchecks/status-list.html'
     context_object_name = 'domains'
+    keyset = ('name', 'pk', )
 
     def get_queryset(self):
         if self.request.user.is_authenticated():
-            return DomainCheck.objects.active().filter(
-                domain__owner=self.request.user
-            ).values('domain__name').status().order_by('domain__name')
+            return Domain.objects.active().filter(
+                owner=self.request.user
+            ).status(cutoff=get_status_window(self.request))
         else:
-            return DomainCheck.objects.none()
+            return Domain.objects.none()
 
 
-class StatusDetail(ListView):
+class StatusDetail(ReplicaReadMixin, KeysetPaginationMixin, ListView):
     template_name = 'domainchecks/public-status-detail.html'
     allow_empty = False
     context_object_name = 'checks'
+    paginate_by = 20
+    keyset = ('path', 'pk', )
 
     def get_queryset(self):
         return DomainCheck.objects.active().filter(
-            domain__name=self.kwargs['domain']).status().order_by('path')
+            domain__name=self.kwargs['domain']).status(
+                cutoff=get_status_window(self.request))
 
 
 class PrivateStatusDetail(StatusDetail):
@@ -40,15 +119,92 @@ class PrivateStatusDetail(StatusDetail):
         return super().get_queryset()
 
 
-class CheckTimeline(ListView):
+class LiveUpdatesMixin(object):
+    """Long-poll for the changes published after the client's version.
+
+    Without a ``version`` the current one is returned straight away. When
+    the client has missed events ``reset`` is set and it should reload.
+    ``retry`` is the time (in seconds) to wait before asking again.
+    """
+
+    def get_topic(self):
+        raise NotImplementedError()
+
+    def get_changes(self, events):
+        raise NotImplementedError()
+
+    def get(self, request, *args, **kwargs):
+        topic = self.get_topic()
+        channel = updates.get_channel()
+        try:
+            version = int(request.GET['version'])
+        except (KeyError, ValueError):
+            return JsonResponse({'version': channel.version(topic), 'reset': False})
+        version, events = channel.wait(
+            topic, version, timeout=settings.DOMAINCHECKS_UPDATES_TIMEOUT)
+        data = {
+            'version': version, 'reset': events is None,
+            'retry': 0 if events else settings.DOMAINCHECKS_UPDATES_RETRY,
+        }
+        if events:
+            data.update(self.get_changes(events))
+        return JsonResponse(data)
+
+
+class StatusUpdates(ReplicaReadMixin, LiveUpdatesMixin, View):
+    """Changed check statuses and new timeline points for a domain."""
+
+    fields = ('id', 'status', 'success_rate', 'successes', 'pings', 'last_check', )
+
+    def get_topic(self):
+        self.domain = get_object_or_404(Domain, name=self.kwargs['domain'])
+        return updates.domain_topic(self.domain.pk)
+
+    def get_changes(self, events):
+        points = {}
+        for event in events:
+            for check, new in event['points'].items():
+                points.setdefault(check, []).extend(new)
+        checks = DomainCheck.objects.active().filter(
+            domain=self.domain, pk__in=points).status(
+                cutoff=get_status_window(self.request)).values(*self.fields)
+        return {
+            'checks': list(checks),
+            'points': dict((str(check), new) for check, new in points.items()),
+        }
+
+
+class StatusListUpdates(ReplicaReadMixin, LiveUpdatesMixin, View):
+    """Changed domain statuses for the current user."""
+
+    fields = ('id', 'name', 'status', 'success_rate', 'successes', 'pings', 'last_check', )
+
+    def get_topic(self):
+        return updates.owner_topic(self.request.user.pk)
+
+    def get_changes(self, events):
+        changed = set()
+        for event in events:
+            changed.update(event['domains'])
+        domains = Domain.objects.filter(
+            owner=self.request.user, pk__in=changed).status(
+                cutoff=get_status_window(self.request)).values(*self.fields)
+        return {'domains': list(domains)}
+
+
+class CheckTimeline(ReplicaReadMixin, ListView):
+
+    fields = ('checked_on', 'last_checked_on', 'count', 'response_time', 'status_code', )
 
     def get_queryset(self):
-        check = get_object_or_404(
+        self.check = get_object_or_404(
             DomainCheck.objects.active(), pk=self.kwargs['check'])
-        qs = CheckResult.objects.filter(domain_check=check)
-        results = CheckResultFilter(self.request.GET, queryset=qs, strict=True)
-        self._filters_valid = results.form.is_valid()
-        return results.qs.values('checked_on', 'response_time', 'status_code')
+        qs = CheckResult.objects.filter(domain_check=self.check)
+        filtered = CheckResultFilter(self.request.GET, queryset=qs, strict=True)
+        self._filters_valid = filtered.form.is_valid()
+        if self._filters_valid:
+            self._range = filtered.form.cleaned_data['start'], filtered.form.cleaned_data['end']
+        return filtered.qs.values(*self.fields)
 
     def render_to_response(self, context, **response_kwargs):
         results = self.get_results(context)
@@ -58,11 +214,39 @@ class CheckTimeline(ListView):
 
     def get_results(self, context):
         results = list(context['object_list'])
+        if getattr(self, '_filters_valid', False):
+            # Older results may have been moved to the archive
+            results.extend(
+                dict((field, archived[field]) for field in self.fields)
+                for archived in archive.read_results(self.check.pk, *self._range))
         return {
             'results': results,
         }
 
 
+class ExportResults(View):
+    """Stream the results of the user's checks for any time range."""
+
+    def get(self, request, *args, **kwargs):
+        form = ResultExportForm(request.GET)
+        form.fields['checks'].queryset = DomainCheck.objects.filter(
+            domain__owner=request.user)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        with routers.replica_reads(not routers.is_pinned(request)):
+            # Rows are read while the response streams, after the view returns
+            using = router.db_for_read(CheckResult)
+        data = form.cleaned_data
+        format = export.FORMATS[data['format']]
+        response = StreamingHttpResponse(
+            export.export_results(
+                data['checks'], data['start'], data['end'], data['format'], using=using),
+            content_type=format.content_type)
+        response['Content-Disposition'] = 'attachment; filename="results.{}"'.format(
+            format.extension)
+        return response
+
+
 class CreateDomain(CreateView):
     model = Domain
     form_class = DomainForm
@@ -70,6 +254,7 @@ class CreateDomain(CreateView):
 
     def form_valid(self, form):
         form.instance.owner = self.request.user
+        routers.pin_to_primary(self.request)
         return super().form_valid(form)
 
 
@@ -85,3 +270,200 @@ class EditDomain(UpdateView):
         if domain.owner != self.request.user:
             raise PermissionDenied('Must be the owner to edit')
         return domain
+
+    def form_valid(self, form):
+        routers.pin_to_primary(self.request)
+        return super().form_valid(form)
+
+
+class APIKeyMixin(object):
+    """Authenticate API calls by the user's key or their session.
+
+    Scripts send ``Authorization: Token <key>`` with a key from
+    DOMAINCHECKS_API_KEYS and don't need a CSRF token. Calls without a key
+    must come from a logged in session and pass the CSRF check like a form
+    post, with the token from the ``csrftoken`` cookie in the
+    ``X-CSRFToken`` header.
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        scheme, _, key = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme == 'Token':
+            username = settings.DOMAINCHECKS_API_KEYS.get(key)
+            user_model = get_user_model()
+            user = username and user_model.objects.filter(
+                is_active=True, **{user_model.USERNAME_FIELD: username}).first()
+            if not user:
+                raise PermissionDenied('Invalid API key.')
+            request.user = user
+        else:
+            if not request.user.is_authenticated():
+                raise PermissionDenied('Authentication required.')
+            rejected = CsrfViewMiddleware().process_view(request, None, (), {})
+            if rejected is not None:
+                return rejected
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ProvisionDomains(APIKeyMixin, View):
+    """Create a batch of domains for the user from JSON.
+
+    The body is ``{"domains": [{"name": ..., "checks": [...]}, ...]}`` where
+    each check has a ``path`` and optionally a ``protocol``, ``method``,
+    ``is_active``, ``interval``, ``status_only``, ``assertion`` and
+    ``assertion_value``. Invalid domains are skipped and their errors
+    returned by position.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            domains = json.loads(request.body.decode('utf-8'))['domains']
+            if not isinstance(domains, list) or not all(isinstance(d, dict) for d in domains):
+                raise ValueError('Domains must be a list of objects.')
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Invalid domain list.'}, status=400)
+        if len(domains) > settings.DOMAINCHECKS_PROVISION_MAX:
+            return JsonResponse({'error': 'At most {} domains can be added at once.'.format(
+                settings.DOMAINCHECKS_PROVISION_MAX)}, status=400)
+        created, errors = provisioning.provision(domains, request.user)
+        if created:
+            routers.pin_to_primary(request)
+        return JsonResponse({'created': created, 'errors': errors})
+
+
+class AgentMixin(object):
+    """Authenticate remote probe agents by their key."""
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        scheme, _, key = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        self.region = None
+        if scheme == 'Token':
+            self.region = settings.DOMAINCHECKS_AGENT_KEYS.get(key)
+        if self.region is None:
+            raise PermissionDenied('Invalid agent key.')
+        return super().dispatch(request, *args, **kwargs)
+
+
+class AgentChecks(AgentMixin, View):
+    """Hand out a batch of checks which are due in the agent's region."""
+
+    fields = (
+        'id', 'method', 'url', 'status_only',
+        'assertion', 'assertion_value', 'max_bytes', )
+    max_limit = 500
+
+    def get_due(self):
+        """Ids of the active checks which are due in the agent's region.
+
+        Checks which haven't run for one and a half of their intervals are
+        due whenever they last ran, so only the results since then are read
+        rather than all of them. Runs of results which started up to
+        DOMAINCHECKS_COMPACT_MAX_SPAN seconds earlier are included.
+        """
+        start = now()
+        checks = list(DomainCheck.objects.active().values_list('pk', 'interval'))
+        if not checks:
+            return []
+        since = start - datetime.timedelta(
+            seconds=max(interval for pk, interval in checks) * 1.5 +
+            settings.DOMAINCHECKS_COMPACT_MAX_SPAN)
+        latest = dict(CheckResult.objects.filter(
+            region=self.region, checked_on__gte=since).values('domain_check').annotate(
+                latest=Max('last_checked_on')).values_list('domain_check', 'latest'))
+        due = scheduling.due_checks(
+            ((pk, interval, latest.get(pk)) for pk, interval in checks),
+            start=start, window=datetime.timedelta(0))
+        return (check[0] for check, countdown in due)
+
+    def lease(self, pks, limit):
+        """Reserve due checks so they aren't given to another agent.
+
+        Leases are added to the default cache, which must be shared by all
+        web processes for agents polling different processes. A lease which
+        is neither added nor found means the cache can't be reached, which
+        memcached doesn't otherwise report.
+        """
+        leased = []
+        for pk in pks:
+            key = 'domainchecks:agent-lease:{}:{}'.format(self.region, pk)
+            if cache.add(key, True, settings.DOMAINCHECKS_AGENT_LEASE):
+                leased.append(pk)
+                if len(leased) >= limit:
+                    break
+            elif cache.get(key) is None:
+                raise ImproperlyConfigured(
+                    'Agent leases could not be stored. Check CACHE_URL.')
+        return leased
+
+    def serialize(self, check):
+        if check.assertion:
+            max_bytes = settings.DOMAINCHECKS_MAX_ASSERTION_BYTES
+        else:
+            max_bytes = settings.DOMAINCHECKS_MAX_BODY_BYTES
+        return [
+            check.pk, check.method, check.url, check.status_only,
+            check.assertion, check.assertion_value, max_bytes,
+        ]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.GET.get('limit', 100)), self.max_limit)
+        except ValueError:
+            return JsonResponse({'error': 'Limit must be a number.'}, status=400)
+        leased = self.lease(self.get_due(), limit)
+        checks = DomainCheck.objects.filter(
+            pk__in=leased).select_related('domain').order_by('pk')
+        return JsonResponse({
+            'region': self.region,
+            'fields': self.fields,
+            'checks': [self.serialize(check) for check in checks],
+        })
+
+
+class AgentResults(AgentMixin, View):
+    """Accept a batch of result records from an agent."""
+
+    # Types of the check id, timestamp, status code, response time, response
+    # body and whether the assertion passed in each record
+    record_types = (
+        (int, ), (int, float), (int, type(None)), (int, float, type(None)),
+        (str, ), (bool, type(None)),
+    )
+
+    def get_records(self):
+        records = json.loads(self.request.body.decode('utf-8'))['results']
+        if not isinstance(records, list):
+            raise ValueError('Results must be a list of records.')
+        return records
+
+    def decode(self, record):
+        """Rebuild a result from a record, raising ValueError if it is invalid."""
+        if not isinstance(record, list) or len(record) != len(self.record_types):
+            raise ValueError('Records must be lists of {} values.'.format(len(self.record_types)))
+        for value, types in zip(record, self.record_types):
+            # Booleans are ints but only allowed where they are expected
+            if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+                raise ValueError('Invalid value {!r}.'.format(value))
+        if any(value is not None and value < 0 for value in record[:4]):
+            raise ValueError('Values must not be negative.')
+        return results.decode(record + [self.region])
+
+    def post(self, request, *args, **kwargs):
+        try:
+            records = self.get_records()
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Invalid result records.'}, status=400)
+        batch = []
+        for index, record in enumerate(records):
+            try:
+                batch.append(self.decode(record))
+            except (ValueError, OverflowError, OSError):
+                return JsonResponse(
+                    {'error': 'Invalid result record.', 'index': index}, status=400)
+        known = set(DomainCheck.objects.active().filter(
+            pk__in=[r.domain_check_id for r in batch]).values_list('pk', flat=True))
+        accepted = [result for result in batch if result.domain_check_id in known]
+        results.get_backend().publish_many(accepted)
+        return JsonResponse({'accepted': len(accepted), 'rejected': len(batch) - len(accepted)})
@@ -0,0 +1,165 @@
+"""Coordination between the scheduler and the probe workers.
+
+The scheduler counts the checks it queues in the default cache and the
+probe tasks count them off as they finish, so the number in flight is
+known without asking the workers. Counts are kept per minute and expire
+after DOMAINCHECKS_IN_FLIGHT_EXPIRES seconds in case a worker is killed
+before it gets to count its checks off. The slot each check was queued for
+is marked for as long so a check which is waiting to run, or whose result
+hasn't been written yet, isn't queued again for the same slot. Together with the depth of the
+probe queues on the broker this tells the scheduler how much room there
+is before queuing more.
+
+Probe workers drain on SIGTERM: running tasks finish the probe in
+progress, flush their results and queue the checks they didn't get to
+again instead of starting them. Prefork pool processes, which Celery only
+sends SIGTERM to terminate them, still stop straight away.
+
+The in flight limit needs a cache shared by the scheduler and the workers
+and is left off when the default cache is local to each process.
+"""
+import logging
+import os
+import signal
+import threading
+import time
+
+from celery import current_app
+from celery.signals import worker_process_init, worker_ready
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import scheduling
+
+
+logger = logging.getLogger(__name__)
+
+_draining = threading.Event()
+
+
+def in_flight_key(minute):
+    return 'domainchecks:in-flight:{}'.format(minute)
+
+
+def current_minute():
+    return int(time.time() // 60)
+
+
+def add_in_flight(count, minute=None):
+    """Count checks as queued in the given minute (defaults to this one)."""
+    key = in_flight_key(current_minute() if minute is None else minute)
+    cache.add(key, 0, settings.DOMAINCHECKS_IN_FLIGHT_EXPIRES)
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        # Expired in the meantime
+        pass
+
+
+def remove_in_flight(count, minute):
+    """Count off checks queued in the given minute once they have run."""
+    try:
+        if cache.decr(in_flight_key(minute), count) < 0:
+            cache.delete(in_flight_key(minute))
+    except ValueError:
+        # Already expired
+        pass
+
+
+def in_flight():
+    """Checks which have been queued and haven't finished yet."""
+    now = current_minute()
+    minutes = range(now - settings.DOMAINCHECKS_IN_FLIGHT_EXPIRES // 60, now + 1)
+    return sum(max(count, 0) for count in cache.get_many(
+        [in_flight_key(minute) for minute in minutes]).values())
+
+
+def queued_key(check):
+    """Cache key for the slot a ``(pk, interval, last_check, ...)`` check is due in."""
+    pk, interval, last_check = check[:3]
+    due = scheduling.next_due(pk, interval, last_check)
+    return 'domainchecks:queued:{}:{}'.format(pk, 'new' if due is None else int(due.timestamp()))
+
+
+def not_queued(due):
+    """Leave out the due checks which were already queued for their slot."""
+    keys = [queued_key(check) for check, countdown in due]
+    queued = cache.get_many(keys)
+    return [item for item, key in zip(due, keys) if key not in queued]
+
+
+def mark_queued(chosen):
+    """Mark the slots the chosen checks have been queued for."""
+    cache.set_many(
+        dict((queued_key(check), True) for check, countdown in chosen),
+        settings.DOMAINCHECKS_IN_FLIGHT_EXPIRES)
+
+
+def is_shared_cache():
+    """Whether other processes see the default cache."""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def max_in_flight():
+    """Most checks in flight, or None when there is no limit."""
+    limit = settings.DOMAINCHECKS_MAX_IN_FLIGHT
+    if limit is not None and not is_shared_cache():
+        logger.error('DOMAINCHECKS_MAX_IN_FLIGHT is ignored without a shared cache')
+        return None
+    return limit
+
+
+def queue_depth(queues):
+    """Messages waiting in the given broker queues."""
+    with current_app.connection() as connection:
+        channel = connection.default_channel
+        return sum(
+            channel.queue_declare(queue=queue, passive=True).message_count
+            for queue in queues)
+
+
+def available_capacity():
+    """Checks which can be queued before reaching the limits, or None for no limit."""
+    room = None
+    limit = max_in_flight()
+    if limit is not None:
+        room = max(limit - in_flight(), 0)
+    if settings.DOMAINCHECKS_MAX_QUEUE_DEPTH is not None:
+        try:
+            depth = queue_depth(settings.DOMAINCHECKS_PROBE_QUEUES)
+        except Exception:
+            logger.exception('Unable to read the probe queue depth')
+        else:
+            if depth >= settings.DOMAINCHECKS_MAX_QUEUE_DEPTH:
+                logger.warning('Probe queues have %d waiting message(s)', depth)
+                room = 0
+    return room
+
+
+def is_draining():
+    return _draining.is_set()
+
+
+def drain(signum=None, frame=None, previous=None):
+    """Stop starting new probes and hand on to the previous handler."""
+    logger.warning('Draining probe tasks')
+    _draining.set()
+    if callable(previous):
+        previous(signum, frame)
+    elif previous == signal.SIG_DFL:
+        # Pool processes start with the default handler and are only sent
+        # the signal to terminate them, so let it do that
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+@worker_ready.connect
+@worker_process_init.connect
+def install_drain_handler(**kwargs):
+    # The worker's own handler is in place once it is ready so it is kept
+    # to start the warm shutdown after the tasks are told to drain.
+    previous = signal.getsignal(signal.SIGTERM)
+    signal.signal(
+        signal.SIGTERM,
+        lambda signum, frame: drain(signum, frame, previous=previous))
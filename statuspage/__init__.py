@@ -1 +1 @@
-from .celery import app as celery_app  # noqa
+default_app_config = 'statuspage.apps.StatuspageConfig'
@@ -0,0 +1,29 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class StatuspageConfig(AppConfig):
+    name = 'statuspage'
+
+    def ready(self):
+        # Set up the Celery app and the connection receivers with the project
+        # app rather than on import so probe processes, which leave it out,
+        # don't import Celery.
+        from . import celery, db  # noqa
+
+
+class ProbeConfig(AppConfig):
+    """Project app for probe processes.
+
+    Celery is only set up when the results are published through it so
+    probes which write them to the database don't import it.
+    """
+
+    name = 'statuspage'
+
+    def ready(self):
+        from domainchecks.results import CeleryBackend
+
+        if issubclass(import_string(settings.DOMAINCHECKS_RESULT_BACKEND), CeleryBackend):
+            from . import celery  # noqa
@@ -0,0 +1,90 @@
+"""Persistent database connections.
+
+Django keeps a connection open for up to ``CONN_MAX_AGE`` seconds and
+closes it at the start and end of each request, or each task through
+Celery's Django fixup, once it is too old or has failed. The settings for
+each process type are in DATABASE_CONNECTIONS.
+
+On top of that connections which have been idle for longer than the
+``health_check`` time are pinged before they are reused so a connection
+dropped by the server isn't found out by the first query of a request.
+Connections opened, reused and found broken are counted and logged every
+DATABASE_STATS_INTERVAL seconds.
+"""
+import collections
+import logging
+import threading
+import time
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+stats = collections.Counter()
+
+_state = threading.local()
+
+_logged_on = time.time()
+
+_lock = threading.Lock()
+
+
+def get_options():
+    return settings.DATABASE_CONNECTIONS[settings.PROCESS_TYPE]
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    with _lock:
+        stats['opened'] += 1
+
+
+def check_connections(**kwargs):
+    """Ping reused connections which have been idle for a while."""
+    health_check = get_options()['health_check']
+    last_used = getattr(_state, 'last_used', {})
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        with _lock:
+            stats['reused'] += 1
+        idle = time.time() - last_used.get(connection.alias, time.time())
+        if health_check and idle > health_check and not connection.is_usable():
+            with _lock:
+                stats['broken'] += 1
+            connection.close()
+    log_stats()
+
+
+def release_connections(**kwargs):
+    """Remember when the open connections were last used."""
+    _state.last_used = dict(
+        (connection.alias, time.time())
+        for connection in connections.all() if connection.connection is not None)
+
+
+def log_stats():
+    """Log the connection counts once per interval."""
+    global _logged_on
+    with _lock:
+        if time.time() - _logged_on < settings.DATABASE_STATS_INTERVAL:
+            return
+        _logged_on = time.time()
+        counts = dict(stats)
+        stats.clear()
+    logger.info(
+        'Database connections (%s): %d opened, %d reused, %d broken',
+        settings.PROCESS_TYPE, counts.get('opened', 0),
+        counts.get('reused', 0), counts.get('broken', 0))
+
+
+request_started.connect(check_connections)
+request_finished.connect(release_connections)
+task_prerun.connect(check_connections)
+task_postrun.connect(release_connections)
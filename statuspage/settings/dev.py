@@ -1,6 +1,11 @@
 """Settings for local development and testing."""
+import os
 import sys
 
+# Web processes share agent leases and in flight counts through the cache.
+# Locally the database keeps it, after: python manage.py createcachetable
+os.environ.setdefault('CACHE_URL', 'db://statuspage_cache')
+
 from .base import *  # noqa
 
 DEBUG = True
@@ -11,6 +16,11 @@ INTERNAL_IPS = ('127.0.0.1', )
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+DOMAINCHECKS_AGENT_KEYS = {
+    'local-east': 'east',
+    'local-west': 'west',
+}
+
 if 'test' in sys.argv:
     # Special settings for running the tests
     PASSWORD_HASHERS = (
@@ -19,3 +29,16 @@ if 'test' in sys.argv:
     )
 
     LOGGING['root']['handlers'] = []
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+    # Tests opt in to the circuit breaker so failures don't leak between them
+    DOMAINCHECKS_BREAKER_THRESHOLD = 0
+
+    # Replica which mirrors the test database. Tests opt in to using it
+    # since it can only see committed data.
+    DATABASES['replica1'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+
+# Loads the apps like a probe process and reports how Celery is set up
+PROBE = '''
+import json, sys
+import django
+django.setup()
+from celery import current_app
+print(json.dumps({
+    'main': current_app.main,
+    'broker': current_app.conf.BROKER_URL,
+    'routes': bool(current_app.conf.CELERY_ROUTES),
+}))
+'''
+
+
+class ProbeProfileTestCase(SimpleTestCase):
+    """Apps loaded by probe processes."""
+
+    def run_probe(self, backend):
+        env = dict(
+            os.environ, PROCESS_TYPE='probe', DOMAINCHECKS_RESULT_BACKEND=backend,
+            DJANGO_SETTINGS_MODULE='statuspage.settings.dev',
+            BROKER_URL='redis://broker:6379/0')
+        output = subprocess.check_output(
+            [sys.executable, '-c', PROBE], env=env, cwd=settings.BASE_DIR)
+        return json.loads(output.decode('utf-8'))
+
+    def test_celery_backend(self):
+        """Results are published with the project's Celery app."""
+        app = self.run_probe('domainchecks.results.CeleryBackend')
+        self.assertEqual(app, {
+            'main': 'statuspage', 'broker': 'redis://broker:6379/0', 'routes': True})
+
+    def test_database_backend(self):
+        """Celery isn't set up when results are written to the database."""
+        app = self.run_probe('domainchecks.results.DatabaseBackend')
+        self.assertNotEqual(app['main'], 'statuspage')
+
+    def test_explicit_profile(self):
+        """Only PROCESS_TYPE picks the profile, not the command line."""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='statuspage.settings.dev')
+        env.pop('PROCESS_TYPE', None)
+        code = (
+            'import sys; sys.argv = ["manage.py", "checkdomains"]; '
+            'from django.conf import settings; print(settings.PROCESS_TYPE)')
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], env=env, cwd=settings.BASE_DIR)
+        self.assertEqual(output.decode('utf-8').strip(), 'web')
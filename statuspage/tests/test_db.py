@@ -0,0 +1,71 @@
+import time
+
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase, override_settings
+
+from .. import db
+
+
+@override_settings(
+    PROCESS_TYPE='worker', DATABASE_STATS_INTERVAL=60,
+    DATABASE_CONNECTIONS={'worker': {'max_age': 600, 'health_check': 30}})
+class CheckConnectionsTestCase(SimpleTestCase):
+    """Health checks for persistent connections."""
+
+    def setUp(self):
+        db.stats.clear()
+        self.connection = Mock(alias='default')
+        self.connection.is_usable.return_value = True
+        patched = patch('statuspage.db.connections')
+        self.connections = patched.start()
+        self.connections.all.return_value = [self.connection]
+        self.addCleanup(patched.stop)
+
+    def set_idle(self, seconds):
+        db._state.last_used = {'default': time.time() - seconds}
+
+    def test_recently_used(self):
+        """Connections used recently are reused without a ping."""
+        self.set_idle(5)
+        db.check_connections()
+        self.assertFalse(self.connection.is_usable.called)
+        self.assertEqual(db.stats['reused'], 1)
+
+    def test_idle(self):
+        """Idle connections are pinged before they are reused."""
+        self.set_idle(60)
+        db.check_connections()
+        self.assertTrue(self.connection.is_usable.called)
+        self.assertFalse(self.connection.close.called)
+
+    def test_broken(self):
+        """Broken connections are closed."""
+        self.set_idle(60)
+        self.connection.is_usable.return_value = False
+        db.check_connections()
+        self.connection.close.assert_called_once_with()
+        self.assertEqual(db.stats['broken'], 1)
+
+    def test_not_connected(self):
+        """Nothing is done for connections which aren't open."""
+        self.connection.connection = None
+        db.check_connections()
+        self.assertEqual(db.stats['reused'], 0)
+
+    def test_release(self):
+        """The last use of open connections is recorded."""
+        db.release_connections()
+        self.assertAlmostEqual(db._state.last_used['default'], time.time(), delta=1)
+
+    def test_log_stats(self):
+        """Counts are logged and reset once per interval."""
+        db.stats['opened'] = 3
+        with patch('statuspage.db.logger') as logger:
+            db._logged_on = time.time()
+            db.log_stats()
+            self.assertFalse(logger.info.called)
+            db._logged_on = time.time() - 120
+            db.log_stats()
+            self.assertEqual(logger.info.call_args[0][1:], ('worker', 3, 0, 0))
+        self.assertEqual(db.stats['opened'], 0)